@@ -1,26 +1,35 @@
 import os
+import hashlib
 import logging
-from typing import Optional
+import time
+from contextlib import ExitStack
+from functools import lru_cache
+from itertools import islice
+from typing import (
+    IO, Callable, Iterable, Iterator, Optional, Tuple, Union
+)
 import json
 from urllib.parse import urlparse, urljoin, urlunparse
-import requests
 
+import requests
 from lxml import etree
-from owslib.csw import CatalogueServiceWeb
-from owslib.ogcapi.records import Records
-from owslib.opensearch import OpenSearch
-from pycsw.core import metadata, repository, util
-import pycsw.core.admin
-import pycsw.core.config
-from pygeometa.core import read_mcf
-from pygeometa.schemas.iso19139 import ISO19139OutputSchema
+from pycsw.core import metadata
 from pystac import Item, Collection
-from pystac_client import Client
+from sqlalchemy import (
+    Column, MetaData, Table, Text, and_, literal, literal_column, select,
+    union_all
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from registrar.abc import Backend
 from registrar.source import Source
-from requests.exceptions import JSONDecodeError
 
-from .metadata import ISOMetadata, STACMetadata
+from . import (
+    catalogue, fetch, formats, harvest, metrics, registry, session, xmlstream
+)
+from .cache import DetectionCache
+from .metadata import ISOMetadata, STACMetadata, url_identifier
+from .pipeline import RegistrationPipeline
+from .profiling import Profiler, profiled
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +37,53 @@ THISDIR = os.path.dirname(__file__)
 
 COLLECTION_LEVEL_METADATA = f'{THISDIR}/resources'
 
+# version of the rendering of collection level metadata, hashed along with
+# the files so that their records are rendered again when it changes
+COLLECTION_LEVEL_METADATA_VERSION = '1'
+
+# table holding the digests of the source documents of records, see
+# `formats.digest`
+RECORD_DIGESTS_TABLE = 'registrar_record_digests'
+
+# attribute holding the digest of a parsed record until it is written
+DIGEST_ATTRIBUTE = '_registrar_digest'
+
+# table mapping the URLs of registered documents to their record identifiers
+SOURCES_TABLE = 'registrar_sources'
+
+# database dialects supporting INSERT ... ON CONFLICT DO UPDATE
+NATIVE_UPSERT_DIALECTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+# bind parameters a PostgreSQL statement may have
+POSTGRESQL_MAX_PARAMETERS = 32767
+
+
+@lru_cache()
+def list_collection_level_metadata() -> tuple:
+    return tuple(sorted(os.listdir(COLLECTION_LEVEL_METADATA)))
+
+
+def collection_level_metadata_version() -> str:
+    """ The version of the rendering of collection level metadata, made
+        of `COLLECTION_LEVEL_METADATA_VERSION` and the pygeometa version
+    """
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        pygeometa_version = version('pygeometa')
+    except PackageNotFoundError:
+        pygeometa_version = ''
+    return f'{COLLECTION_LEVEL_METADATA_VERSION}:{pygeometa_version}'
+
+
+def render_collection_level_metadata(path: str) -> str:
+    # pygeometa is only needed when collection level metadata changed
+    from pygeometa.core import read_mcf
+    from pygeometa.schemas.iso19139 import ISO19139OutputSchema
+    return ISO19139OutputSchema().write(read_mcf(path))
+
 
 def href_to_path(href):
     """ Gets the path component of a URL
@@ -40,130 +96,843 @@ class PycswMixIn:
     """ Helper MixIn, to add some common functions when dealing with PyCSW
     """
     def __init__(self, repository_database_uri, ows_url: str = '',
-                 public_s3_url: str = ''):
+                 public_s3_url: str = '', batch_size: int = 500,
+                 flush_interval: float = 5.0,
+                 fetch_max_size: int = fetch.MAX_SIZE, workers: int = 4,
+                 max_inflight_bytes: int = 64 * 1024 * 1024,
+                 detection_cache: Optional[str] = None,
+                 detection_cache_ttl: float = 3600,
+                 detection_cache_size: int = 10000,
+                 http_timeout: Optional[float] = None,
+                 http_pool_connections: Optional[int] = None,
+                 http_pool_maxsize: Optional[int] = None,
+                 profile_dir: Optional[str] = None,
+                 profile_fraction: Optional[float] = None,
+                 profile_pattern: Optional[str] = None,
+                 identifier_index: bool = False,
+                 identifier_index_capacity: int = 10_000_000,
+                 identifier_index_error_rate: float = 0.01,
+                 identifier_index_refresh: float = 60,
+                 pool_size: Optional[int] = None,
+                 max_overflow: Optional[int] = None,
+                 pool_pre_ping: bool = True,
+                 pool_recycle: Optional[int] = None,
+                 harvest: bool = False, harvest_workers: int = 4,
+                 harvest_page_size: int = 100,
+                 harvest_prune_unchanged: bool = False):
         self.collections = []
+        self.repository_database_uri = repository_database_uri
         self.ows_url = ows_url
         self.public_s3_url = public_s3_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fetch_max_size = fetch_max_size
+        self.workers = workers
+        self.max_inflight_bytes = max_inflight_bytes
+        self.harvest = harvest
+        self.harvest_workers = harvest_workers
+        self.harvest_page_size = harvest_page_size
+        self.harvest_prune_unchanged = harvest_prune_unchanged
+        if (http_timeout, http_pool_connections, http_pool_maxsize) != \
+                (None, None, None):
+            # the HTTP session is shared by all backends of the process,
+            # the first one configuring it sets it up
+            session.configure(
+                timeout=http_timeout or session.TIMEOUT,
+                pool_connections=http_pool_connections or
+                session.POOL_CONNECTIONS,
+                pool_maxsize=http_pool_maxsize or session.POOL_MAXSIZE
+            )
 
-        logger.debug('Setting up static context')
-        self.context = pycsw.core.config.StaticContext()
+        # opt-in profiling of registrations, see `Profiler.from_options`
+        self.profiler = Profiler.from_options(
+            profile_dir, profile_fraction, profile_pattern)
+
+        self.detection_cache = None
+        if detection_cache:
+            self.detection_cache = DetectionCache(
+                detection_cache, detection_cache_ttl, detection_cache_size)
+
+        # the backends of a process share the repository of a database
+        self.context, self.repo = registry.get_repository(
+            repository_database_uri, pool_size, max_overflow,
+            pool_pre_ping, pool_recycle)
+        self.record_digests = Table(
+            RECORD_DIGESTS_TABLE, MetaData(),
+            Column('identifier', Text, primary_key=True),
+            Column('digest', Text, nullable=False)
+        )
+        self.record_digests.create(self.repo.engine, checkfirst=True)
+        self.sources = Table(
+            SOURCES_TABLE, MetaData(),
+            Column('url', Text, primary_key=True),
+            Column('identifier', Text, primary_key=True)
+        )
+        self.sources.create(self.repo.engine, checkfirst=True)
+
+        self.identifier_index = None
+        if identifier_index:
+            self.identifier_index = registry.get_identifier_index(
+                repository_database_uri, identifier_index_capacity,
+                identifier_index_error_rate, identifier_index_refresh)
 
-        logger.debug('Initializing pycsw repository')
-        self.repo = repository.Repository(repository_database_uri,
-                                          self.context, table='records')
         logger.debug('Loading collection level metadata identifiers')
-        for clm in os.listdir(COLLECTION_LEVEL_METADATA):
+        for clm in list_collection_level_metadata():
             self.collections.append(os.path.splitext(clm)[0])
 
     def load_collection_level_metadata(self):
+        """ Renders and upserts the collection level metadata files whose
+            content or rendering changed since they were last loaded
+        """
         logger.debug('Loading collection level metadata')
-        for clm in os.listdir(COLLECTION_LEVEL_METADATA):
-            logger.debug(f'collection metadata file: {clm}')
-            clm_ = os.path.join(COLLECTION_LEVEL_METADATA, clm)
-            clm_mcf = read_mcf(clm_)
-            clm_iso = ISO19139OutputSchema().write(clm_mcf)
-            logger.debug(f'Upserting metadata: {clm_}')
-            self._parse_and_upsert_metadata(clm_iso)
-
-    def _parse_and_upsert_metadata(self, md: str):
+        version = collection_level_metadata_version().encode()
+        digests = {}
+        for clm in list_collection_level_metadata():
+            with open(os.path.join(COLLECTION_LEVEL_METADATA, clm), 'rb') as f:
+                digests[clm] = hashlib.sha256(
+                    version + b'\0' + f.read()).hexdigest()
+
+        identifiers = {clm: os.path.splitext(clm)[0] for clm in digests}
+        # only the digests of existing records are returned
+        stored = self._get_record_digests(list(identifiers.values()))
+        changed = [
+            clm for clm, digest in digests.items()
+            if stored.get(identifiers[clm]) != digest
+        ]
+        if not changed:
+            logger.info('Collection level metadata is up to date')
+            return
+
+        logger.info(f'Loading changed collection metadata files: {changed}')
+        paths = [
+            os.path.join(COLLECTION_LEVEL_METADATA, clm) for clm in changed
+        ]
+        if len(paths) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(min(len(paths), self.workers)) as pool:
+                rendered = list(
+                    pool.map(render_collection_level_metadata, paths))
+        else:
+            rendered = [render_collection_level_metadata(paths[0])]
+
+        records = []
+        for clm, iso in zip(changed, rendered):
+            record = self._parse_metadata(iso, formats.XML_CONTENT_TYPE)
+            # the digest of the file is stored with the record, in place
+            # of that of the rendered document
+            setattr(record, DIGEST_ATTRIBUTE, digests[clm])
+            records.append(record)
+        self._write_batch(records)
+
+    # converter branch of the backend, tags the profiles of registrations
+    converter_branch = ''
+
+    def _converter_branch(self, item) -> str:
+        return self.converter_branch
+
+    def _profile_identifier(self, item) -> str:
+        if isinstance(item, dict):
+            return str(item.get('identifier') or item.get('id')
+                       or item.get('url') or '')
+        return item.id
+
+    def _stage(self, name: str, converter: str = ''):
+        """ Times a stage of the registration in the metrics of the backend
+        """
+        return metrics.stage(type(self).__name__, name, converter)
+
+    def _convert(self, converter, *args, **kwargs):
+        """ Calls a converter of `ISOMetadata` or `STACMetadata`, timed
+            as a 'convert' stage labelled with the converter name
+        """
+        with self._stage('convert', converter.__name__):
+            return converter(*args, **kwargs)
+
+    def _fetch(self, href: str, source: Optional[Source]) -> bytes:
+        with self._stage('fetch'):
+            content = fetch.fetch(href, source, self.fetch_max_size)
+        metrics.fetched(type(self).__name__, len(content))
+        return content
+
+    def _query_ids(self, identifiers: list) -> list:
+        with self._stage('query_ids'):
+            return self.repo.query_ids(identifiers)
+
+    def _index(self, records: Iterable):
+        if self.identifier_index is not None:
+            self.identifier_index.update(r.identifier for r in records)
+
+    def _unindex(self, identifiers: Iterable[str]):
+        if self.identifier_index is not None:
+            for identifier in identifiers:
+                self.identifier_index.discard(identifier)
+
+    def _set_digests(self, digests: dict, connection=None):
+        """ Stores digests by identifier, within the transaction of
+            `connection`, a connection or session, if given
+        """
+        if not digests:
+            return
+        if connection is None:
+            with self.repo.engine.begin() as connection:
+                return self._set_digests(digests, connection)
+
+        table = self.record_digests
+        rows = [
+            {'identifier': identifier, 'digest': digest}
+            for identifier, digest in digests.items()
+        ]
+        insert = NATIVE_UPSERT_DIALECTS.get(self.repo.engine.dialect.name)
+        if insert is not None:
+            statement = insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=['identifier'],
+                set_={'digest': statement.excluded.digest}
+            )
+        else:
+            connection.execute(table.delete().where(
+                table.c.identifier.in_(list(digests))))
+            statement = table.insert()
+        connection.execute(statement, rows)
+
+    def _get_record_digests(self, identifiers: list) -> dict:
+        """ Gets the stored digests of the records that still exist
+        """
+        records = self.repo.dataset.__table__
+        identifier = records.c[
+            self.context.md_core_model['mappings']['pycsw:Identifier']]
+        query = select([self.record_digests]).select_from(
+            self.record_digests.join(
+                records, identifier == self.record_digests.c.identifier)
+        ).where(self.record_digests.c.identifier.in_(identifiers))
+        with self._stage('query_ids'):
+            with self.repo.engine.connect() as connection:
+                return {
+                    row.identifier: row.digest
+                    for row in connection.execute(query)
+                }
+
+    def _take_digests(self, records: list) -> dict:
+        """ Detaches the digests from parsed records, they would be
+            taken for columns of the records table otherwise
+        """
+        digests = {}
+        for record in records:
+            digest = record.__dict__.pop(DIGEST_ATTRIBUTE, None)
+            if digest is not None:
+                digests[record.identifier] = digest
+        return digests
+
+    def _changed(self, records: list, digests: dict) -> list:
+        """ Filters out the existing records whose source document did
+            not change since they were written
+        """
+        if not digests:
+            return records
+        stored = self._get_record_digests(list(digests))
+        return [
+            record for record in records
+            if record.identifier not in digests
+            or stored.get(record.identifier) != digests[record.identifier]
+        ]
+
+    def _set_source_identifiers(self, url: str, identifiers: Iterable[str]):
+        """ Records the identifiers of the records registered from the
+            document at the URL, replacing those of earlier registrations
+        """
+        rows = [
+            {'url': url, 'identifier': identifier}
+            for identifier in dict.fromkeys(identifiers)
+        ]
+        with self.repo.engine.begin() as connection:
+            connection.execute(
+                self.sources.delete().where(self.sources.c.url == url))
+            if rows:
+                connection.execute(self.sources.insert(), rows)
+
+    def _exists_all(self, identifiers: list) -> bool:
+        """ Checks that records with all the identifiers exist, with at
+            most one query
+        """
+        identifiers = list(dict.fromkeys(identifiers))
+        if not identifiers:
+            return False
+        if self.identifier_index is not None and len(
+                self.identifier_index.candidates(identifiers)
+        ) < len(identifiers):
+            return False
+        exists = len(self._query_ids(identifiers)) == len(identifiers)
+        logger.info(
+            f'Identifiers {identifiers} '
+            f'{"exist" if exists else "do not exist"}'
+        )
+        return exists
+
+    def _exists_source(self, url: str, *fallback: str) -> bool:
+        """ Checks for the records registered from the document at the
+            URL, or else for records with the `fallback` identifiers, with
+            one query
+        """
+        records = self.repo.dataset.__table__
+        identifier = records.c[
+            self.context.md_core_model['mappings']['pycsw:Identifier']]
+        # the identifiers recorded for the URL along with the identifier
+        # of their record if it exists, then the existing fallback ones
+        query = select([
+            self.sources.c.identifier, identifier.label('found'),
+            literal(True).label('recorded')
+        ]).select_from(
+            self.sources.outerjoin(
+                records, identifier == self.sources.c.identifier)
+        ).where(self.sources.c.url == url)
+        fallback = list(dict.fromkeys(fallback))
+        if fallback:
+            query = union_all(query, select([
+                identifier, identifier, literal(False)
+            ]).where(identifier.in_(fallback)))
+
+        with self._stage('query_ids'):
+            with self.repo.engine.connect() as connection:
+                rows = connection.execute(query).fetchall()
+
+        recorded = [row for row in rows if row.recorded]
+        if recorded:
+            exists = all(row.found is not None for row in recorded)
+        else:
+            exists = bool(fallback) and len(rows) == len(fallback)
+        logger.info(f'Records of {url} exist: {exists}')
+        return exists
+
+    def _parse_metadata(self, md: Union[bytes, str],
+                        content_type: Optional[str] = None):
         logger.debug('Parsing metadata')
         try:
-            metadata_record = json.loads(md)
-            metadata_format = 'json'
-        except json.decoder.JSONDecodeError:
-            try:
-                metadata_record = etree.fromstring(md)
-            except:
-                metadata_record = etree.fromstring(bytes(md, encoding='utf-8'))
-            metadata_format = 'xml'
+            metadata_format, metadata_record = formats.parse_document(
+                md, content_type)
         except Exception as err:
             logger.error(f'Metadata parsing failed: {err}')
+            metrics.STAGE_FAILURES.labels(
+                type(self).__name__, 'parse_record', '').inc()
             raise
 
+        return self._parse_record(metadata_record, metadata_format)
+
+    def _parse_record(self, metadata_record,
+                      metadata_format: str = formats.XML):
         logger.debug('Processing metadata')
         try:
-            record = metadata.parse_record(
-                self.context, metadata_record, self.repo)[0]
-            if metadata_format == 'xml':
+            with self._stage('parse_record'):
+                digest = formats.digest(metadata_format, metadata_record)
+                record = metadata.parse_record(
+                    self.context, metadata_record, self.repo)[0]
+                setattr(record, DIGEST_ATTRIBUTE, digest)
+            if metadata_format == formats.XML:
                 record.xml = record.xml.decode()
             logger.info(f"identifier: {record.identifier}")
         except Exception as err:
             logger.error(f'Metadata parsing failed: {err}')
             raise
 
-        if self.repo.query_ids([record.identifier]):
-            logger.info('Updating record')
-            try:
-                self.repo.update(record)
-                logger.info('record updated')
-            except Exception as err:
-                logger.error(f'record update failed: {err}')
-                raise
+        return record
+
+    def _parse_and_upsert_metadata(self, md: Union[bytes, str],
+                                   content_type: Optional[str] = None,
+                                   replace: bool = False):
+        """ Parses a metadata document, given as bytes or text along with
+            its content type if known, and upserts its record. The record
+            is rewritten even if unchanged when replacing.
+        """
+        return self._upsert_record(
+            self._parse_metadata(md, content_type), replace)
+
+    def _upsert_record(self, record, replace: bool = False):
+        digests = self._take_digests([record])
+        if not replace and not self._changed([record], digests):
+            logger.info('record unchanged')
+            metrics.written(type(self).__name__, 'skipped')
+            return record
+
+        self._write_records([record], digests=digests)
+        return record
+
+    def upsert_many(self, records: Iterable[Union[bytes, str]],
+                    content_type: Optional[str] = None,
+                    replace: bool = False) -> int:
+        """ Parses and upserts metadata documents in batches. A batch is
+            written once it holds `batch_size` records or `flush_interval`
+            seconds have passed since the last write, whichever comes
+            first. Unchanged records are skipped unless replacing. Returns
+            the number of records written or found unchanged.
+        """
+        return self._upsert_batched(
+            (self._parse_metadata(md, content_type) for md in records),
+            replace=replace
+        )
+
+    def upsert_stream(self, f: IO[bytes],
+                      identifiers: Optional[list] = None,
+                      replace: bool = False) -> int:
+        """ Splits an XML document holding any number of metadata records
+            and upserts them in batches while it is being parsed. Records
+            that fail to parse are logged and skipped. The identifiers of
+            the written records are appended to `identifiers` if given.
+            Returns the number of records written or found unchanged.
+        """
+        return self.upsert_elements(
+            xmlstream.iter_records(f), identifiers, replace)
+
+    def upsert_elements(self, elements: Iterable,
+                        identifiers: Optional[list] = None,
+                        replace: bool = False) -> int:
+        """ Upserts parsed XML metadata records in batches, like
+            `upsert_stream`
+        """
+        def parsed_records():
+            for element in elements:
+                try:
+                    yield self._parse_record(element)
+                except Exception:
+                    # already logged
+                    continue
+
+        return self._upsert_batched(parsed_records(), identifiers, replace)
+
+    def _upsert_batched(self, records: Iterable,
+                        identifiers: Optional[list] = None,
+                        replace: bool = False) -> int:
+        batch = []
+        written = 0
+        last_flush = time.monotonic()
+        for record in records:
+            batch.append(record)
+            if identifiers is not None:
+                identifiers.append(record.identifier)
+            if (len(batch) >= self.batch_size
+                    or time.monotonic() - last_flush >= self.flush_interval):
+                written += self._write_batch(batch, replace=replace)
+                batch = []
+                last_flush = time.monotonic()
+
+        if batch:
+            written += self._write_batch(batch, replace=replace)
+
+        return written
+
+    def _write_batch(self, records: list, stale=None,
+                     replace: bool = False) -> int:
+        """ Writes the parsed records whose source document changed, or
+            all of them when replacing. Records matching the `stale` filter
+            criterion, if given, are deleted in the same transaction.
+            Returns the number of records written or found unchanged.
+        """
+        # the last occurrence of an identifier within a batch wins
+        records = list({r.identifier: r for r in records}.values())
+        digests = self._take_digests(records)
+        changed = records if replace else self._changed(records, digests)
+        skipped = len(records) - len(changed)
+        if skipped:
+            logger.info(f'Skipping {skipped} unchanged records')
+            metrics.written(type(self).__name__, 'skipped', skipped)
+
+        if not changed:
+            if stale is not None:
+                self._delete_stale(stale)
         else:
-            logger.info('Inserting record')
-            try:
-                self.repo.insert(record, 'local', util.get_today_and_now())
-                logger.info('record inserted')
-            except Exception as err:
-                logger.error(f'record insertion failed: {err}')
-                raise
+            self._write_records(changed, stale, {
+                record.identifier: digests[record.identifier]
+                for record in changed if record.identifier in digests
+            })
+        return len(records)
+
+    def _write_records(self, records: list, stale=None,
+                       digests: Optional[dict] = None):
+        """ Writes parsed records in a single transaction, using one
+            `IN` query to split them into inserts and updates. The digests
+            of their source documents are stored in the same transaction.
+        """
+        if self._native_upsert(records, stale, digests):
+            logger.info(f'Upserted batch of {len(records)} records')
+            return
+
+        existing = {
+            row.identifier
+            for row in self._query_ids([r.identifier for r in records])
+        }
+        logger.info(
+            f'Writing batch of {len(records)} records '
+            f'({len(existing)} updates)'
+        )
+
+        session = self.repo.session
+        # inserts and updates share a transaction, time them as a whole
+        stage = 'update' if len(existing) == len(records) else 'insert'
+        try:
+            session.begin()
+            for record in records:
+                if record.identifier in existing:
+                    values = {
+                        getattr(self.repo.dataset, key): getattr(record, key)
+                        for key in record.__dict__.keys()
+                        if key != '_sa_instance_state'
+                    }
+                    session.query(self.repo.dataset).filter_by(
+                        identifier=record.identifier
+                    ).update(values, synchronize_session=False)
+                else:
+                    session.add(record)
+            deleted = self._delete_where(session, stale)
+            self._set_digests(digests, session)
+            with self._stage(stage):
+                session.commit()
+        except Exception as err:
+            session.rollback()
+            logger.error(f'batch upsert failed: {err}')
+            raise
+
+        metrics.written(type(self).__name__, 'updated', len(existing))
+        metrics.written(
+            type(self).__name__, 'inserted', len(records) - len(existing))
+        metrics.written(type(self).__name__, 'deleted', deleted)
+        self._index(records)
+
+    def _delete_where(self, session, criterion) -> int:
+        """ Deletes the records matching a filter criterion within the
+            current transaction of the session
+        """
+        if criterion is None:
+            return 0
+        with self._stage('delete'):
+            deleted = session.query(self.repo.dataset).filter(
+                criterion).delete(synchronize_session=False)
+        if deleted:
+            logger.info(f'Deleting {deleted} stale records')
+        return deleted
+
+    def _delete_stale(self, criterion):
+        session = self.repo.session
+        try:
+            session.begin()
+            deleted = self._delete_where(session, criterion)
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            logger.error(f'delete failed: {err}')
+            raise
+        metrics.written(type(self).__name__, 'deleted', deleted)
+
+    def deregister_many(self, identifiers: Optional[Iterable[str]] = None,
+                        parent_identifier: Optional[str] = None,
+                        start: Optional[str] = None,
+                        end: Optional[str] = None,
+                        chunk_size: Optional[int] = None,
+                        progress: Optional[Callable[[int, int], None]] = None
+                        ) -> int:
+        """ Deletes the records with the given identifiers, or the records
+            selected by their parent identifier and/or the start of their
+            temporal extent (`start` <= begin < `end`, as ISO 8601 strings).
+
+            Records are deleted in chunks of `chunk_size`, `batch_size` by
+            default, each in a short transaction of its own. After each
+            chunk `progress` is called with the number of identifiers
+            processed and of records deleted so far. Unlike
+            `deregister_identifier`, child records are not deleted along
+            with their parents, purge them by `parent_identifier`.
+            Returns the number of records deleted.
+        """
+        selector = (parent_identifier, start, end) != (None, None, None)
+        if (identifiers is None) == (not selector):
+            raise ValueError(
+                'Either identifiers or a parent identifier/date range '
+                'selector are required'
+            )
+        chunk_size = chunk_size or self.batch_size
+
+        if identifiers is not None:
+            identifiers = iter(identifiers)
+            chunks = (
+                self._resolve_identifiers(chunk) for chunk in iter(
+                    lambda: list(islice(identifiers, chunk_size)), [])
+            )
+        else:
+            chunks = self._select_identifiers(
+                parent_identifier, start, end, chunk_size)
+
+        processed = 0
+        deleted = 0
+        for chunk in chunks:
+            deleted += self._delete_identifiers(chunk)
+            processed += len(chunk)
+            logger.info(f'Deleted {deleted} records, {processed} processed')
+            if progress is not None:
+                progress(processed, deleted)
+
+        return deleted
+
+    def _resolve_identifiers(self, identifiers: list) -> list:
+        """ Maps identifiers to the ones of the records to delete
+        """
+        return identifiers
+
+    def _column(self, name: str):
+        return getattr(self.repo.dataset,
+                       self.context.md_core_model['mappings'][name])
+
+    def _select_identifiers(self, parent_identifier: Optional[str],
+                            start: Optional[str], end: Optional[str],
+                            chunk_size: int) -> Iterator[list]:
+        """ Yields the identifiers of the selected records in chunks,
+            paging by identifier so each chunk is a short indexed query
+        """
+        identifier = self._column('pycsw:Identifier')
+        query = self.repo.session.query(identifier)
+        if parent_identifier is not None:
+            query = query.filter(
+                self._column('pycsw:ParentIdentifier') == parent_identifier)
+        if start is not None:
+            query = query.filter(
+                self._column('pycsw:TempExtent_begin') >= start)
+        if end is not None:
+            query = query.filter(self._column('pycsw:TempExtent_begin') < end)
+
+        last = None
+        while True:
+            page = query
+            if last is not None:
+                page = page.filter(identifier > last)
+            with self._stage('query_ids'):
+                chunk = [
+                    row[0] for row in
+                    page.order_by(identifier).limit(chunk_size).all()
+                ]
+            if not chunk:
+                return
+            yield chunk
+            last = chunk[-1]
+
+    def _delete_identifiers(self, identifiers: list) -> int:
+        session = self.repo.session
+        try:
+            with self._stage('delete'):
+                session.begin()
+                rows = session.query(self.repo.dataset).filter(
+                    self._column('pycsw:Identifier').in_(identifiers)
+                ).delete(synchronize_session=False)
+                session.commit()
+        except Exception as err:
+            session.rollback()
+            logger.error(f'delete failed: {err}')
+            raise
+
+        self._unindex(identifiers)
+        metrics.written(type(self).__name__, 'deleted', rows)
+        return rows
+
+    def _revalidate(self, url: str, replace: bool = False
+                    ) -> Tuple[bool, Optional[requests.Response]]:
+        """ Checks the detection cache for an unchanged, still registered
+            service at the URL, along with the response of the conditional
+            request made to revalidate its entry, if any. A replacing
+            registration bypasses the cache.
+        """
+        if self.detection_cache is None or replace:
+            return False, None
+        entry = self.detection_cache.get(url)
+        if entry is None or not self._query_ids([entry['identifier']]):
+            return False, None
+        return self.detection_cache.revalidate(entry)
+
+    def _native_upsert(self, records: list, stale=None,
+                       digests: Optional[dict] = None) -> bool:
+        """ Writes records with a single INSERT ... ON CONFLICT DO UPDATE
+            statement keyed on the identifier, and deletes the records
+            matching the `stale` filter criterion and stores the `digests`
+            of their source documents in the same transaction.
+            Returns False without writing anything if the database dialect
+            does not support it.
+
+            The written records are counted as inserted or updated: on
+            PostgreSQL from the `xmax = 0` of the rows the statement
+            returns, elsewhere from the identifiers that already existed
+            when the transaction began.
+        """
+        dialect = self.repo.engine.dialect.name
+        insert = NATIVE_UPSERT_DIALECTS.get(dialect)
+        if insert is None:
+            return False
+
+        identifier = self.context.md_core_model['mappings']['pycsw:Identifier']
+        table = self.repo.dataset.__table__
+        columns = []
+        # keyed on the identifier, a row may only be upserted once
+        rows = {}
+        for record in records:
+            row = {
+                key: value for key, value in record.__dict__.items()
+                if key != '_sa_instance_state'
+            }
+            columns.extend(key for key in row if key not in columns)
+            rows[row[identifier]] = row
+
+        # executemany requires the same columns on every row
+        rows = [
+            {column: row.get(column) for column in columns}
+            for row in rows.values()
+        ]
+
+        session = self.repo.session
+        try:
+            with self._stage('upsert'):
+                session.begin()
+                if dialect == 'postgresql':
+                    inserted = 0
+                    # multi-row VALUES, within the bind parameter limit
+                    size = max(1, POSTGRESQL_MAX_PARAMETERS // len(columns))
+                    for start in range(0, len(rows), size):
+                        statement = self._upsert_statement(
+                            insert(table).values(rows[start:start + size]),
+                            identifier, columns
+                        ).returning(
+                            # xmax is 0 on the rows the INSERT created
+                            literal_column('xmax = 0').label('inserted')
+                        )
+                        inserted += sum(
+                            1 for row in session.execute(statement)
+                            if row.inserted
+                        )
+                else:
+                    existing = session.execute(
+                        select([table.c[identifier]]).where(
+                            table.c[identifier].in_(
+                                [row[identifier] for row in rows]))
+                    ).fetchall()
+                    inserted = len(rows) - len(existing)
+                    session.execute(
+                        self._upsert_statement(
+                            insert(table), identifier, columns),
+                        rows
+                    )
+                deleted = self._delete_where(session, stale)
+                self._set_digests(digests, session)
+                session.commit()
+        except Exception as err:
+            session.rollback()
+            logger.error(f'record upsert failed: {err}')
+            raise
+
+        metrics.written(type(self).__name__, 'inserted', inserted)
+        metrics.written(type(self).__name__, 'updated', len(rows) - inserted)
+        metrics.written(type(self).__name__, 'deleted', deleted)
+        self._index(records)
+        return True
 
-        return
+    @staticmethod
+    def _upsert_statement(statement, identifier: str, columns: list):
+        return statement.on_conflict_do_update(
+            index_elements=[identifier],
+            set_={
+                column: statement.excluded[column]
+                for column in columns if column != identifier
+            }
+        )
 
 
 class ItemBackend(Backend[Item], PycswMixIn):
     def exists(self, source: Source, item: Item) -> bool:
         # TODO: sort out identifier problem in ISO XML
         logger.info(f'Checking for identifier {item.id}')
-        if self.repo.query_ids([item.id]):
+        if self.identifier_index is not None \
+                and item.id not in self.identifier_index:
+            logger.info(f'Identifier {item.id} does not exist')
+            return False
+        if self._query_ids([item.id]):
             logger.info(f'Identifier {item.id} exists')
             return True
         else:
             logger.info(f'Identifier {item.id} does not exist')
             return False
 
+    def existing_identifiers(self, identifiers: Iterable[str]) -> set:
+        """ Returns which of the identifiers exist in the repository,
+            with a single query for those the identifier index does not
+            rule out
+        """
+        candidates = list(identifiers)
+        if self.identifier_index is not None:
+            candidates = self.identifier_index.candidates(candidates)
+        if not candidates:
+            return set()
+        return {row.identifier for row in self._query_ids(candidates)}
+
+    def _converter_branch(self, item: Item) -> str:
+        assets = item.get_assets()
+        if 'inspire-metadata' in assets and 'product-metadata' in assets:
+            return 'sentinel'
+        elif 'iso-metadata' in assets:
+            return 'iso'
+        elif 'MTL.xml' in assets:
+            return 'landsat'
+        return 'stac'
+
+    @profiled
     def register(self, source: Source, item: Item, replace: bool):
+        metadata = self.get_metadata(source, item)
+        logger.debug(f'Upserting metadata: {metadata}')
+        self._parse_and_upsert_metadata(metadata, replace=replace)
+
+    def register_many(self, source: Source, items: Iterable[Item]) -> list:
+        """ Registers items concurrently through a RegistrationPipeline.
+            Returns the identifiers that failed to register.
+        """
+        with RegistrationPipeline(self, self.workers,
+                                  self.max_inflight_bytes) as pipeline:
+            for item in items:
+                pipeline.register(source, item)
+        return pipeline.failed
+
+    def get_metadata(self, source: Source, item: Item):
+        """ Fetches and converts the metadata of an item, without touching
+            the repository
+        """
         logger.info('Ingesting product')
 
         assets = item.get_assets()
+        branch = self._converter_branch(item)
 
         # ESA metadata (Sentinel)
-        if 'inspire-metadata' in assets and 'product-metadata' in assets:
+        if branch == 'sentinel':
             inspire_xml = assets['inspire-metadata'].href
             logger.info('Ingesting Sentinel 2 STAC Item')
             # logger.info(f'asset href: {inspire_xml}')
             base_url = f'{os.path.dirname(inspire_xml)}'
             # logger.info(f'base_url: {base_url}')
             imo = STACMetadata(base_url)
-            metadata = imo.from_stac_item(
+            metadata = self._convert(
+                imo.from_stac_item,
                 json.dumps(item.to_dict(transform_hrefs=False)),
                 self.ows_url
             )
 
         # ISO metadata
-        elif 'iso-metadata' in assets:
+        elif branch == 'iso':
             iso_xml = assets['iso-metadata'].href
-            iso_xml_local = '/tmp/iso-metadata.xml'
 
             logger.info(f"Ingesting ISO XML metadata file: {iso_xml}")
 
             try:
-                source.get_file(iso_xml, iso_xml_local)
+                metadata = self._fetch(iso_xml, source)
             except Exception as err:
                 logger.error(err)
                 raise
 
-            with open(iso_xml_local, 'r') as a:
-                metadata = a.read()
-
         # Landsat
-        elif 'MTL.xml' in assets:
+        elif branch == 'landsat':
             logger.info('Ingesting Landsat STAC Item')
             mtl_xml = assets['MTL.xml'].href
             base_url = mtl_xml[:mtl_xml.rfind("/")]
             logger.debug(f'base URL {base_url}')
             imo = STACMetadata(base_url)
-            metadata = imo.from_stac_item(
+            metadata = self._convert(
+                imo.from_stac_item,
                 json.dumps(item.to_dict(transform_hrefs=False)),
                 self.ows_url
             )
@@ -181,21 +950,29 @@ class ItemBackend(Backend[Item], PycswMixIn):
 
             logger.debug(f'base URL {base_url}')
             imo = STACMetadata(base_url)
-            metadata = imo.from_stac_item(
+            metadata = self._convert(
+                imo.from_stac_item,
                 json.dumps(item.to_dict(transform_hrefs=False)),
                 self.ows_url
             )
 
-        logger.debug(f'Upserting metadata: {metadata}')
-        self._parse_and_upsert_metadata(metadata)
+        return metadata
 
     def deregister(self, source: Optional[Source], item: Item):
         self.deregister_identifier(item.id)
 
+    def _resolve_identifiers(self, identifiers: list) -> list:
+        # same as deregister_identifier, with one query per chunk
+        existing = {row.identifier for row in self._query_ids(identifiers)}
+        return [
+            identifier if identifier in existing else f'{identifier}.SAFE'
+            for identifier in identifiers
+        ]
+
     def deregister_identifier(self, identifier: str):
         logger.info(f'Deleting record {identifier}')
         # TODO: identifier alignment required with other components
-        if self.repo.query_ids([identifier]):
+        if self._query_ids([identifier]):
             logger.debug('found matching identifier')
             identifier = identifier
         else:
@@ -208,7 +985,10 @@ class ItemBackend(Backend[Item], PycswMixIn):
             'where': 'identifier = :pvalue0'
         }
         try:
-            rows = self.repo.delete(constraint)
+            with self._stage('delete'):
+                rows = self.repo.delete(constraint)
+            self._unindex([identifier])
+            metrics.written(type(self).__name__, 'deleted', rows)
             logger.info(f'{rows} records deleted')
         except Exception as err:
             logger.error(f'delete failed: {err}')
@@ -218,35 +998,38 @@ class ItemBackend(Backend[Item], PycswMixIn):
 
 
 class CWLBackend(Backend[dict], PycswMixIn):
+    converter_branch = 'cwl'
+
     def exists(self, source: Optional[Source], item: dict) -> bool:
-        pass
+        # the identifier is taken from the CWL document when registering
+        return self._exists_source(
+            item['url'], *filter(None, [item.get('identifier')]))
 
+    @profiled
     def register(self, source: Optional[Source], item: dict, replace: bool):
         logger.info('Ingesting CWL')
-        cwl_local = '/tmp/cwl.yaml'
 
         path = item["url"]
-        source.get_file(path, cwl_local)
-        with open(cwl_local) as f:
-            logger.debug(f'base URL {path}')
-            base_url = f's3://{path}'
-            imo = ISOMetadata(base_url)
-            parsed = urlparse(self.public_s3_url)
-            if len(parsed.path.split(':')) > 1:
-                new_path = parsed.path.split(':')[0] + ':' + path
-            else:
-                new_path = os.path.join(parsed.path, path)
-            new_scheme = f'{parsed.scheme}://{parsed.netloc}'
-            public_url = urljoin(new_scheme, new_path)
-            iso_metadata = imo.from_cwl(
-                f.read(), public_url, item.get("parent_identifier")
-            )
-
-        logger.debug(f"Removing temporary file {cwl_local}")
+        cwl = self._fetch(path, source)
+        logger.debug(f'base URL {path}')
+        base_url = f's3://{path}'
+        imo = ISOMetadata(base_url)
+        parsed = urlparse(self.public_s3_url)
+        if len(parsed.path.split(':')) > 1:
+            new_path = parsed.path.split(':')[0] + ':' + path
+        else:
+            new_path = os.path.join(parsed.path, path)
+        new_scheme = f'{parsed.scheme}://{parsed.netloc}'
+        public_url = urljoin(new_scheme, new_path)
+        iso_metadata = self._convert(
+            imo.from_cwl,
+            cwl.decode(), public_url, item.get("parent_identifier")
+        )
 
-        os.remove(cwl_local)
         logger.debug(f'Upserting metadata: {iso_metadata}')
-        self._parse_and_upsert_metadata(iso_metadata)
+        record = self._parse_and_upsert_metadata(
+            iso_metadata, formats.XML_CONTENT_TYPE, replace)
+        self._set_source_identifiers(path, [record.identifier])
 
     def deregister(self, source: Optional[Source], item: dict):
         pass
@@ -256,9 +1039,12 @@ class CWLBackend(Backend[dict], PycswMixIn):
 
 
 class ADESBackend(Backend[dict], PycswMixIn):
+    converter_branch = 'oaproc'
+
     def exists(self, source: Optional[Source], item: dict) -> bool:
-        pass
+        return self._exists_all([url_identifier(item['url'])])
 
+    @profiled
     def register(self, source: Optional[Source], item: dict, replace: bool):
         if (item["type"] == 'ades'):
             logger.info('Ingesting ADES')
@@ -266,12 +1052,66 @@ class ADESBackend(Backend[dict], PycswMixIn):
             logger.info('Ingesting OGC API - Processes')
         base_url = item["url"]
         logger.debug(f'base URL {base_url}')
+        unchanged, response = self._revalidate(base_url, replace)
+        if unchanged:
+            logger.info(f'{base_url} is unchanged, skipping')
+            return
+
         imo = ISOMetadata(base_url)
-        iso_metadata_records = imo.from_oaproc(
-            item.get("parent_identifier"), item.get("type"))
-        for iso_metadata in iso_metadata_records:
-            logger.debug(f'Upserting metadata: {iso_metadata}')
-            self._parse_and_upsert_metadata(iso_metadata)
+        # the process list changes on (un)deployment of processes, it is
+        # fetched once, if revalidating the cache entry did not already,
+        # for the process records and the cache entry
+        if response is None and (
+                self.detection_cache is not None or item["type"] != 'ades'):
+            response = session.get_session().get(
+                urljoin(imo.base_url, 'processes'),
+                headers=session.JSON_HEADERS)
+            response.raise_for_status()
+        processes = None
+        if response is not None:
+            processes = response.json()['processes']
+
+        self.sync_oaproc(
+            imo, item.get("parent_identifier"), item.get("type"), processes,
+            replace)
+
+        if self.detection_cache is not None:
+            self.detection_cache.put(
+                base_url, item["type"], url_identifier(base_url), response)
+
+    def sync_oaproc(self, imo: ISOMetadata,
+                    parent_identifier: Optional[str] = None,
+                    registration_type: Optional[str] = None,
+                    processes: Optional[list] = None,
+                    replace: bool = False) -> int:
+        """ Registers an OGC API - Processes service and its processes,
+            listed in `processes` if already fetched. The process records
+            are parsed as their descriptions arrive and written in one
+            transaction, which also deletes the records of processes no
+            longer offered. Unchanged records are skipped unless replacing.
+            Returns the number of records written or found unchanged.
+        """
+        oaproc_id = url_identifier(imo.base_url)
+        records = []
+        # the converter fetches the process descriptions itself
+        with self._stage('convert', 'from_oaproc'):
+            for iso_metadata in imo.iter_oaproc(
+                    parent_identifier, registration_type, self.workers,
+                    processes):
+                records.append(self._parse_metadata(
+                    iso_metadata, formats.XML_CONTENT_TYPE))
+
+        stale = None
+        if registration_type != 'ades':
+            identifier = self._column('pycsw:Identifier')
+            stale = and_(
+                self._column('pycsw:ParentIdentifier') == oaproc_id,
+                identifier.startswith(f'{oaproc_id}-', autoescape=True),
+                identifier.notin_([record.identifier for record in records])
+            )
+
+        logger.debug(f'Upserting {len(records)} records')
+        return self._write_batch(records, stale, replace)
 
     def deregister(self, source: Optional[Source], item: dict):
         pass
@@ -281,17 +1121,23 @@ class ADESBackend(Backend[dict], PycswMixIn):
 
 
 class CollectionBackend(Backend[Collection], PycswMixIn):
-    def exists(self, source: Optional[Source], item: dict) -> bool:
-        pass
+    converter_branch = 'stac_collection'
 
+    def exists(self, source: Optional[Source], item: Collection) -> bool:
+        identifier = item['id'] if isinstance(item, dict) else item.id
+        return self._exists_all([identifier])
+
+    @profiled
     def register(
         self, source: Optional[Source], item: Collection, replace: bool
     ):
         logger.info('Ingesting Collection')
         imo = STACMetadata("")
-        metadata = imo.from_stac_collection(item.to_dict(False, False))
+        metadata = self._convert(
+            imo.from_stac_collection, item.to_dict(False, False))
         logger.info(f'Upserting metadata: {metadata}')
-        self._parse_and_upsert_metadata(metadata)
+        self._parse_and_upsert_metadata(
+            metadata, formats.JSON_CONTENT_TYPE, replace)
 
     def deregister(self, source: Optional[Source], item: Collection):
         pass
@@ -301,63 +1147,134 @@ class CollectionBackend(Backend[Collection], PycswMixIn):
 
 
 class CatalogueBackend(Backend[dict], PycswMixIn):
+    converter_branch = 'catalogue'
+
     def exists(self, source: Optional[Source], item: dict) -> bool:
-        pass
+        # a harvested catalogue is registered again for new records, its
+        # unchanged service record is skipped all the same
+        if item.get('harvest', self.harvest):
+            return False
+        # STAC catalogs are registered under their own id, the other
+        # services under the one derived from their URL
+        return self._exists_source(item['url'], url_identifier(item['url']))
 
+    @profiled
     def register(
         self, source: Optional[Source], item: Collection, replace: bool
     ):
         logger.info('Ingesting Catalogue')
-        # OARec
-        # CSW2
-        # CSW3
-        # STAC API
-        # OpenSearch
 
         base_url = item['url']
-        imo = ISOMetadata(base_url)
-        metadata = None
-
-        try:
-            is_stac_api = False
-            c = Records(base_url)
-            logger.info('Detected OGC API - Records')
+        harvest_records = item.get('harvest', self.harvest)
+        if self._revalidate(base_url, replace)[0]:
+            logger.info(f'{base_url} is unchanged, skipping')
+            if harvest_records:
+                # the content may have changed all the same
+                self._harvest(base_url, item)
+            return
 
-            try:
-                client = Client.open(base_url)
-                logger.info('Detected STAC API')
-                is_stac_api = True
-            except:
-                logger.info('STAC API client failed')
-
-            # if 'stac_version' in c.response:
-            #     logger.info('Detected STAC API')
-            #     is_stac_api = True
-
-            metadata = imo.from_oarec(c.response, is_stac_api=is_stac_api)
+        imo = ISOMetadata(base_url)
 
-        except JSONDecodeError:
-            try:
-                c = CatalogueServiceWeb(base_url)
-                logger.info('Detected OGC CSW')
-                metadata = imo.from_csw()
-            except etree.XMLSyntaxError:
-                try:
-                    client = Client.open(base_url)
-                    logger.info('Detected STAC Catalog')
-                    metadata = imo.from_stac_catalog(base_url)
-                except JSONDecodeError:
-                    logger.info('All catalogue clients failed')
-            except RuntimeError:
-                try:
-                    osearch = OpenSearch(base_url)
-                    logger.info('Detected OpenSearch Catalog')
-                    metadata = imo.from_opensearch(base_url)
-                except:
-                    logger.info('All catalogue clients failed')
+        # OARec, STAC API, STAC Catalog, CSW and OpenSearch are probed
+        # concurrently, the fetched document is reused for the conversion
+        with self._stage('fetch'):
+            service_type, document, response = catalogue.detect(base_url)
+        if response is not None:
+            metrics.fetched(type(self).__name__, len(response.content))
+
+        if service_type in ('oarec', 'stac_api'):
+            metadata = self._convert(
+                imo.from_oarec, document,
+                is_stac_api=service_type == 'stac_api')
+        elif service_type == 'stac_catalog':
+            metadata = self._convert(
+                imo.from_stac_catalog, base_url, document)
+        elif service_type == 'csw':
+            metadata = self._convert(imo.from_csw, document)
+        elif service_type == 'opensearch':
+            metadata = self._convert(
+                imo.from_opensearch, base_url, document)
+        else:
+            logger.info('All catalogue clients failed')
+            raise ValueError(f'No supported catalogue found at {base_url}')
 
         logger.info(f'Upserting metadata: {metadata}')
-        self._parse_and_upsert_metadata(metadata)
+        record = self._parse_and_upsert_metadata(
+            metadata, formats.XML_CONTENT_TYPE, replace)
+
+        self._set_source_identifiers(base_url, [record.identifier])
+
+        if self.detection_cache is not None:
+            self.detection_cache.put(
+                base_url, service_type, record.identifier, response)
+
+        if harvest_records:
+            self._harvest(base_url, item, service_type, document)
+
+    def _harvest(self, base_url: str, item: dict,
+                 service_type: Optional[str] = None, document=None) -> int:
+        """ Harvests the records of a catalogue, for the catalogue types
+            supporting it. Returns the number of records harvested.
+        """
+        if service_type is None:
+            service_type = self.detection_cache.get(base_url)['service_type']
+
+        if service_type == 'stac_api':
+            harvester = harvest.StacApiHarvester(
+                self._shared_backend(ItemBackend),
+                harvest.Checkpoints(self.repo.engine),
+                base_url, document or session.get_json(base_url),
+                self.harvest_workers, self.harvest_page_size
+            )
+            written = harvester.harvest(item.get('collections'))
+            if harvester.failed:
+                logger.warning(
+                    f'Harvesting failed for {len(harvester.failed)} '
+                    f'collections or items: {harvester.failed[:10]}'
+                )
+            return written
+
+        if service_type == 'csw':
+            harvester = harvest.CswHarvester(
+                self, harvest.Checkpoints(self.repo.engine), base_url,
+                self.harvest_workers, self.harvest_page_size
+            )
+            written = harvester.harvest()
+            if harvester.failed:
+                logger.warning(
+                    f'Harvesting {base_url} stopped at record '
+                    f'{harvester.failed[0]}, it resumes from there'
+                )
+            return written
+
+        if service_type == 'stac_catalog':
+            crawler = harvest.StacCatalogCrawler(
+                self._shared_backend(CollectionBackend),
+                self._shared_backend(ItemBackend),
+                harvest.Validators(self.repo.engine), base_url,
+                self.harvest_workers, self.harvest_prune_unchanged
+            )
+            written = crawler.crawl()
+            if crawler.failed:
+                logger.warning(
+                    f'Crawling failed for {len(crawler.failed)} documents: '
+                    f'{crawler.failed[:10]}'
+                )
+            return written
+
+        logger.info(f'Harvesting is not supported for {service_type}')
+        return 0
+
+    def _shared_backend(self, backend_class):
+        """ A backend converting and writing harvested records, on the
+            repository shared with this backend
+        """
+        return backend_class(
+            self.repository_database_uri, ows_url=self.ows_url,
+            public_s3_url=self.public_s3_url, batch_size=self.batch_size,
+            flush_interval=self.flush_interval,
+            fetch_max_size=self.fetch_max_size, workers=self.workers
+        )
 
     def deregister(self, source: Optional[Source], item: Collection):
         pass
@@ -367,15 +1284,22 @@ class CatalogueBackend(Backend[dict], PycswMixIn):
 
 
 class JSONBackend(Backend[dict], PycswMixIn):
+    converter_branch = 'json'
+
     def exists(self, source: Optional[Source], item: dict) -> bool:
-        pass
+        identifier = item.get('id')
+        if identifier is None:
+            return False
+        return self._exists_all([identifier])
 
+    @profiled
     def register(
         self, source: Optional[Source], item: dict, replace: bool
     ):
         logger.info('Ingesting JSON')
         logger.info(f'Upserting metadata: {item}')
-        self._parse_and_upsert_metadata(json.dumps(item))
+        # the item is already parsed
+        self._upsert_record(self._parse_record(item, formats.JSON), replace)
 
     def deregister(self, source: Optional[Source], item: dict):
         pass
@@ -385,27 +1309,61 @@ class JSONBackend(Backend[dict], PycswMixIn):
 
 
 class XMLBackend(Backend[dict], PycswMixIn):
+    converter_branch = 'xml'
+
     def exists(self, source: Optional[Source], item: dict) -> bool:
-        pass
+        # the identifiers are only known from earlier registrations
+        return self._exists_source(item['url'])
 
+    @profiled
     def register(
         self, source: Optional[Source], item: dict, replace: bool
     ):
         logger.info('Ingesting XML')
         path = item["url"]
-        xml_local = '/tmp/metadata.xml'
-        logger.debug(f"Downloading {path} to temporary file {xml_local}")
-        if source:
-            source.get_file(path, xml_local)
-        else:
-            r = requests.get(path, allow_redirects=True)
-            open(xml_local, 'wb').write(r.content)
-        with open(xml_local) as f:
-            xml = f.read()
-        logger.debug(f"Removing temporary file {xml_local}")
-        os.remove(xml_local)
-        logger.info(f'Upserting metadata: {xml}')
-        self._parse_and_upsert_metadata(xml)
+        logger.debug(f"Fetching {path}")
+        with ExitStack() as stack:
+            # the document is downloaded when it is opened
+            with self._stage('fetch'):
+                f = stack.enter_context(
+                    fetch.open_href(path, source, self.fetch_max_size))
+            metrics.fetched(type(self).__name__, f.seek(0, os.SEEK_END))
+            f.seek(0)
+            identifiers = []
+            seen = 0
+
+            def elements():
+                nonlocal seen
+                for element in xmlstream.iter_records(f):
+                    seen += 1
+                    yield element
+
+            try:
+                written = self.upsert_elements(
+                    elements(), identifiers, replace)
+            except etree.XMLSyntaxError:
+                if seen:
+                    # batches before the error may be written already,
+                    # they are tracked and exists() finds the rest missing
+                    self._track_source(path, identifiers)
+                    raise
+                written = 0
+            if not seen:
+                # not a document of records pycsw can split, hand the
+                # whole document to pycsw
+                f.seek(0)
+                record = self._parse_and_upsert_metadata(
+                    f.read(), replace=replace)
+                identifiers = [record.identifier]
+                written = 1
+        logger.info(f'Upserted {written} records from {path}')
+        self._track_source(path, identifiers)
+
+    def _track_source(self, path: str, identifiers: list):
+        # dumps of many records are not tracked, exists() would have to
+        # check all of them
+        self._set_source_identifiers(
+            path, identifiers if len(identifiers) <= self.batch_size else [])
 
     def deregister(self, source: Optional[Source], item: dict):
         pass
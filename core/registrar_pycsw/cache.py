@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+import requests
+
+from .session import get_session
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 10
+
+
+def digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class DetectionCache:
+    """ Persistent cache of service detection results, keyed by base URL.
+
+        Each entry holds the detected service type, the identifier of the
+        registered record and the digest, ETag and Last-Modified header of
+        the document the detection was based on. Entries with an ETag or
+        Last-Modified header are revalidated with a conditional request
+        every time, entries without either are trusted as is while younger
+        than `ttl` seconds and refetched once older. At most `max_entries`
+        are kept, the least recently used are evicted first.
+    """
+
+    def __init__(self, path: str, ttl: float = 3600,
+                 max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS detections ('
+                'url TEXT PRIMARY KEY, service_type TEXT, identifier TEXT, '
+                'document_url TEXT, digest TEXT, etag TEXT, '
+                'last_modified TEXT, checked REAL, accessed REAL)'
+            )
+
+    def get(self, url: str) -> Optional[dict]:
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT * FROM detections WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                'UPDATE detections SET accessed = ? WHERE url = ?',
+                (time.time(), url)
+            )
+        return dict(row)
+
+    def put(self, url: str, service_type: str, identifier: str,
+            response: requests.Response):
+        """ Stores a detection result along with the validators of the
+            response it was based on
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO detections VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, service_type, identifier, response.url,
+                 digest(response.content), response.headers.get('ETag'),
+                 response.headers.get('Last-Modified'), now, now)
+            )
+            self._db.execute(
+                'DELETE FROM detections WHERE url NOT IN ('
+                'SELECT url FROM detections ORDER BY accessed DESC LIMIT ?)',
+                (self.max_entries,)
+            )
+
+    def invalidate(self, url: str):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM detections WHERE url = ?', (url,))
+
+    def is_unchanged(self, entry: dict, timeout: float = TIMEOUT) -> bool:
+        """ Checks whether the document behind a cache entry is unchanged,
+            with a conditional request if the entry holds validators, and
+            otherwise without a request while the entry is fresh
+        """
+        return self.revalidate(entry, timeout)[0]
+
+    def revalidate(self, entry: dict, timeout: float = TIMEOUT
+                   ) -> Tuple[bool, Optional[requests.Response]]:
+        """ Like `is_unchanged`, but also returns the response of the
+            conditional request if it fetched the document, so a changed
+            document need not be fetched again
+        """
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        # the TTL only applies to servers that cannot answer conditionally
+        if not headers and time.time() - entry['checked'] < self.ttl:
+            return True, None
+
+        try:
+            response = get_session().get(
+                entry['document_url'], headers=headers, timeout=timeout
+            )
+        except requests.RequestException as err:
+            logger.debug(f'revalidating {entry["url"]} failed: {err}')
+            return False, None
+
+        if response.status_code == 304:
+            unchanged = True
+        elif response.ok:
+            unchanged = digest(response.content) == entry['digest']
+        else:
+            unchanged = False
+
+        if unchanged:
+            with self._lock, self._db:
+                self._db.execute(
+                    'UPDATE detections SET checked = ?, '
+                    'etag = COALESCE(?, etag), '
+                    'last_modified = COALESCE(?, last_modified) '
+                    'WHERE url = ?',
+                    (time.time(), response.headers.get('ETag'),
+                     response.headers.get('Last-Modified'), entry['url'])
+                )
+        fetched = response.ok and response.status_code != 304
+        return unchanged, response if fetched else None
@@ -0,0 +1,123 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Optional, Tuple
+
+import requests
+from lxml import etree
+
+from .session import get_session
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 10
+
+GET_CAPABILITIES = {'service': 'CSW', 'version': '2.0.2',
+                    'request': 'GetCapabilities'}
+
+OPENSEARCH_DESCRIPTION = \
+    '{http://a9.com/-/spec/opensearch/1.1/}OpenSearchDescription'
+
+CSW_CAPABILITIES = (
+    '{http://www.opengis.net/cat/csw/2.0.2}Capabilities',
+    '{http://www.opengis.net/cat/csw/3.0}Capabilities',
+)
+
+# service type, parsed document and response of a conclusive probe
+ProbeResult = Tuple[str, Any, requests.Response]
+
+
+def probe_landing_page(base_url: str,
+                       timeout: float) -> Optional[ProbeResult]:
+    """ Probes for OGC API - Records, STAC API, static STAC catalogs and
+        OpenSearch on a single fetch of the landing page
+    """
+    response = get_session().get(
+        base_url, timeout=timeout,
+        headers={'Accept': 'application/json, application/xml;q=0.9'}
+    )
+    response.raise_for_status()
+
+    try:
+        landing_page = response.json()
+    except ValueError:
+        if etree.fromstring(response.content).tag == OPENSEARCH_DESCRIPTION:
+            return 'opensearch', response.content, response
+        return None
+
+    if not isinstance(landing_page, dict):
+        return None
+    if 'stac_version' in landing_page and 'conformsTo' not in landing_page:
+        return 'stac_catalog', landing_page, response
+    if 'links' in landing_page:
+        if 'stac_version' in landing_page:
+            return 'stac_api', landing_page, response
+        return 'oarec', landing_page, response
+    return None
+
+
+def probe_csw(base_url: str, timeout: float) -> Optional[ProbeResult]:
+    """ Probes for an OGC CSW by requesting its capabilities
+    """
+    response = get_session().get(
+        base_url, params=GET_CAPABILITIES, timeout=timeout)
+    response.raise_for_status()
+
+    if etree.fromstring(response.content).tag in CSW_CAPABILITIES:
+        return 'csw', response.content, response
+    return None
+
+
+# the probes, with the service types each may detect
+PROBES = {
+    probe_landing_page: ('oarec', 'stac_api', 'stac_catalog', 'opensearch'),
+    probe_csw: ('csw',),
+}
+
+# the service type detected on a URL answering to several probes
+PRIORITY = ['oarec', 'stac_api', 'stac_catalog', 'csw', 'opensearch']
+
+
+def _run_probe(probe: Callable, base_url: str, timeout: float):
+    try:
+        return probe(base_url, timeout)
+    except Exception as err:
+        logger.debug(f'{probe.__name__} on {base_url} failed: {err}')
+        return None
+
+
+def detect(base_url: str, timeout: float = TIMEOUT
+           ) -> Tuple[Optional[str], Any, Optional[requests.Response]]:
+    """ Runs all probes concurrently and returns the service type, the
+        parsed document and the response of the conclusive probe whose
+        service type comes first in `PRIORITY`, or (None, None, None).
+        Probes are only waited for as long as they may detect a service
+        type of a higher priority than the one already detected, the
+        remaining ones are cancelled or left to finish in the background.
+    """
+    executor = ThreadPoolExecutor(len(PROBES))
+    pending = {
+        executor.submit(_run_probe, probe, base_url, timeout): service_types
+        for probe, service_types in PROBES.items()
+    }
+    best = None
+    try:
+        for future in as_completed(list(pending)):
+            del pending[future]
+            result = future.result()
+            if result is not None and (
+                    best is None
+                    or PRIORITY.index(result[0]) < PRIORITY.index(best[0])):
+                best = result
+            if best is not None and not any(
+                    PRIORITY.index(service_type) < PRIORITY.index(best[0])
+                    for service_types in pending.values()
+                    for service_type in service_types):
+                break
+        if best is None:
+            return None, None, None
+        logger.info(f'Detected {best[0]} at {base_url}')
+        return best
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
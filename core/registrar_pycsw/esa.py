@@ -0,0 +1,227 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+NAMESPACES = {
+    'xfdu': 'urn:ccsds:schema:xfdu:1',
+    'safe': 'http://www.esa.int/safe/sentinel-1.0',
+    's1': 'http://www.esa.int/safe/sentinel-1.0/sentinel-1',
+    's1sarl1': 'http://www.esa.int/safe/sentinel-1.0/sentinel-1/sar/level-1',
+    'gml': 'http://www.opengis.net/gml',
+}
+
+
+@dataclass
+class Band:
+    name: Optional[str]
+    units: Optional[str] = None
+    min: Optional[str] = None
+    max: Optional[str] = None
+
+
+@dataclass
+class ProductMetadata:
+    """ Fields of an ESA product metadata document needed to build its
+        ISO record. Values are kept as the strings found in the document.
+    """
+    product_type: Optional[str] = None
+    product_uri: Optional[str] = None
+    generation_time: Optional[str] = None
+    start_time: Optional[str] = None
+    stop_time: Optional[str] = None
+    footprint: Optional[str] = None
+    processing_level: Optional[str] = None
+    cloud_cover: Optional[str] = None
+    orbit_number: Optional[str] = None
+    orbit_direction: Optional[str] = None
+    snow_cover: Optional[str] = None
+    image_format: Optional[str] = None
+    platform: Optional[str] = None
+    instrument: Optional[str] = None
+    bands: List[Band] = field(default_factory=list)
+    # footprint coordinates as (lat, lon) pairs
+    coordinates: List[tuple] = field(default_factory=list)
+
+    @property
+    def bbox(self) -> list:
+        """ The bounding box of the footprint as [minx, miny, maxx, maxy],
+            with the coordinates as found in the document
+        """
+        lats = [lat for lat, _ in self.coordinates]
+        lons = [lon for _, lon in self.coordinates]
+        return [min(lons, key=float), min(lats, key=float),
+                max(lons, key=float), max(lats, key=float)]
+
+
+class Profile:
+    """ Extraction table of one family of product metadata documents,
+        identified by the local name of their `root` element.
+
+        `fields` maps the fields of `ProductMetadata` to XPath expressions
+        evaluating to strings, `bands` selects the band elements and
+        `band_fields` maps the fields of `Band` to expressions relative to
+        a band element. All expressions are compiled once, and spell out
+        the path from the root instead of scanning all descendants.
+    """
+
+    def __init__(self, name: str, root: str, fields: Dict[str, str],
+                 bands: Optional[str] = None,
+                 band_fields: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.root = root
+        self.fields = {
+            key: etree.XPath(expression, namespaces=NAMESPACES)
+            for key, expression in fields.items()
+        }
+        self.bands = bands and etree.XPath(bands, namespaces=NAMESPACES)
+        self.band_fields = {
+            key: etree.XPath(expression, namespaces=NAMESPACES)
+            for key, expression in (band_fields or {}).items()
+        }
+
+    def extract(self, root: etree._Element) -> ProductMetadata:
+        values = {}
+        for key, xpath in self.fields.items():
+            values[key] = xpath(root) or None
+
+        product = ProductMetadata(**values)
+        product.coordinates = parse_footprint(product.footprint)
+        if self.bands is not None:
+            product.bands = [
+                Band(**{
+                    key: xpath(band) or None
+                    for key, xpath in self.band_fields.items()
+                })
+                for band in self.bands(root)
+            ]
+        return product
+
+
+def parse_footprint(footprint: Optional[str]) -> list:
+    """ Parses a footprint given as 'lat lon lat lon ...' (S2) or as
+        'lat,lon lat,lon ...' (S1) into (lat, lon) pairs
+    """
+    if not footprint:
+        return []
+    values = footprint.replace(',', ' ').split()
+    return list(zip(values[::2], values[1::2]))
+
+
+def _s2_section(name: str) -> str:
+    # the top level sections are in the namespace of the version of the
+    # product specification, their content is not namespaced
+    return f'/*/*[local-name()="{name}"]'
+
+
+S2_PRODUCT_INFO = f'{_s2_section("General_Info")}/Product_Info'
+S2_FIELDS = {
+    'product_type': f'string({S2_PRODUCT_INFO}/PRODUCT_TYPE)',
+    'product_uri': f'string({S2_PRODUCT_INFO}/PRODUCT_URI)',
+    'generation_time': f'string({S2_PRODUCT_INFO}/GENERATION_TIME)',
+    'start_time': f'string({S2_PRODUCT_INFO}/PRODUCT_START_TIME)',
+    'stop_time': f'string({S2_PRODUCT_INFO}/PRODUCT_STOP_TIME)',
+    'processing_level': f'string({S2_PRODUCT_INFO}/PROCESSING_LEVEL)',
+    'platform': f'string({S2_PRODUCT_INFO}/Datatake/SPACECRAFT_NAME)',
+    'instrument': f'string({S2_PRODUCT_INFO}/Datatake/DATATAKE_TYPE)',
+    'orbit_number': f'string({S2_PRODUCT_INFO}/Datatake/SENSING_ORBIT_NUMBER)',  # noqa
+    'orbit_direction':
+        f'string({S2_PRODUCT_INFO}/Datatake/SENSING_ORBIT_DIRECTION)',
+    'image_format':
+        f'string({S2_PRODUCT_INFO}/Product_Organisation/Granule_List'
+        '/Granule[1]/@imageFormat)',
+    'footprint':
+        f'string({_s2_section("Geometric_Info")}/Product_Footprint'
+        '/Product_Footprint/Global_Footprint/EXT_POS_LIST)',
+    'cloud_cover':
+        f'string({_s2_section("Quality_Indicators_Info")}'
+        '/Cloud_Coverage_Assessment)',
+}
+S2_BANDS = (f'{_s2_section("General_Info")}/Product_Image_Characteristics'
+            '/Spectral_Information_List/Spectral_Information')
+S2_BAND_FIELDS = {
+    'name': 'string(@physicalBand)',
+    'units': 'string(Wavelength/CENTRAL/@unit)',
+    'min': 'string(Wavelength/MIN)',
+    'max': 'string(Wavelength/MAX)',
+}
+
+
+def _s1_metadata(identifier: str) -> str:
+    return (f'/xfdu:XFDU/metadataSection/metadataObject[@ID="{identifier}"]'
+            '/metadataWrap/xmlData')
+
+
+S1_FIELDS = {
+    'product_type':
+        f'string({_s1_metadata("generalProductInformation")}'
+        '/s1sarl1:standAloneProductInformation/s1sarl1:productType)',
+    'generation_time':
+        f'string({_s1_metadata("processing")}/safe:processing/@stop)',
+    'start_time':
+        f'string({_s1_metadata("acquisitionPeriod")}'
+        '/safe:acquisitionPeriod/safe:startTime)',
+    'stop_time':
+        f'string({_s1_metadata("acquisitionPeriod")}'
+        '/safe:acquisitionPeriod/safe:stopTime)',
+    'platform':
+        f'concat({_s1_metadata("platform")}/safe:platform/safe:familyName, '
+        f'{_s1_metadata("platform")}/safe:platform/safe:number)',
+    'instrument':
+        f'string({_s1_metadata("platform")}/safe:platform/safe:instrument'
+        '/safe:extension/s1sarl1:instrumentMode/s1sarl1:mode)',
+    'orbit_number':
+        f'string({_s1_metadata("measurementOrbitReference")}'
+        '/safe:orbitReference/safe:orbitNumber[@type="start"])',
+    'orbit_direction':
+        f'string({_s1_metadata("measurementOrbitReference")}'
+        '/safe:orbitReference/safe:extension/s1:orbitProperties/s1:pass)',
+    'footprint':
+        f'string({_s1_metadata("measurementFrameSet")}'
+        '/safe:frameSet/safe:frame/safe:footPrint/gml:coordinates)',
+}
+
+S2_L1C = Profile(
+    'S2 L1C',
+    'Level-1C_User_Product',
+    S2_FIELDS, S2_BANDS, S2_BAND_FIELDS
+)
+
+S2_L2A = Profile(
+    'S2 L2A',
+    'Level-2A_User_Product',
+    dict(S2_FIELDS, snow_cover=(
+        f'string({_s2_section("Quality_Indicators_Info")}/Image_Content_QI'
+        '/SNOW_ICE_PERCENTAGE)'
+    )),
+    S2_BANDS, S2_BAND_FIELDS
+)
+
+S1 = Profile('S1', 'XFDU', S1_FIELDS)
+
+# profiles by the local name of the root element, the namespace of S2
+# documents changes with the version of the product specification
+PROFILES = {profile.root: profile for profile in (S2_L1C, S2_L2A, S1)}
+
+
+def get_profile(root: etree._Element) -> Profile:
+    try:
+        return PROFILES[etree.QName(root).localname]
+    except KeyError:
+        raise ValueError(
+            f'Unsupported product metadata document: {root.tag}'
+        ) from None
+
+
+def extract(esa_xml) -> ProductMetadata:
+    """ Extracts the fields of an ESA product metadata document, given as
+        bytes or as a parsed element
+    """
+    root = esa_xml if isinstance(esa_xml, etree._Element) \
+        else etree.fromstring(esa_xml)
+    profile = get_profile(root)
+    logger.debug(f'Extracting {profile.name} product metadata')
+    return profile.extract(root)
@@ -0,0 +1,85 @@
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
+
+from registrar.source import Source
+
+from .session import get_session
+
+logger = logging.getLogger(__name__)
+
+# documents larger than this are refused
+MAX_SIZE = 512 * 1024 * 1024
+
+# documents larger than this are spilled from memory to a temporary file
+SPOOL_SIZE = 16 * 1024 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _check_size(href: str, size: int, max_size: int):
+    if size > max_size:
+        raise ValueError(
+            f'{href} exceeds the maximum document size of {max_size} bytes'
+        )
+
+
+def _read_source(source: Source, href: str, buffer: IO[bytes],
+                 max_size: int):
+    # sources can only download to a path, so use a private directory to
+    # keep concurrent registrations from overwriting each other
+    with tempfile.TemporaryDirectory(prefix='registrar-') as tmpdir:
+        path = os.path.join(tmpdir, os.path.basename(href) or 'document')
+        source.get_file(href, path)
+        _check_size(href, os.path.getsize(path), max_size)
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, buffer, CHUNK_SIZE)
+
+
+def _read_http(href: str, buffer: IO[bytes], max_size: int):
+    with get_session().get(href, stream=True) as response:
+        response.raise_for_status()
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit():
+            _check_size(href, int(content_length), max_size)
+
+        size = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+            _check_size(href, size, max_size)
+            buffer.write(chunk)
+
+
+@contextmanager
+def open_href(href: str, source: Optional[Source] = None,
+              max_size: int = MAX_SIZE,
+              spool_size: int = SPOOL_SIZE) -> Iterator[IO[bytes]]:
+    """ Opens a document from a source, or over HTTP if no source is given,
+        as a binary file object. The content is held in memory up to
+        `spool_size` bytes and spilled to a unique temporary file beyond.
+    """
+    buffer = tempfile.SpooledTemporaryFile(
+        max_size=spool_size, prefix='registrar-'
+    )
+    try:
+        logger.debug(f'Fetching {href}')
+        if source is not None:
+            _read_source(source, href, buffer, max_size)
+        else:
+            _read_http(href, buffer, max_size)
+        buffer.seek(0)
+        yield buffer
+    finally:
+        buffer.close()
+
+
+def fetch(href: str, source: Optional[Source] = None,
+          max_size: int = MAX_SIZE) -> bytes:
+    """ Reads a document from a source, or over HTTP if no source is given,
+        into memory
+    """
+    with open_href(href, source, max_size, spool_size=max_size) as f:
+        return f.read()
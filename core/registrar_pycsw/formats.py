@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import re
+from functools import lru_cache
+from typing import Any, Optional, Tuple, Union
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+JSON = 'json'
+XML = 'xml'
+
+JSON_CONTENT_TYPE = 'application/json'
+XML_CONTENT_TYPE = 'application/xml'
+
+BOM = b'\xef\xbb\xbf'
+
+# formats by the first non-whitespace character of a document
+FORMATS = {
+    '{': JSON, '[': JSON, '<': XML,
+    b'{': JSON, b'[': JSON, b'<': XML,
+}
+
+# the first character of a document after a byte order mark and whitespace
+FIRST_BYTE = re.compile(rb'(?:\xef\xbb\xbf)?[ \t\r\n]*(.)', re.DOTALL)
+FIRST_CHAR = re.compile(r'\ufeff?[ \t\r\n]*(.)', re.DOTALL)
+
+ISO_NAMESPACES = {
+    'gco': 'http://www.isotc211.org/2005/gco',
+    'gmd': 'http://www.isotc211.org/2005/gmd',
+}
+
+# the record datestamp, set to the time of conversion by the converters
+DATESTAMP = etree.XPath('/*/gmd:dateStamp/*', namespaces=ISO_NAMESPACES)
+
+# the dates of a record, some set to the datestamp by the converters
+DATES = etree.XPath('//gco:Date | //gco:DateTime', namespaces=ISO_NAMESPACES)
+
+
+@lru_cache(maxsize=256)
+def format_of(content_type: Optional[str]) -> Optional[str]:
+    """ Maps a media type to the metadata format, or None if it does not
+        tell
+    """
+    if not content_type:
+        return None
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    if media_type.endswith('json'):
+        return JSON
+    if media_type.endswith('xml'):
+        return XML
+    return None
+
+
+def sniff(md: Union[bytes, str]) -> str:
+    """ Tells JSON from XML documents, given as bytes or text, by their
+        first non-whitespace character
+    """
+    head = md[:1]
+    if head not in FORMATS:
+        match = (FIRST_CHAR if isinstance(md, str) else FIRST_BYTE).match(md)
+        head = match.group(1) if match else head
+    try:
+        return FORMATS[head]
+    except KeyError:
+        raise ValueError(
+            f'Unknown metadata format starting with {head!r}') from None
+
+
+def parse_document(md: Union[bytes, str],
+                   content_type: Optional[str] = None) -> Tuple[str, Any]:
+    """ Parses a metadata document given as bytes, or as text, exactly once.
+        The format is taken from the content type if given and sniffed
+        from the document otherwise. Returns the format and the parsed
+        JSON object or XML element.
+    """
+    metadata_format = format_of(content_type) or sniff(md)
+    if metadata_format == JSON:
+        return JSON, json.loads(md)
+    if isinstance(md, str):
+        # lxml refuses text with an encoding declaration, and parses the
+        # encoded text faster anyway
+        md = md.encode('utf-8')
+    return XML, etree.fromstring(md)
+
+
+def digest(metadata_format: str, parsed) -> str:
+    """ Digest of a parsed metadata document that ignores the record
+        datestamp, and the dates of the resource the converters set to
+        the same time of conversion
+    """
+    if metadata_format == JSON:
+        content = json.dumps(
+            parsed, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    else:
+        # the dates are blanked in the tree for the canonicalization, and
+        # restored as the tree is still to be turned into a record
+        datestamps = {
+            element.text.strip() for element in DATESTAMP(parsed)
+            if element.text and element.text.strip()
+        }
+        blanked = [
+            (element, element.text) for element in DATES(parsed)
+            if element.text and element.text.strip() in datestamps
+        ]
+        try:
+            for element, _ in blanked:
+                element.text = ''
+            content = etree.tostring(parsed, method='c14n')
+        finally:
+            for element, text in blanked:
+                element.text = text
+    return hashlib.sha256(content).hexdigest()
@@ -0,0 +1,682 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, Optional
+from urllib.parse import urldefrag, urljoin
+
+from lxml import etree
+from pystac import Collection, Item
+from sqlalchemy import Column, MetaData, Table, Text, and_, select
+
+from . import xmlstream
+from .cache import digest
+from .session import JSON_HEADERS, get_json, get_session
+
+logger = logging.getLogger(__name__)
+
+# table holding the harvesting progress of remote catalogues
+CHECKPOINTS_TABLE = 'registrar_harvest_checkpoints'
+
+# table holding the validators of the crawled documents of static catalogs
+VALIDATORS_TABLE = 'registrar_crawl_validators'
+
+_DONE = object()
+
+GET_RECORDS = """<csw:GetRecords xmlns:csw="http://www.opengis.net/cat/csw/2.0.2"
+    xmlns:ogc="http://www.opengis.net/ogc"
+    xmlns:gmd="http://www.isotc211.org/2005/gmd"
+    xmlns:apiso="http://www.opengis.net/cat/csw/apiso/1.0"
+    service="CSW" version="2.0.2" resultType="{result_type}"
+    startPosition="{start}" maxRecords="{max_records}"
+    outputSchema="http://www.isotc211.org/2005/gmd">
+  <csw:Query typeNames="gmd:MD_Metadata">
+    <csw:ElementSetName>full</csw:ElementSetName>{constraint}
+    <ogc:SortBy>
+      <ogc:SortProperty>
+        <ogc:PropertyName>apiso:Identifier</ogc:PropertyName>
+        <ogc:SortOrder>ASC</ogc:SortOrder>
+      </ogc:SortProperty>
+    </ogc:SortBy>
+  </csw:Query>
+</csw:GetRecords>"""
+
+CONSTRAINT = """
+    <csw:Constraint version="1.1.0">
+      <ogc:Filter>{comparisons}
+      </ogc:Filter>
+    </csw:Constraint>"""
+
+MODIFIED = """
+        <ogc:{operator}>
+          <ogc:PropertyName>apiso:Modified</ogc:PropertyName>
+          <ogc:Literal>{value}</ogc:Literal>
+        </ogc:{operator}>"""
+
+SEARCH_RESULTS = '{http://www.opengis.net/cat/csw/2.0.2}SearchResults'
+
+EXCEPTION_REPORT = '{http://www.opengis.net/ows}ExceptionReport'
+
+
+def get_records(start: int, max_records: int, since: Optional[str] = None,
+                result_type: str = 'results',
+                until: Optional[str] = None) -> bytes:
+    """ Builds a CSW 2.0.2 GetRecords request for ISO metadata ordered by
+        identifier, optionally for the records modified since and until
+        a date
+    """
+    comparisons = [
+        MODIFIED.format(operator=operator, value=value)
+        for operator, value in (
+            ('PropertyIsGreaterThanOrEqualTo', since),
+            ('PropertyIsLessThanOrEqualTo', until),
+        ) if value
+    ]
+    if len(comparisons) > 1:
+        comparisons = ['<ogc:And>', *comparisons, '</ogc:And>']
+    return GET_RECORDS.format(
+        result_type=result_type, start=start, max_records=max_records,
+        constraint=CONSTRAINT.format(comparisons=''.join(comparisons))
+        if comparisons else ''
+    ).encode('utf-8')
+
+
+class Checkpoints:
+    """ Harvesting progress per catalogue URL and collection, kept in the
+        repository database.
+
+        `watermark` is where the next incremental harvest starts, it only
+        advances once a harvest completed. `pending` tracks the watermark
+        of the harvest in progress and `next` the request of its next
+        page, so an interrupted harvest is resumed from there. `failed`
+        is the earliest timestamp of the records the harvest in progress
+        failed to convert, the watermark does not advance past it.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.table = Table(
+            CHECKPOINTS_TABLE, MetaData(),
+            Column('url', Text, primary_key=True),
+            Column('collection', Text, primary_key=True),
+            Column('watermark', Text),
+            Column('pending', Text),
+            Column('next', Text),
+            Column('failed', Text),
+            Column('updated', Text)
+        )
+        self.table.create(engine, checkfirst=True)
+
+    def _where(self, url: str, collection: str):
+        return and_(self.table.c.url == url,
+                    self.table.c.collection == collection)
+
+    def get(self, url: str, collection: str = '') -> dict:
+        query = select([self.table]).where(self._where(url, collection))
+        with self.engine.connect() as connection:
+            row = connection.execute(query).fetchone()
+        if row is None:
+            return {'watermark': None, 'pending': None, 'next': None,
+                    'failed': None}
+        return {
+            'watermark': row.watermark,
+            'pending': row.pending,
+            'next': json.loads(row.next) if row.next else None,
+            'failed': row.failed,
+        }
+
+    def save(self, url: str, collection: str = '',
+             watermark: Optional[str] = None, pending: Optional[str] = None,
+             next: Optional[dict] = None, failed: Optional[str] = None):
+        row = {
+            'url': url,
+            'collection': collection,
+            'watermark': watermark,
+            'pending': pending,
+            'next': json.dumps(next) if next else None,
+            'failed': failed,
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
+        with self.engine.begin() as connection:
+            connection.execute(
+                self.table.delete().where(self._where(url, collection)))
+            connection.execute(self.table.insert(), row)
+
+
+class Validators:
+    """ ETag, Last-Modified header and digest of the documents of static
+        catalogs as of their last successful crawl, along with the links
+        to follow of the catalogs and collections, kept in the repository
+        database.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.table = Table(
+            VALIDATORS_TABLE, MetaData(),
+            Column('url', Text, primary_key=True),
+            Column('etag', Text),
+            Column('last_modified', Text),
+            Column('digest', Text),
+            Column('links', Text)
+        )
+        self.table.create(engine, checkfirst=True)
+
+    def get(self, url: str) -> Optional[dict]:
+        query = select([self.table]).where(self.table.c.url == url)
+        with self.engine.connect() as connection:
+            row = connection.execute(query).fetchone()
+        return dict(row) if row is not None else None
+
+    def save(self, validators: list):
+        if not validators:
+            return
+        urls = [row['url'] for row in validators]
+        with self.engine.begin() as connection:
+            connection.execute(
+                self.table.delete().where(self.table.c.url.in_(urls)))
+            connection.execute(self.table.insert(), validators)
+
+
+def _put(pages: queue.Queue, entry, stop: threading.Event) -> bool:
+    """ Queues an entry unless the consumer stopped
+    """
+    while not stop.is_set():
+        try:
+            pages.put(entry, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _later(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    # RFC 3339 timestamps in UTC compare as strings
+    if a is None or b is None:
+        return a or b
+    return max(a, b)
+
+
+def _earlier(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    if a is None or b is None:
+        return a or b
+    return min(a, b)
+
+
+class StacApiHarvester:
+    """ Mirrors the items of a STAC API, collection by collection.
+
+        The items of up to `workers` collections are searched concurrently,
+        page by page, and converted like the items of the `item_backend`.
+        The pages are written in batches by the calling thread, which
+        saves the checkpoint of a collection once its page is written.
+
+        A harvest only asks for the items from the watermark of the last
+        completed harvest of a collection on. If the API conforms to the
+        filter extension, the watermark is the latest `updated` timestamp
+        of the items harvested, so changed items are harvested again.
+        Otherwise it is the latest `datetime` of the items, and changes to
+        items whose `datetime` is before the watermark are missed until
+        the checkpoint of the collection is removed for a full harvest.
+
+        Items that fail to convert hold the watermark back to their
+        timestamp, so the next harvest asks for them again. Interrupted
+        harvests resume with the next page they would have requested.
+    """
+
+    def __init__(self, item_backend, checkpoints: Checkpoints, url: str,
+                 landing_page: dict, workers: int = 4, page_size: int = 100):
+        self.item_backend = item_backend
+        self.checkpoints = checkpoints
+        self.url = url
+        self.landing_page = landing_page
+        self.workers = workers
+        self.page_size = page_size
+        self.failed = []
+        # the filter extension allows searching by `updated`
+        self.filter_updated = any(
+            'item-search#filter' in conformance
+            for conformance in landing_page.get('conformsTo', [])
+        )
+
+    def search_url(self) -> str:
+        for link in self.landing_page.get('links', []):
+            if link.get('rel') == 'search':
+                return link['href']
+        return urljoin(self.url.rstrip('/') + '/', 'search')
+
+    def collections(self) -> list:
+        collections = get_json(
+            urljoin(self.url.rstrip('/') + '/', 'collections'))
+        return [collection['id'] for collection in collections['collections']]
+
+    def harvest(self, collections: Optional[list] = None) -> int:
+        """ Harvests the items of the given, or all, collections. Returns
+            the number of items written or found unchanged.
+        """
+        collections = collections or self.collections()
+        pages = queue.Queue(self.workers * 2)
+        stop = threading.Event()
+        written = 0
+        with ThreadPoolExecutor(
+                min(self.workers, len(collections)) or 1,
+                thread_name_prefix='registrar-harvest') as executor:
+            for collection in collections:
+                executor.submit(self._produce, collection, pages, stop)
+
+            remaining = len(collections)
+            try:
+                while remaining:
+                    entry = pages.get()
+                    if entry is _DONE:
+                        remaining -= 1
+                        continue
+                    written += self._write(*entry)
+            finally:
+                # lets the producers finish if writing failed
+                stop.set()
+
+        logger.info(
+            f'Harvested {written} items of {len(collections)} collections '
+            f'from {self.url}'
+        )
+        return written
+
+    def _produce(self, collection: str, pages: queue.Queue,
+                 stop: threading.Event):
+        try:
+            for page in self._pages(collection):
+                if not _put(pages, page, stop):
+                    return
+        except Exception as err:
+            logger.error(f'Harvesting collection {collection} failed: {err}')
+            self.failed.append(collection)
+        finally:
+            _put(pages, _DONE, stop)
+
+    def _pages(self, collection: str) -> Iterator[tuple]:
+        """ Yields the converted items of the pages of a collection along
+            with the checkpoint to save once they are written
+        """
+        checkpoint = self.checkpoints.get(self.url, collection)
+        request = checkpoint['next']
+        pending = checkpoint['pending']
+        failed = checkpoint['failed']
+        if request is None:
+            params = {'collections': collection, 'limit': self.page_size}
+            watermark = checkpoint['watermark']
+            if watermark and self.filter_updated:
+                params['filter'] = f"updated >= TIMESTAMP('{watermark}')"
+                params['filter-lang'] = 'cql2-text'
+            elif watermark:
+                params['datetime'] = f'{watermark}/..'
+            request = {'href': self.search_url(), 'method': 'GET',
+                       'params': params}
+            pending = watermark
+            failed = None
+        else:
+            logger.info(f'Resuming harvest of collection {collection}')
+
+        while request is not None:
+            page = self._request(request)
+            metadata = []
+            for feature in page.get('features', []):
+                timestamp = self._timestamp(feature)
+                pending = _later(pending, timestamp)
+                try:
+                    metadata.append(self.item_backend.get_metadata(
+                        None, Item.from_dict(feature)))
+                except Exception as err:
+                    logger.error(
+                        f'Converting item {feature.get("id")} failed: {err}')
+                    self.failed.append(feature.get('id'))
+                    failed = _earlier(failed, timestamp)
+
+            request = self._next(page)
+            if request is None:
+                # completed, the next harvest starts from here
+                saved = {'watermark': _earlier(pending, failed),
+                         'pending': None, 'next': None}
+            else:
+                saved = {'watermark': checkpoint['watermark'],
+                         'pending': pending, 'next': request,
+                         'failed': failed}
+            yield collection, metadata, saved
+
+    def _timestamp(self, feature: dict) -> Optional[str]:
+        """ The timestamp of an item the watermark is based on
+        """
+        properties = feature.get('properties', {})
+        return properties.get(
+            'updated' if self.filter_updated else 'datetime')
+
+    def _request(self, request: dict) -> dict:
+        session = get_session()
+        if request.get('method', 'GET').upper() == 'POST':
+            response = session.post(request['href'], json=request.get('body'),
+                                    headers=JSON_HEADERS)
+        else:
+            response = session.get(request['href'],
+                                   params=request.get('params'),
+                                   headers=JSON_HEADERS)
+        response.raise_for_status()
+        return response.json()
+
+    def _next(self, page: dict) -> Optional[dict]:
+        for link in page.get('links', []):
+            if link.get('rel') == 'next':
+                return {
+                    'href': link['href'],
+                    'method': link.get('method', 'GET'),
+                    'body': link.get('body'),
+                }
+        return None
+
+    def _write(self, collection: str, metadata: list, checkpoint: dict) -> int:
+        written = 0
+        if metadata:
+            written = self.item_backend.upsert_many(metadata)
+        self.checkpoints.save(self.url, collection, **checkpoint)
+        logger.debug(f'Harvested {written} items of collection {collection}')
+        return written
+
+
+class CswHarvester:
+    """ Mirrors the ISO metadata records of a CSW.
+
+        The records are requested with GetRecords over consecutive
+        `startPosition` windows of `page_size` records, up to `workers` of
+        them at a time. Each response is stream-parsed into its
+        `gmd:MD_Metadata` records, which the calling thread upserts in
+        batches, window by window.
+
+        A harvest only asks for the records modified until it started,
+        so the windows do not shift as records are modified meanwhile, and
+        since the day the last completed harvest started, as
+        `apiso:Modified` values are often dates, which compare before the
+        timestamps of the same day. The checkpoint keeps the start and the
+        next window of a harvest in progress, so an interrupted harvest
+        resumes from there with the same windows.
+    """
+
+    def __init__(self, backend, checkpoints: Checkpoints, url: str,
+                 workers: int = 4, page_size: int = 100):
+        self.backend = backend
+        self.checkpoints = checkpoints
+        self.url = url
+        self.workers = workers
+        self.page_size = page_size
+        self.failed = []
+
+    def harvest(self) -> int:
+        """ Harvests the records of the CSW. Returns the number of records
+            written or found unchanged.
+        """
+        checkpoint = self.checkpoints.get(self.url)
+        # the date of the start of the last completed harvest
+        since = checkpoint['watermark'] and checkpoint['watermark'][:10]
+        if checkpoint['next']:
+            logger.info(f'Resuming harvest of {self.url}')
+            start = checkpoint['next']['startPosition']
+            until = checkpoint['pending']
+        else:
+            start = 1
+            until = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+        matched = self.hits(since, until)
+        logger.info(
+            f'Harvesting {matched} records from {self.url} modified '
+            + (f'since {since} ' if since else '') + f'until {until}'
+        )
+
+        written = 0
+        positions = iter(range(start, matched + 1, self.page_size))
+        with ThreadPoolExecutor(
+                self.workers,
+                thread_name_prefix='registrar-harvest') as executor:
+            windows = deque()
+
+            def submit():
+                for position in positions:
+                    windows.append((position, executor.submit(
+                        self._window, position, since, until)))
+                    return
+
+            for _ in range(self.workers * 2):
+                submit()
+
+            try:
+                while windows:
+                    position, future = windows.popleft()
+                    try:
+                        elements = future.result()
+                    except Exception as err:
+                        logger.error(
+                            f'Harvesting records {position} to '
+                            f'{position + self.page_size - 1} of '
+                            f'{self.url} failed: {err}'
+                        )
+                        self.failed.append(position)
+                        break
+                    submit()
+                    written += self.backend.upsert_elements(elements)
+
+                    next_position = position + self.page_size
+                    if next_position > matched:
+                        self.checkpoints.save(self.url, watermark=until)
+                    else:
+                        self.checkpoints.save(
+                            self.url, watermark=checkpoint['watermark'],
+                            pending=until,
+                            next={'startPosition': next_position})
+            finally:
+                for _, future in windows:
+                    future.cancel()
+
+        if matched < start:
+            # nothing (left) to harvest
+            self.checkpoints.save(self.url, watermark=until)
+
+        logger.info(f'Harvested {written} records from {self.url}')
+        return written
+
+    def _post(self, body: bytes, stream: bool = False):
+        response = get_session().post(
+            self.url, data=body, stream=stream,
+            headers={'Content-Type': 'application/xml'}
+        )
+        response.raise_for_status()
+        return response
+
+    def hits(self, since: Optional[str] = None,
+             until: Optional[str] = None) -> int:
+        """ Asks for the number of records to harvest
+        """
+        response = self._post(get_records(1, 0, since, 'hits', until))
+        root = etree.fromstring(response.content)
+        results = root.find(SEARCH_RESULTS)
+        if results is None:
+            raise ValueError(
+                f'No search results in GetRecords response of {self.url}: '
+                f'{response.content[:500]!r}'
+            )
+        return int(results.get('numberOfRecordsMatched'))
+
+    def _window(self, position: int, since: Optional[str],
+                until: Optional[str]) -> list:
+        response = self._post(
+            get_records(position, self.page_size, since, until=until),
+            stream=True)
+        response.raw.decode_content = True
+        elements = []
+        with response:
+            for element in xmlstream.iter_records(
+                    response.raw, xmlstream.RECORD_TAGS + (EXCEPTION_REPORT,)):
+                if element.tag == EXCEPTION_REPORT:
+                    raise ValueError(etree.tostring(element).decode())
+                elements.append(element)
+        return elements
+
+
+class StacCatalogCrawler:
+    """ Mirrors the collections and items of a static STAC catalog.
+
+        Starting from the root, the `child` and `item` links are followed
+        by up to `workers` threads, each URL once. Collections are
+        registered with the `collection_backend`, items are converted like
+        those of the `item_backend` by the workers and written in batches
+        by the calling thread. Catalogs are only crawled.
+
+        Documents are requested conditionally with the validators of the
+        last crawl, which also keep the links of the catalogs and
+        collections. An unchanged document is not registered again and,
+        if it is a catalog or collection, costs a single request, as its
+        links are followed from the validators.
+
+        The links below an unchanged catalog or collection are still
+        followed by default: the links of a static catalog only hold the
+        href of its children, so a child or item can change, or gain
+        children and items, without its parents changing. With
+        `prune_unchanged`, the crawl does not descend below unchanged
+        documents, which only suits catalogs whose publishers rewrite all
+        the parents of a changed document, e.g. to update their
+        `updated` timestamp.
+    """
+
+    def __init__(self, collection_backend, item_backend,
+                 validators: Validators, url: str, workers: int = 4,
+                 prune_unchanged: bool = False):
+        self.collection_backend = collection_backend
+        self.item_backend = item_backend
+        self.validators = validators
+        self.url = url
+        self.workers = workers
+        self.prune_unchanged = prune_unchanged
+        self.failed = []
+
+    def crawl(self) -> int:
+        """ Crawls the catalog. Returns the number of collections and items
+            written or found unchanged.
+        """
+        root = urldefrag(self.url)[0]
+        seen = {root}
+        urls = deque([root])
+        # converted items and their validators, written in batches
+        items = []
+        batch_size = self.item_backend.batch_size
+        written = 0
+
+        with ThreadPoolExecutor(
+                self.workers,
+                thread_name_prefix='registrar-crawl') as executor:
+            futures = {}
+            while urls or futures:
+                while urls and len(futures) < self.workers * 2:
+                    url = urls.popleft()
+                    futures[executor.submit(self._visit, url)] = url
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = futures.pop(future)
+                    try:
+                        document, metadata, validators = future.result()
+                    except Exception as err:
+                        logger.error(f'Crawling {url} failed: {err}')
+                        self.failed.append(url)
+                        continue
+
+                    if document is None and self.prune_unchanged:
+                        logger.debug(f'{url} is unchanged, pruned')
+                        continue
+                    for link in json.loads(validators['links'] or '[]'):
+                        if link not in seen:
+                            seen.add(link)
+                            urls.append(link)
+
+                    if document is None:
+                        logger.debug(f'{url} is unchanged')
+                    elif metadata is not None:
+                        items.append((url, metadata, validators))
+                        if len(items) >= batch_size:
+                            written += self._write_items(items)
+                            items = []
+                    else:
+                        written += self._write_container(
+                            url, document, validators)
+
+        if items:
+            written += self._write_items(items)
+
+        logger.info(f'Crawled {len(seen)} documents of {self.url}')
+        return written
+
+    def _visit(self, url: str) -> tuple:
+        """ Fetches a document and converts it if it is an item. Returns
+            the document, the item metadata and the validators to keep, with
+            the document None if it is unchanged.
+        """
+        cached = self.validators.get(url)
+        headers = dict(JSON_HEADERS)
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = get_session().get(url, headers=headers)
+        if response.status_code == 304:
+            return None, None, cached
+        response.raise_for_status()
+
+        content_digest = digest(response.content)
+        if cached is not None and cached['digest'] == content_digest:
+            return None, None, cached
+
+        document = response.json()
+        links = [
+            urldefrag(urljoin(url, link['href']))[0]
+            for link in document.get('links', [])
+            if link.get('rel') in ('child', 'item')
+        ]
+        validators = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'digest': content_digest,
+            'links': json.dumps(links) if links else None,
+        }
+        if document.get('type') != 'Feature':
+            return document, None, validators
+
+        item = Item.from_dict(document, href=url)
+        item.make_asset_hrefs_absolute()
+        return document, self.item_backend.get_metadata(None, item), validators
+
+    def _write_container(self, url: str, document: dict,
+                         validators: dict) -> int:
+        written = 0
+        if document.get('type') == 'Collection':
+            try:
+                self.collection_backend.register(
+                    None, Collection.from_dict(document), True)
+            except Exception as err:
+                logger.error(f'Registering {url} failed: {err}')
+                self.failed.append(url)
+                return 0
+            written = 1
+        self.validators.save([validators])
+        return written
+
+    def _write_items(self, items: list) -> int:
+        try:
+            written = self.item_backend.upsert_many(
+                metadata for _, metadata, _ in items)
+        except Exception as err:
+            logger.error(f'Writing {len(items)} items failed: {err}')
+            self.failed.extend(url for url, _, _ in items)
+            return 0
+        self.validators.save([validators for _, _, validators in items])
+        return written
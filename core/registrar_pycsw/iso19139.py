@@ -0,0 +1,408 @@
+import logging
+
+from lxml import etree
+from lxml.builder import ElementMaker
+import pygeometa
+from pygeometa import core as pygeometa_core
+from pygeometa.core import normalize_datestring
+from pygeometa.schemas.iso19139_2 import ISO19139_2OutputSchema
+
+logger = logging.getLogger(__name__)
+
+NAMESPACES = {
+    'gco': 'http://www.isotc211.org/2005/gco',
+    'gmd': 'http://www.isotc211.org/2005/gmd',
+    'gmi': 'http://www.isotc211.org/2005/gmi',
+    'gml': 'http://www.opengis.net/gml',
+    'gmx': 'http://www.isotc211.org/2005/gmx',
+    'xlink': 'http://www.w3.org/1999/xlink',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+}
+
+SCHEMA_LOCATION = (
+    'http://www.isotc211.org/2005/gmd http://www.isotc211.org/2005/gmd/gmd.xsd '  # noqa
+    'http://www.isotc211.org/2005/gmx http://www.isotc211.org/2005/gmx/gmx.xsd '  # noqa
+    'http://www.isotc211.org/2005/gmi http://www.isotc211.org/2005/gmx/gmi.xsd'  # noqa
+)
+
+CODELISTS = 'http://www.isotc211.org/2005/resources/Codelist/gmxCodelists.xml'
+LINK_RELATIONS = \
+    'https://www.iana.org/assignments/link-relations/link-relations.xml'
+LANGUAGE_CODELIST = 'http://www.loc.gov/standards/iso639-2/'
+
+NIL_LANGUAGES = ('inapplicable', 'missing', 'template', 'unknown', 'withheld')
+
+# the note of the pygeometa templates, with the version they render
+# (pygeometa.core.VERSION since 0.16, pygeometa.__version__ before)
+PYGEOMETA_VERSION = getattr(
+    pygeometa_core, 'VERSION', getattr(pygeometa, '__version__', ''))
+MAINTENANCE_NOTE = (
+    f'This metadata record was generated by pygeometa-{PYGEOMETA_VERSION} '
+    '(https://github.com/geopython/pygeometa)'
+)
+
+GMD = ElementMaker(namespace=NAMESPACES['gmd'], nsmap=NAMESPACES)
+GCO = ElementMaker(namespace=NAMESPACES['gco'], nsmap=NAMESPACES)
+GMI = ElementMaker(namespace=NAMESPACES['gmi'], nsmap=NAMESPACES)
+GML = ElementMaker(namespace=NAMESPACES['gml'], nsmap=NAMESPACES)
+
+NIL_REASON = f'{{{NAMESPACES["gco"]}}}nilReason'
+GML_ID = f'{{{NAMESPACES["gml"]}}}id'
+SCHEMA_LOCATION_ATTR = f'{{{NAMESPACES["xsi"]}}}schemaLocation'
+
+# the parts of the MCF the writer knows how to render, everything else
+# is left to pygeometa
+METADATA_KEYS = {'identifier', 'language', 'charset', 'parentidentifier',
+                 'hierarchylevel', 'datestamp'}
+IDENTIFICATION_KEYS = {'charset', 'language', 'keywords', 'dates', 'status',
+                       'maintenancefrequency', 'title', 'abstract',
+                       'extents'}
+DISTRIBUTION_KEYS = {'rel', 'url', 'type', 'name', 'description'}
+
+
+def _value(mapping: dict, key: str) -> str:
+    # like the template, missing values are rendered empty and None as 'None'
+    return str(mapping[key]) if key in mapping else ''
+
+
+def _code(element: str, codelist: str, value: str,
+          code_space: str = 'ISOTC211/19115'):
+    return GMD(element, value, codeList=codelist, codeSpace=code_space,
+               codeListValue=value)
+
+
+def _iso_code(element: str, value: str):
+    return _code(element, f'{CODELISTS}#{element}', value)
+
+
+def _char(element: str, value) -> list:
+    # optional free text elements are left out when empty
+    if value is None or str(value).strip() == 'None':
+        return []
+    return [GMD(element, GCO.CharacterString(str(value).strip()))]
+
+
+def _date(datestring) -> etree._Element:
+    datestamp = normalize_datestring(datestring)
+    if len(datestamp) > 11:
+        return GCO.DateTime(datestamp)
+    return GCO.Date(datestamp)
+
+
+def _contact(role: str) -> etree._Element:
+    return GMD.CI_ResponsibleParty(
+        GMD.contactInfo(GMD.CI_Contact(
+            GMD.phone(GMD.CI_Telephone(
+                GMD.voice({NIL_REASON: 'missing'}),
+                GMD.facsimile({NIL_REASON: 'missing'}),
+            )),
+            GMD.address(GMD.CI_Address(
+                GMD.postalCode(GCO.CharacterString('')),
+            )),
+            GMD.onlineResource(GMD.CI_OnlineResource(
+                GMD.linkage(GMD.URL('')),
+                GMD.protocol(GCO.CharacterString('WWW:LINK')),
+                GMD.function(GMD.CI_OnLineFunctionCode(
+                    'information',
+                    codeList=f'{CODELISTS}#CI_OnLineFunctionCode',
+                    codeListValue='information', codeSpace='ISOTC211/19115'
+                )),
+            )),
+        )),
+        GMD.role(_iso_code('CI_RoleCode', role)),
+        id=f'contact-{role}'
+    )
+
+
+def _reference_system(crs) -> etree._Element:
+    return GMD.referenceSystemInfo(GMD.MD_ReferenceSystem(
+        GMD.referenceSystemIdentifier(GMD.RS_Identifier(
+            GMD.authority(GMD.CI_Citation(
+                GMD.title(GCO.CharacterString(
+                    'European Petroleum Survey Group (EPSG) Geodetic '
+                    'Parameter Registry'
+                )),
+                GMD.date(GMD.CI_Date(
+                    GMD.date(GCO.Date('2008-11-12')),
+                    GMD.dateType(_iso_code('CI_DateTypeCode', 'publication')),
+                )),
+                GMD.citedResponsibleParty(GMD.CI_ResponsibleParty(
+                    GMD.organisationName(GCO.CharacterString(
+                        'European Petroleum Survey Group'
+                    )),
+                    GMD.contactInfo(GMD.CI_Contact(
+                        GMD.onlineResource(GMD.CI_OnlineResource(
+                            GMD.linkage(GMD.URL(
+                                'http://www.epsg-registry.org'
+                            )),
+                        )),
+                    )),
+                    GMD.role(_iso_code('CI_RoleCode', 'originator')),
+                )),
+            )),
+            GMD.code(GCO.CharacterString(f'urn:ogc:def:crs:EPSG:{crs}')),
+            GMD.version(GCO.CharacterString('6.18.3')),
+        )),
+    ))
+
+
+def _keywords(keywords: dict) -> etree._Element:
+    return GMD.descriptiveKeywords(GMD.MD_Keywords(
+        *(element for keyword in keywords.get('keywords') or []
+          for element in _char('keyword', keyword)),
+        GMD.type(_iso_code('MD_KeywordTypeCode',
+                           _value(keywords, 'keywords_type'))),
+    ))
+
+
+def _extent(extents: dict) -> etree._Element:
+    elements = []
+    for spatial in extents['spatial']:
+        bbox = spatial['bbox']
+        elements.append(GMD.geographicElement(GMD.EX_GeographicBoundingBox(
+            GMD.extentTypeCode(GCO.Boolean('1')),
+            GMD.westBoundLongitude(GCO.Decimal(str(bbox[0]))),
+            GMD.eastBoundLongitude(GCO.Decimal(str(bbox[2]))),
+            GMD.southBoundLatitude(GCO.Decimal(str(bbox[1]))),
+            GMD.northBoundLatitude(GCO.Decimal(str(bbox[3]))),
+        )))
+    for temporal in extents.get('temporal', []):
+        if temporal.get('end') == 'now':
+            end = GML.endPosition(indeterminatePosition='now')
+        else:
+            end = GML.endPosition(_value(temporal, 'end'))
+        elements.append(GMD.temporalElement(GMD.EX_TemporalExtent(
+            GMD.extent(GML.TimePeriod(
+                GML.beginPosition(_value(temporal, 'begin')),
+                end,
+                {GML_ID: 'T001'}
+            )),
+        )))
+    return GMD.extent(GMD.EX_Extent(*elements))
+
+
+def _content_info(content_info: dict) -> etree._Element:
+    dimensions = []
+    for index, dimension in enumerate(content_info['dimensions'], 1):
+        dimensions.append(GMD.dimension(GMD.MD_Band(
+            GMD.units(GML.UnitDefinition(
+                GML.identifier(_value(dimension, 'units'), codeSpace='none'),
+                {GML_ID: f'units-{index}'}
+            )),
+            id=_value(dimension, 'name')
+        )))
+    content_type = content_info['type']
+    return GMD.contentInfo(GMD.MD_ImageDescription(
+        GMD.attributeDescription(GCO.RecordType(content_type)),
+        GMD.contentType(_code(
+            'MD_CoverageContentTypeCode', f'{CODELISTS}#MD_ScopeCode',
+            content_type
+        )),
+        *dimensions,
+        GMD.cloudCoverPercentage(GCO.Real(
+            _value(content_info, 'cloud_cover'))),
+        GMD.processingLevelCode(GMD.RS_Identifier(
+            GMD.code(GCO.CharacterString(
+                _value(content_info, 'processing_level'))),
+        )),
+    ))
+
+
+def _online_resource(distribution: dict) -> etree._Element:
+    function = []
+    if distribution.get('rel'):
+        function.append(GMD.function(_code(
+            'CI_OnLineFunctionCode', LINK_RELATIONS, distribution['rel'],
+            code_space='rfc8288'
+        )))
+    return GMD.onLine(GMD.CI_OnlineResource(
+        GMD.linkage(GMD.URL(_value(distribution, 'url'))),
+        GMD.protocol(GCO.CharacterString(_value(distribution, 'type'))),
+        *_char('name', distribution.get('name')),
+        *_char('description', distribution.get('description')),
+        *function,
+    ))
+
+
+def supports(mcf: dict) -> bool:
+    """ Checks whether an MCF only uses the parts of the schema the direct
+        writer renders, i.e. the shape of item records
+    """
+    metadata = mcf.get('metadata', {})
+    identification = mcf.get('identification', {})
+    extents = identification.get('extents', {})
+    content_info = mcf.get('content_info')
+    dataquality = mcf.get('dataquality')
+
+    return (
+        mcf.get('spatial', {}).get('datatype') == 'grid'
+        and set(metadata) <= METADATA_KEYS
+        and set(identification) <= IDENTIFICATION_KEYS
+        and all(not contact for contact in mcf.get('contact', {}).values())
+        and all(set(keywords) <= {'keywords', 'keywords_type'}
+                and isinstance(keywords.get('keywords'), list)
+                for keywords in identification.get('keywords', {}).values())
+        and bool(extents.get('spatial'))
+        and all(spatial.get('crs') == 4326 and 'description' not in spatial
+                for spatial in extents['spatial'])
+        and all('resolution' not in temporal
+                for temporal in extents.get('temporal', []))
+        and bool(content_info) and content_info.get('type') == 'image'
+        and all(set(dimension) <= {'name', 'units'}
+                for dimension in content_info.get('dimensions', []))
+        and all(set(distribution) <= DISTRIBUTION_KEYS
+                for distribution in mcf.get('distribution', {}).values())
+        and (not dataquality or 'scope' in dataquality)
+        and 'acquisition' in mcf
+    )
+
+
+def write_item(mcf: dict) -> str:
+    """ Renders an item record MCF as ISO 19139-2 directly with lxml.
+        The result holds the same content as the pygeometa iso19139-2
+        template, without rendering and re-parsing the template for every
+        record.
+    """
+    metadata = mcf['metadata']
+    identification = mcf['identification']
+    contacts = mcf.get('contact', {})
+
+    header = [
+        GMD.fileIdentifier(GCO.CharacterString(
+            _value(metadata, 'identifier'))),
+        GMD.language(GMD.LanguageCode(
+            metadata['language'], codeList=LANGUAGE_CODELIST,
+            codeSpace='ISO 639-2', codeListValue=metadata['language']
+        )),
+        GMD.characterSet(_iso_code('MD_CharacterSetCode',
+                                   metadata['charset'])),
+    ]
+    if metadata.get('parentidentifier'):
+        header.append(GMD.parentIdentifier(
+            GCO.CharacterString(str(metadata['parentidentifier']))
+        ))
+    header.append(GMD.hierarchyLevel(_iso_code(
+        'MD_ScopeCode', _value(metadata, 'hierarchylevel'))))
+    header.extend(
+        GMD.contact(_contact(role)) for role in contacts
+        if role not in ('distributor', 'pointOfContact')
+    )
+    header.extend([
+        GMD.dateStamp(_date(metadata['datestamp'])),
+        GMD.metadataStandardName(GCO.CharacterString(
+            'ISO 19115:2003 - Geographic information - Metadata')),
+        GMD.metadataStandardVersion(GCO.CharacterString('ISO 19115:2003')),
+        GMD.dataSetURI(GCO.CharacterString('')),
+        GMD.spatialRepresentationInfo(),
+        _reference_system(
+            identification['extents']['spatial'][0]['crs']),
+    ])
+
+    citation = GMD.CI_Citation(
+        *_char('title', identification.get('title')),
+        *(GMD.date(GMD.CI_Date(
+            GMD.date(_date(date)),
+            GMD.dateType(_iso_code('CI_DateTypeCode', date_type)),
+        )) for date_type, date in identification['dates'].items())
+    )
+
+    language = identification['language']
+    if language in NIL_LANGUAGES:
+        language_element = GMD.language({NIL_REASON: language})
+    else:
+        language_element = GMD.language(GMD.LanguageCode(
+            language, codeList=LANGUAGE_CODELIST, codeSpace='ISO 639-2',
+            codeListValue=language
+        ))
+
+    point_of_contact = []
+    if 'pointOfContact' in contacts:
+        point_of_contact.append(GMD.pointOfContact(
+            _contact('pointOfContact')))
+
+    identification_info = GMD.identificationInfo(GMD.MD_DataIdentification(
+        GMD.citation(citation),
+        *_char('abstract', identification.get('abstract')),
+        GMD.status(_iso_code('MD_ProgressCode', identification['status'])),
+        *point_of_contact,
+        GMD.resourceMaintenance(GMD.MD_MaintenanceInformation(
+            GMD.maintenanceAndUpdateFrequency(_iso_code(
+                'MD_MaintenanceFrequencyCode',
+                identification['maintenancefrequency']
+            )),
+        )),
+        *(_keywords(keywords)
+          for keywords in identification['keywords'].values()),
+        GMD.resourceConstraints(GMD.MD_LegalConstraints(
+            GMD.accessConstraints(_iso_code('MD_RestrictionCode', '')),
+        )),
+        GMD.spatialRepresentationType(_iso_code(
+            'MD_SpatialRepresentationTypeCode', mcf['spatial']['datatype'])),
+        language_element,
+        GMD.characterSet(_iso_code('MD_CharacterSetCode',
+                                   identification['charset'])),
+        _extent(identification['extents']),
+    ))
+
+    distributor = []
+    if 'distributor' in contacts:
+        distributor.append(GMD.distributor(GMD.MD_Distributor(
+            GMD.distributorContact(_contact('distributor')),
+        )))
+    distribution_info = GMD.distributionInfo(GMD.MD_Distribution(
+        *distributor,
+        GMD.transferOptions(GMD.MD_DigitalTransferOptions(
+            *(_online_resource(distribution)
+              for distribution in mcf['distribution'].values())
+        )),
+    ))
+
+    sections = [identification_info, _content_info(mcf['content_info']),
+                distribution_info]
+
+    dataquality = mcf.get('dataquality')
+    if dataquality:
+        sections.append(GMD.dataQualityInfo(GMD.DQ_DataQuality(
+            GMD.scope(GMD.DQ_Scope(
+                GMD.level(_iso_code('MD_ScopeCode',
+                                    _value(dataquality['scope'], 'level'))),
+            )),
+            GMD.lineage(GMD.LI_Lineage(
+                *_char('statement',
+                       dataquality['lineage'].get('statement')),
+            )),
+        )))
+
+    sections.append(GMD.metadataMaintenance(GMD.MD_MaintenanceInformation(
+        GMD.maintenanceAndUpdateFrequency(_iso_code(
+            'MD_MaintenanceFrequencyCode',
+            identification['maintenancefrequency']
+        )),
+        GMD.maintenanceNote(GCO.CharacterString(MAINTENANCE_NOTE)),
+    )))
+
+    sections.append(GMI.acquisitionInformation(GMI.MI_AcquisitionInformation(
+        *(GMI.platform(GMI.MI_Platform(
+            GMI.identifier(_value(platform, 'identifier')),
+            GMI.description(_value(platform, 'description')),
+            *(GMI.instrument(GMI.MI_Instrument(
+                GMI.identifier(_value(instrument, 'identifier')),
+                GMI.type(_value(instrument, 'type')),
+            )) for instrument in platform.get('instruments', []))
+        )) for platform in mcf['acquisition']['platforms'])
+    )))
+
+    root = GMI.MI_Metadata(
+        *header, *sections, {SCHEMA_LOCATION_ATTR: SCHEMA_LOCATION}
+    )
+    return etree.tostring(root, encoding='unicode')
+
+
+def write(mcf: dict) -> str:
+    """ Renders an MCF as ISO 19139-2, directly if the writer supports its
+        shape and through pygeometa otherwise
+    """
+    if supports(mcf):
+        return write_item(mcf)
+    logger.debug('Falling back to pygeometa for ISO 19139-2 output')
+    return ISO19139_2OutputSchema().write(mcf)
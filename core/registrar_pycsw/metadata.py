@@ -3,19 +3,17 @@ import logging
 from copy import deepcopy
 from datetime import datetime
 import json
-import yaml
 import re
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, Optional
 from urllib.parse import urlencode, urljoin, uses_netloc, uses_relative
 
 from lxml import etree
-from owslib.iso import MD_Metadata
-from owslib.ogcapi.processes import Processes
-from owslib.csw import CatalogueServiceWeb
-from owslib.opensearch import OpenSearch
-from pystac_client import Client
-from pygeometa.schemas.iso19139 import ISO19139OutputSchema
-from pygeometa.schemas.iso19139_2 import ISO19139_2OutputSchema
+from pystac import Catalog
+
+from . import esa
+from .catalogue import GET_CAPABILITIES
+from .session import get_json, get_session
 
 LANGUAGE = 'eng'
 
@@ -28,6 +26,37 @@ if 's3' not in uses_relative:
     uses_relative.append('s3')
 
 
+# The dependencies of the converters (pygeometa, OWSLib, PyYAML) are
+# imported by the converters using them, so that workers registering STAC
+# items only do not pay for loading them.
+
+def _iso19139_output_schema():
+    from pygeometa.schemas.iso19139 import ISO19139OutputSchema
+    return ISO19139OutputSchema()
+
+
+def _keyword_sets(identification) -> list:
+    """ The keywords and type of the keyword sets of an OWSLib data
+        identification. Older OWSLib releases give them as dicts, newer
+        ones as `MD_Keywords` of `Keyword`.
+    """
+    keyword_sets = []
+    for kws in identification.keywords:
+        if isinstance(kws, dict):
+            keyword_sets.append((kws['keywords'], kws['type']))
+        else:
+            keyword_sets.append((
+                [getattr(kw, 'name', kw) for kw in kws.keywords], kws.type
+            ))
+    return keyword_sets
+
+
+def url_identifier(url: str) -> str:
+    """ Derives the record identifier of a service from its URL
+    """
+    return re.sub('[^a-zA-Z0-9 \n]', '-', url.rstrip('/') + '/')
+
+
 class ISOMetadata:
     def __init__(self, base_url: str):
         self.base_url = base_url.rstrip('/') + '/'
@@ -71,6 +100,8 @@ class ISOMetadata:
                  parent_identifier: Optional[str] = None) -> str:
         mcf = deepcopy(self.mcf)
 
+        import yaml
+
         now = datetime.now().isoformat()
 
         cwl = yaml.load(cwl_item, Loader=yaml.SafeLoader)
@@ -191,7 +222,7 @@ class ISOMetadata:
 
         logger.info(f'MCF: {mcf}')
 
-        iso_os = ISO19139OutputSchema()
+        iso_os = _iso19139_output_schema()
 
         return iso_os.write(mcf)
 
@@ -326,9 +357,8 @@ class ISOMetadata:
 
         logger.debug(f'MCF: {mcf}')
 
-        iso_os = ISO19139_2OutputSchema()
-
-        return iso_os.write(mcf)
+        from . import iso19139
+        return iso19139.write(mcf)
 
     def from_esa_iso_xml(self, esa_xml: bytes, inspire_xml: bytes, stac_item: str,
                          collections: list, ows_url: str) -> str:
@@ -336,14 +366,15 @@ class ISOMetadata:
         mcf = deepcopy(self.mcf)
         si = json.loads(stac_item)
 
-        exml = etree.fromstring(esa_xml)
+        product = esa.extract(esa_xml)
         ixml = etree.fromstring(inspire_xml)
 
-        product_type = exml.xpath('//PRODUCT_TYPE/text()')[0]
+        product_type = product.product_type
 
+        from owslib.iso import MD_Metadata
         m = MD_Metadata(ixml)
 
-        product_manifest = exml.xpath('//PRODUCT_URI/text()')[0]
+        product_manifest = product.product_uri or si.get('id')
         # product_manifest_link = urljoin(self.base_url, product_manifest)
 
         if si.get('id') is not None:
@@ -351,29 +382,19 @@ class ISOMetadata:
         else:
             mcf['metadata']['identifier'] = product_manifest
         mcf['metadata']['hierarchylevel'] = m.hierarchy or 'dataset'
-        mcf['metadata']['datestamp'] = exml.xpath('//Product_Info/GENERATION_TIME/text()')[0]
+        mcf['metadata']['datestamp'] = product.generation_time
 
         if product_type in collections:
             mcf['metadata']['parentidentifier'] = product_type
 
-        gfp = exml.xpath('//Global_Footprint/EXT_POS_LIST/text()')[0].split()
-
-        xlist = gfp[1::2]
-        ylist = gfp[::2]
-
-        minx = min(xlist)
-        miny = min(ylist)
-        maxx = max(xlist)
-        maxy = max(ylist)
-
         mcf['identification']['extents'] = {
             'spatial': [{
-                'bbox': [minx, miny, maxx, maxy],
+                'bbox': product.bbox,
                 'crs': 4326
             }],
             'temporal': [{
-                'begin': exml.xpath('//Product_Info/PRODUCT_START_TIME/text()')[0],
-                'end': exml.xpath('//Product_Info/PRODUCT_STOP_TIME/text()')[0]
+                'begin': product.start_time,
+                'end': product.stop_time
             }]
         }
 
@@ -386,47 +407,49 @@ class ISOMetadata:
             'publication': mcf['metadata']['datestamp']
         }
 
-        for i, kws in enumerate(m.identification[0].keywords):
+        # a list in newer OWSLib releases
+        identification = m.identification
+        if isinstance(identification, list):
+            identification = identification[0]
+
+        for i, (keywords, type_) in enumerate(_keyword_sets(identification)):
             kw_set = f'kw{i}'
 
             mcf['identification']['keywords'][kw_set] = {
-                'keywords': kws['keywords']
+                'keywords': keywords
             }
-            mcf['identification']['keywords'][kw_set]['keywords_type'] = kws['type'] or 'theme'
+            mcf['identification']['keywords'][kw_set]['keywords_type'] = type_ or 'theme'
 
-        keyword_xpaths = {
-            'eo:productType': '//PRODUCT_TYPE/text()',
-            'eo:orbitNumber': '//SENSING_ORBIT_NUMBER/text()',
-            'eo:orbitDirection': '//SENSING_ORBIT_DIRECTION/text()',
-            'eo:snowCover': '//SNOW_ICE_PERCENTAGE/text()'
+        product_keywords = {
+            'eo:productType': product.product_type,
+            'eo:orbitNumber': product.orbit_number,
+            'eo:orbitDirection': product.orbit_direction,
+            'eo:snowCover': product.snow_cover
         }
 
         mcf['identification']['keywords']['product'] = {
-            'keywords': [],
+            'keywords': [
+                f'{key}:{value}' for key, value in product_keywords.items()
+                if value is not None
+            ],
             'keywords_type': 'theme'
         }
 
-        for key, value in keyword_xpaths.items():
-            if len(exml.xpath(value)) > 0:
-                keyword = value[0]
-                mcf['identification']['keywords']['product']['keywords'].append(
-                    f"{key}:{keyword}")
-
-        mcf['identification']['topiccategory'] = [m.identification[0].topiccategory[0]]
+        mcf['identification']['topiccategory'] = [identification.topiccategory[0]]
         mcf['identification']['status'] = 'onGoing'
         mcf['identification']['maintenancefrequency'] = 'continual'
-        mcf['identification']['accessconstraints'] = m.identification[0].accessconstraints[0]
+        mcf['identification']['accessconstraints'] = identification.accessconstraints[0]
 
-        if len(exml.xpath('//Cloud_Coverage_Assessment/text()')) > 0:
-            mcf['content_info']['cloud_cover'] = exml.xpath('//Cloud_Coverage_Assessment/text()')[0]
-        mcf['content_info']['processing_level'] = exml.xpath('//PROCESSING_LEVEL/text()')[0]
+        if product.cloud_cover is not None:
+            mcf['content_info']['cloud_cover'] = product.cloud_cover
+        mcf['content_info']['processing_level'] = product.processing_level
 
-        for d in exml.xpath('//Spectral_Information_List/Spectral_Information'):
+        for band in product.bands:
             mcf['content_info']['dimensions'].append({
-                'name': d.attrib.get('physicalBand'),
-                'units': d.xpath('//CENTRAL')[0].attrib.get('unit'),
-                'min': d.xpath('//MIN/text()')[0],
-                'max': d.xpath('//MAX/text()')[0]
+                'name': band.name,
+                'units': band.units,
+                'min': band.min,
+                'max': band.max
             })
 
         mcf['distribution'][product_manifest] = {
@@ -437,7 +460,7 @@ class ISOMetadata:
             'description': 'product'
         }
 
-        product_format = exml.xpath('//Granule_List/Granule/@imageFormat')[0]
+        product_format = product.image_format
 
         if product_format == 'JPEG2000':
             mime_type = 'image/jp2'
@@ -503,10 +526,10 @@ class ISOMetadata:
 
         mcf['acquisition'] = {
             'platforms': [{
-                'identifier': exml.xpath('//SPACECRAFT_NAME/text()')[0],
-                'description': exml.xpath('//SPACECRAFT_NAME/text()')[0],
+                'identifier': product.platform,
+                'description': product.platform,
                 'instruments': [{
-                    'identifier': exml.xpath('//DATATAKE_TYPE/text()')[0],
+                    'identifier': product.instrument,
                     'type': product_type
                 }]
             }]
@@ -514,6 +537,7 @@ class ISOMetadata:
 
         logger.debug(f'MCF: {mcf}')
 
+        from pygeometa.schemas.iso19139_2 import ISO19139_2OutputSchema
         iso_os = ISO19139_2OutputSchema()
 
         return iso_os.write(mcf)
@@ -523,15 +547,15 @@ class ISOMetadata:
 
         now = datetime.now().isoformat()
 
-        ades = Processes(self.base_url)
+        landing_page = get_json(self.base_url)
 
-        mcf['metadata']['identifier'] = re.sub('[^a-zA-Z0-9 \n]', '-', self.base_url)
+        mcf['metadata']['identifier'] = url_identifier(self.base_url)
         mcf['metadata']['hierarchylevel'] = 'service'
         mcf['metadata']['datestamp'] = now
         mcf.pop('dataquality', None)
 
-        mcf['identification']['title'] = ades.response.get('title')
-        mcf['identification']['abstract'] = ades.response.get('description')
+        mcf['identification']['title'] = landing_page.get('title')
+        mcf['identification']['abstract'] = landing_page.get('description')
         mcf['identification']['dates'] = {
                 'creation': now
             }
@@ -545,13 +569,13 @@ class ISOMetadata:
             'rel': 'service',
             'url': self.base_url,
             'type': 'application/json',
-            'name': ades.response.get('title'),
-            'description': ades.response.get('description'),
+            'name': landing_page.get('title'),
+            'description': landing_page.get('description'),
             'function': 'service'
         }
 
         link_id = 0
-        for link in ades.links:
+        for link in landing_page.get('links', []):
             mcf['distribution'][str(link_id)] = {
                 'rel': link.get('rel'),
                 'url': link.get('href'),
@@ -573,26 +597,65 @@ class ISOMetadata:
 
         logger.info(f'MCF: {mcf}')
 
-        iso_os = ISO19139OutputSchema()
+        iso_os = _iso19139_output_schema()
 
         return iso_os.write(mcf)
 
     def from_oaproc(self, parent_identifier: Optional[str] = None,
-                    registration_type: Optional[str] = None) -> str:
-        mcf = deepcopy(self.mcf)
-
+                    registration_type: Optional[str] = None) -> list:
+        return list(self.iter_oaproc(parent_identifier, registration_type))
+
+    def iter_oaproc(self, parent_identifier: Optional[str] = None,
+                    registration_type: Optional[str] = None,
+                    workers: int = 8,
+                    processes: Optional[list] = None) -> Iterator[str]:
+        """ Yields the record of an OGC API - Processes service, then the
+            records of its processes as they are ready. The process list is
+            fetched unless given as `processes`, the process descriptions
+            are fetched and rendered by `workers` threads.
+        """
         now = datetime.now().isoformat()
 
-        oaproc = Processes(self.base_url)
+        landing_page = get_json(self.base_url)
+
+        oaproc_id = url_identifier(self.base_url)
+
+        yield self._oaproc_record(
+            oaproc_id, landing_page, parent_identifier, registration_type, now)
+
+        if registration_type == 'ades':
+            return
+
+        if processes is None:
+            processes = get_json(
+                urljoin(self.base_url, 'processes'))['processes']
+        if not processes:
+            return
+
+        with ThreadPoolExecutor(
+                min(workers, len(processes)),
+                thread_name_prefix='registrar-oaproc') as executor:
+            futures = [
+                executor.submit(
+                    self._process_record, oaproc_id, landing_page, process,
+                    now)
+                for process in processes
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _oaproc_record(self, oaproc_id: str, landing_page: dict,
+                       parent_identifier: Optional[str],
+                       registration_type: Optional[str], now: str) -> str:
+        mcf = deepcopy(self.mcf)
 
-        oaproc_id = re.sub('[^a-zA-Z0-9 \n]', '-', self.base_url)
         mcf['metadata']['identifier'] = oaproc_id
         mcf['metadata']['hierarchylevel'] = 'service'
         mcf['metadata']['datestamp'] = now
         mcf.pop('dataquality', None)
 
-        mcf['identification']['title'] = oaproc.response.get('title')
-        mcf['identification']['abstract'] = oaproc.response.get('description')
+        mcf['identification']['title'] = landing_page.get('title')
+        mcf['identification']['abstract'] = landing_page.get('description')
         mcf['identification']['dates'] = {
             'creation': now
         }
@@ -610,13 +673,13 @@ class ISOMetadata:
             'rel': 'service',
             'url': self.base_url,
             'type': 'application/json',
-            'name': oaproc.response.get('title'),
-            'description': oaproc.response.get('description'),
+            'name': landing_page.get('title'),
+            'description': landing_page.get('description'),
             'function': 'service'
         }
 
         link_id = 0
-        for link in oaproc.links:
+        for link in landing_page.get('links', []):
             mcf['distribution'][str(link_id)] = {
                 'rel': link.get('rel'),
                 'url': link.get('href'),
@@ -638,80 +701,87 @@ class ISOMetadata:
 
         logger.info(f'OGC API - Processes MCF: {mcf}')
 
-        iso_os = ISO19139OutputSchema()
-
-        records = []
-        records.append(iso_os.write(mcf))
-
-        if registration_type != 'ades':
-            for process in oaproc.processes():
-                mcf = {}
-                mcf = deepcopy(self.mcf)
-                mcf['metadata']['identifier'] = oaproc_id + '-' + process['id']
-                mcf['metadata']['hierarchylevel'] = 'service'
-                mcf['metadata']['datestamp'] = now
-                mcf.pop('dataquality', None)
-
-                mcf['identification']['title'] = process['title']
-                mcf['identification']['abstract'] = process['description']
-                mcf['identification']['dates'] = {
-                    'creation': now
-                }
-
-                mcf['identification']['keywords']['service'] = {
-                    'keywords': ['OGC API - Processes', 'service', 'application', 'process', 'OAProc'],
-                    'keywords_type': 'theme'
-                }
-
-                if 'keywords' in process:
-                    mcf['identification']['keywords']['default'] = {
-                        'keywords': process['keywords'],
-                        'keywords_type': 'theme'
-                    }
-
-                mcf['distribution']['http'] = {
-                    'rel': 'service',
-                    'url': self.base_url,
-                    'type': 'application/json',
-                    'name': oaproc.response['title'],
-                    'description': oaproc.response['description'],
-                    'function': 'service'
-                }
-
-                link_id = 0
-                for link in process['links']:
-                    mcf['distribution'][str(link_id)] = {
-                        'rel': link.get('rel'),
-                        'url': link.get('href'),
-                        'type': link.get('type'),
-                        'name': link.get('title'),
-                        'description': link.get('title')
-                    }
-                    link_id += 1
-
-                mcf['identification']['extents'] = {
-                    'spatial': [{
-                        'bbox': [-180, -90, 180, 90],
-                        'crs': 4326
-                    }],
-                }
-
-                mcf['metadata']['parentidentifier'] = oaproc_id
-
-                logger.info(f'Process MCF: {mcf}')
-
-                iso_os = ISO19139OutputSchema()
-
-                records.append(iso_os.write(mcf))
-
-        return records
+        iso_os = _iso19139_output_schema()
+
+        return iso_os.write(mcf)
+
+    def _process_record(self, oaproc_id: str, landing_page: dict,
+                        process: dict, now: str) -> str:
+        """ Renders the record of a process from its description, or from
+            its summary in the process list if the description cannot be
+            fetched
+        """
+        try:
+            process = dict(process, **get_json(
+                urljoin(self.base_url, f'processes/{process["id"]}')))
+        except Exception as err:
+            logger.warning(
+                f'Using the summary of process {process["id"]}: {err}')
+
+        mcf = deepcopy(self.mcf)
+        mcf['metadata']['identifier'] = oaproc_id + '-' + process['id']
+        mcf['metadata']['hierarchylevel'] = 'service'
+        mcf['metadata']['datestamp'] = now
+        mcf.pop('dataquality', None)
+
+        mcf['identification']['title'] = process['title']
+        mcf['identification']['abstract'] = process['description']
+        mcf['identification']['dates'] = {
+            'creation': now
+        }
+
+        mcf['identification']['keywords']['service'] = {
+            'keywords': ['OGC API - Processes', 'service', 'application', 'process', 'OAProc'],
+            'keywords_type': 'theme'
+        }
+
+        if 'keywords' in process:
+            mcf['identification']['keywords']['default'] = {
+                'keywords': process['keywords'],
+                'keywords_type': 'theme'
+            }
+
+        mcf['distribution']['http'] = {
+            'rel': 'service',
+            'url': self.base_url,
+            'type': 'application/json',
+            'name': landing_page['title'],
+            'description': landing_page['description'],
+            'function': 'service'
+        }
+
+        link_id = 0
+        for link in process['links']:
+            mcf['distribution'][str(link_id)] = {
+                'rel': link.get('rel'),
+                'url': link.get('href'),
+                'type': link.get('type'),
+                'name': link.get('title'),
+                'description': link.get('title')
+            }
+            link_id += 1
+
+        mcf['identification']['extents'] = {
+            'spatial': [{
+                'bbox': [-180, -90, 180, 90],
+                'crs': 4326
+            }],
+        }
+
+        mcf['metadata']['parentidentifier'] = oaproc_id
+
+        logger.info(f'Process MCF: {mcf}')
+
+        iso_os = _iso19139_output_schema()
+
+        return iso_os.write(mcf)
 
     def from_oarec(self, landing_page: dict, is_stac_api: bool = False) -> str:
         mcf = deepcopy(self.mcf)
 
         now = datetime.now().isoformat()
 
-        oarec_id = re.sub('[^a-zA-Z0-9 \n]', '-', self.base_url)
+        oarec_id = url_identifier(self.base_url)
         mcf['metadata']['identifier'] = oarec_id
         mcf['metadata']['hierarchylevel'] = 'service'
         mcf['metadata']['datestamp'] = now
@@ -762,24 +832,40 @@ class ISOMetadata:
 
         logger.info(f'MCF: {mcf}')
 
-        iso_os = ISO19139OutputSchema()
+        iso_os = _iso19139_output_schema()
 
         return iso_os.write(mcf)
 
-    def from_csw(self) -> str:
+    def from_csw(self, capabilities: Optional[bytes] = None) -> str:
         mcf = deepcopy(self.mcf)
 
         now = datetime.now().isoformat()
-        capabilities = CatalogueServiceWeb(self.base_url)
+        if capabilities is None:
+            response = get_session().get(
+                self.base_url, params=GET_CAPABILITIES)
+            response.raise_for_status()
+            capabilities = response.content
+
+        caps = etree.fromstring(capabilities)
+        si = caps.find('{*}ServiceIdentification')
+        # the ServiceIdentification section is optional
+        if si is not None:
+            from owslib.ows import ServiceIdentification
+            identification = ServiceIdentification(
+                si, etree.QName(si).namespace)
+            title = identification.title
+            abstract = identification.abstract
+        else:
+            title = abstract = None
 
-        csw_id = re.sub('[^a-zA-Z0-9 \n]', '-', self.base_url)
+        csw_id = url_identifier(self.base_url)
         mcf['metadata']['identifier'] = csw_id
         mcf['metadata']['hierarchylevel'] = 'service'
         mcf['metadata']['datestamp'] = now
         mcf.pop('dataquality', None)
 
-        mcf['identification']['title'] = capabilities.identification.title
-        mcf['identification']['abstract'] = capabilities.identification.abstract
+        mcf['identification']['title'] = title
+        mcf['identification']['abstract'] = abstract
         mcf['identification']['dates'] = {
             'creation': now
         }
@@ -795,8 +881,8 @@ class ISOMetadata:
             'rel': 'service',
             'url': self.base_url,
             'type': 'application/xml',
-            'name': capabilities.identification.title,
-            'description': capabilities.identification.abstract,
+            'name': title,
+            'description': abstract,
             'function': 'service'
         }
 
@@ -809,17 +895,20 @@ class ISOMetadata:
 
         logger.info(f'MCF: {mcf}')
 
-        iso_os = ISO19139OutputSchema()
+        iso_os = _iso19139_output_schema()
 
         return iso_os.write(mcf)
 
-    def from_stac_catalog(self, url: str) -> str:
+    def from_stac_catalog(self, url: str,
+                          catalog: Optional[dict] = None) -> str:
         mcf = deepcopy(self.mcf)
 
         now = datetime.now().isoformat()
-        client = Client.open(url)
+        if catalog is None:
+            catalog = get_json(url)
+        client = Catalog.from_dict(catalog, href=url)
 
-        # api_id = re.sub('[^a-zA-Z0-9 \n]', '-', self.base_url)
+        # api_id = url_identifier(self.base_url)
         mcf['metadata']['identifier'] = client.id
         mcf['metadata']['hierarchylevel'] = 'dataset'
         mcf['metadata']['datestamp'] = now
@@ -867,7 +956,7 @@ class ISOMetadata:
 
         logger.info(f'MCF: {mcf}')
 
-        iso_os = ISO19139OutputSchema()
+        iso_os = _iso19139_output_schema()
 
         return iso_os.write(mcf)
 
@@ -915,17 +1004,23 @@ class ISOMetadata:
 
         logger.debug(f'MCF: {mcf}')
 
-        iso_os = ISO19139OutputSchema()
+        iso_os = _iso19139_output_schema()
 
         return iso_os.write(mcf)
 
-    def from_opensearch(self, url: str) -> str:
+    def from_opensearch(self, url: str,
+                        description: Optional[bytes] = None) -> str:
         mcf = deepcopy(self.mcf)
 
         now = datetime.now().isoformat()
-        osearch = OpenSearch(url)
-
-        os_id = re.sub('[^a-zA-Z0-9 \n]', '-', self.base_url)
+        if description is None:
+            response = get_session().get(url)
+            response.raise_for_status()
+            description = response.content
+        from owslib.opensearch import OpenSearch
+        osearch = OpenSearch(url, xml=description)
+
+        os_id = url_identifier(self.base_url)
         mcf['metadata']['identifier'] = os_id
         mcf['metadata']['hierarchylevel'] = 'service'
         mcf['metadata']['datestamp'] = now
@@ -962,7 +1057,7 @@ class ISOMetadata:
 
         logger.info(f'MCF: {mcf}')
 
-        iso_os = ISO19139OutputSchema()
+        iso_os = _iso19139_output_schema()
 
         return iso_os.write(mcf)
 
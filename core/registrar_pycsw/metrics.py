@@ -0,0 +1,74 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+
+# With PROMETHEUS_MULTIPROC_DIR set, as in the registrar image, the values
+# are written to files in that directory and aggregated over all processes
+# by the exporter.
+
+# A batch of records is written in a single one of the stages 'insert',
+# 'update' and 'upsert', so their sum is the time spent writing. Batches
+# with new records are timed as 'insert' and batches of updates only as
+# 'update', while 'upsert' times the batches written with the native
+# upsert of PostgreSQL or SQLite, which tells the two apart only once
+# written. The records are counted by operation in RECORDS either way.
+STAGES = (
+    'fetch', 'convert', 'parse_record', 'query_ids',
+    'insert', 'update', 'upsert', 'delete',
+)
+
+STAGE_SECONDS = Histogram(
+    'registrar_pycsw_stage_seconds',
+    'Time spent in a stage of the registration of metadata records',
+    ['backend', 'stage', 'converter'],
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+)
+
+STAGE_FAILURES = Counter(
+    'registrar_pycsw_stage_failures_total',
+    'Failures of a stage of the registration of metadata records',
+    ['backend', 'stage', 'converter']
+)
+
+FETCHED_BYTES = Counter(
+    'registrar_pycsw_fetched_bytes_total',
+    'Bytes of metadata documents fetched from sources or over HTTP',
+    ['backend']
+)
+
+RECORDS = Counter(
+    'registrar_pycsw_records_total',
+    'Records written to the repository, by operation. Records left as '
+    'they were because their source did not change are counted as '
+    'skipped.',
+    ['backend', 'operation']
+)
+
+
+@contextmanager
+def stage(backend: str, name: str, converter: str = ''):
+    """ Times the enclosed block as a stage of a backend and counts it as
+        failed if it raises. `converter` names the converter of a
+        'convert' stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_FAILURES.labels(backend, name, converter).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(backend, name, converter).observe(
+            time.perf_counter() - start)
+
+
+def fetched(backend: str, size: int):
+    FETCHED_BYTES.labels(backend).inc(size)
+
+
+def written(backend: str, operation: str, count: int = 1):
+    """ Counts records 'inserted', 'updated', 'deleted' or 'skipped'
+    """
+    if count:
+        RECORDS.labels(backend, operation).inc(count)
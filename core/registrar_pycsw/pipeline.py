@@ -0,0 +1,146 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from pystac import Item
+from registrar.source import Source
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class RegistrationPipeline:
+    """ Registers items concurrently. A pool of worker threads fetches and
+        converts items, and a single writer thread drains the results into
+        the repository of the backend in batches.
+
+        Results are written in submission order, so a register followed by
+        a deregister of the same identifier is applied in that order. The
+        producer is blocked while more than `max_inflight_bytes` of
+        converted metadata wait to be written, or while `queue_size` items
+        are pending.
+    """
+
+    def __init__(self, backend, workers: int = 4,
+                 max_inflight_bytes: int = 64 * 1024 * 1024,
+                 queue_size: Optional[int] = None):
+        self.backend = backend
+        self.max_inflight_bytes = max_inflight_bytes
+        self.failed = []
+
+        self._inflight_bytes = 0
+        self._inflight = threading.Condition()
+        self._queue = queue.Queue(queue_size or workers * 4)
+        self._executor = ThreadPoolExecutor(
+            workers, thread_name_prefix='registrar-convert'
+        )
+        self._writer = threading.Thread(
+            target=self._write, name='registrar-writer', daemon=True
+        )
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def register(self, source: Optional[Source], item: Item):
+        with self._inflight:
+            self._inflight.wait_for(
+                lambda: self._inflight_bytes < self.max_inflight_bytes
+            )
+        future = self._executor.submit(self._convert, source, item)
+        self._queue.put(('register', item.id, future))
+
+    def deregister(self, identifier: str):
+        future = Future()
+        future.set_result(None)
+        self._queue.put(('deregister', identifier, future))
+
+    def close(self):
+        """ Waits for all submitted items to be written
+        """
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._executor.shutdown()
+
+    def _convert(self, source: Optional[Source], item: Item):
+        metadata = self.backend.get_metadata(source, item)
+        size = len(metadata.encode('utf-8')) \
+            if isinstance(metadata, str) else len(metadata)
+        with self._inflight:
+            self._inflight_bytes += size
+        return metadata, size
+
+    def _release(self, size: int):
+        with self._inflight:
+            self._inflight_bytes -= size
+            self._inflight.notify_all()
+
+    def _flush(self, batch: list):
+        if not batch:
+            return
+        try:
+            self._upsert(batch)
+        finally:
+            self._release(sum(size for _, _, size in batch))
+        batch.clear()
+
+    def _upsert(self, batch: list):
+        """ Upserts a batch, splitting it in halves if it fails until the
+            failing records are isolated
+        """
+        try:
+            self.backend.upsert_many(metadata for _, metadata, _ in batch)
+        except Exception as err:
+            if len(batch) == 1:
+                logger.error(f'writing {batch[0][0]} failed: {err}')
+                self.failed.append(batch[0][0])
+                return
+            logger.warning(
+                f'writing batch of {len(batch)} records failed, '
+                f'retrying in halves: {err}'
+            )
+            middle = len(batch) // 2
+            self._upsert(batch[:middle])
+            self._upsert(batch[middle:])
+
+    def _write(self):
+        batch = []
+        while True:
+            try:
+                # flush a partial batch once no more results arrive
+                entry = self._queue.get(
+                    timeout=self.backend.flush_interval if batch else None
+                )
+            except queue.Empty:
+                self._flush(batch)
+                continue
+
+            if entry is _STOP:
+                self._flush(batch)
+                return
+
+            action, identifier, future = entry
+            try:
+                result = future.result()
+            except Exception as err:
+                logger.error(f'converting {identifier} failed: {err}')
+                self.failed.append(identifier)
+                continue
+
+            if action == 'register':
+                batch.append((identifier, *result))
+                if len(batch) >= self.backend.batch_size:
+                    self._flush(batch)
+            else:
+                self._flush(batch)
+                try:
+                    self.backend.deregister_identifier(identifier)
+                except Exception as err:
+                    logger.error(f'deregistering {identifier} failed: {err}')
+                    self.failed.append(identifier)
@@ -0,0 +1,108 @@
+import cProfile
+import functools
+import logging
+import os
+import random
+import re
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# defaults of the profiling options of the backends
+PROFILE_DIR_ENV = 'REGISTRAR_PYCSW_PROFILE_DIR'
+PROFILE_FRACTION_ENV = 'REGISTRAR_PYCSW_PROFILE_FRACTION'
+PROFILE_PATTERN_ENV = 'REGISTRAR_PYCSW_PROFILE_PATTERN'
+
+
+def _safe(value: str) -> str:
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', value)[:100]
+
+
+class Profiler:
+    """ Profiles selected registrations with cProfile and dumps each
+        profile to `directory` as a `.pstats` file named after the backend,
+        the identifier and the converter branch of the registration.
+
+        A registration is profiled if its identifier matches the regular
+        expression `pattern`, or else with a probability of `fraction`.
+    """
+
+    def __init__(self, directory: str, fraction: float = 0.0,
+                 pattern: Optional[str] = None):
+        self.directory = directory
+        self.fraction = fraction
+        self.pattern = re.compile(pattern) if pattern else None
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_options(cls, directory: Optional[str] = None,
+                     fraction: Optional[float] = None,
+                     pattern: Optional[str] = None) -> Optional['Profiler']:
+        """ Creates a profiler from the backend options, falling back to
+            the REGISTRAR_PYCSW_PROFILE_* environment variables. Returns
+            None if no directory is configured or nothing would be
+            profiled.
+        """
+        directory = directory or os.environ.get(PROFILE_DIR_ENV)
+        if fraction is None:
+            fraction = float(os.environ.get(PROFILE_FRACTION_ENV) or 0)
+        pattern = pattern or os.environ.get(PROFILE_PATTERN_ENV)
+        if not directory or not (fraction > 0 or pattern):
+            return None
+        return cls(directory, fraction, pattern)
+
+    def selects(self, identifier: str) -> bool:
+        if self.pattern is not None and self.pattern.search(identifier):
+            return True
+        return self.fraction > 0 and random.random() < self.fraction
+
+    def run(self, backend: str, identifier: str, branch: str,
+            function, *args, **kwargs):
+        """ Calls `function` under the profiler and dumps the profile, also
+            if the call raises
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as err:
+            # only one profiler can be active at a time
+            logger.warning(f'Not profiling {identifier}: {err}')
+            return function(*args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            path = os.path.join(self.directory, '-'.join((
+                _safe(backend), _safe(identifier), _safe(branch),
+                f'{int(time.time() * 1000)}', f'{os.getpid()}'
+            )) + '.pstats')
+            profile.dump_stats(path)
+            logger.info(
+                f'Profiled registration of {identifier} ({elapsed:.3f}s) '
+                f'to {path}'
+            )
+
+
+def profiled(register):
+    """ Decorates the `register` method of a backend to profile the
+        registrations selected by the profiler of the backend
+    """
+    @functools.wraps(register)
+    def wrapper(self, source, item, *args, **kwargs):
+        profiler = self.profiler
+        if profiler is None:
+            return register(self, source, item, *args, **kwargs)
+
+        identifier = self._profile_identifier(item)
+        if not profiler.selects(identifier):
+            return register(self, source, item, *args, **kwargs)
+
+        return profiler.run(
+            type(self).__name__, identifier, self._converter_branch(item),
+            register, self, source, item, *args, **kwargs
+        )
+    return wrapper
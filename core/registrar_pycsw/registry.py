@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+from typing import Optional, Tuple
+
+import pycsw.core.config
+from pycsw.core import repository
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from .index import RepositoryIndex
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+# context and repository by database URI
+_repositories = {}
+
+# identifier index by database URI
+_indexes = {}
+
+
+def _create_engine(database_uri: str, pool_size: Optional[int],
+                   max_overflow: Optional[int], pool_pre_ping: bool,
+                   pool_recycle: Optional[int]):
+    """ Creates the engine of a database with the given pool options
+    """
+    options = {'pool_pre_ping': pool_pre_ping}
+    if pool_size is not None:
+        options['pool_size'] = pool_size
+    if max_overflow is not None:
+        options['max_overflow'] = max_overflow
+    if pool_recycle is not None:
+        options['pool_recycle'] = pool_recycle
+    logger.info(f'Creating database engine with {options}')
+    return create_engine(database_uri, **options)
+
+
+def get_repository(database_uri: str, pool_size: Optional[int] = None,
+                   max_overflow: Optional[int] = None,
+                   pool_pre_ping: bool = True,
+                   pool_recycle: Optional[int] = None
+                   ) -> Tuple[pycsw.core.config.StaticContext,
+                              repository.Repository]:
+    """ Returns the pycsw context and repository of a database, shared by
+        all backends of the process so they use a single engine and
+        connection pool. The pool options of the first call for a
+        database apply.
+
+        The session of the repository is scoped to the calling thread, so
+        the repository may be used by several threads at once, each in
+        its own transactions.
+    """
+    with _lock:
+        if database_uri not in _repositories:
+            logger.debug('Setting up static context')
+            context = pycsw.core.config.StaticContext()
+
+            # pycsw memoizes its engines by URI, an engine with the pool
+            # options is put in place before pycsw sets up the repository
+            # on it. SQLite engines are left to pycsw as they need its SQL
+            # functions and do not pool connections to a server.
+            engines = repository.Repository._engines
+            if not database_uri.startswith('sqlite'):
+                if database_uri in engines:
+                    logger.warning(
+                        'pycsw already created an engine for the database, '
+                        'the pool options do not apply')
+                else:
+                    engines[database_uri] = _create_engine(
+                        database_uri, pool_size, max_overflow,
+                        pool_pre_ping, pool_recycle)
+
+            logger.debug('Initializing pycsw repository')
+            repo = repository.Repository(
+                database_uri, context, table='records')
+
+            # the autocommit session pycsw creates, one per thread
+            repo.session.close()
+            repo.session = scoped_session(sessionmaker(
+                bind=repo.engine, autocommit=True, autoflush=False,
+                expire_on_commit=False))
+
+            _repositories[database_uri] = (context, repo)
+        return _repositories[database_uri]
+
+
+def get_identifier_index(database_uri: str, capacity: int = 10_000_000,
+                         error_rate: float = 0.01,
+                         refresh_interval: float = 60) -> RepositoryIndex:
+    """ Returns the identifier index of the records of a database, built
+        once and shared by all backends of the process. The options of the
+        first call for a database apply.
+    """
+    context, repo = get_repository(database_uri)
+    with _lock:
+        if database_uri not in _indexes:
+            mappings = context.md_core_model['mappings']
+            _indexes[database_uri] = RepositoryIndex(
+                repo.engine, repo.dataset.__table__,
+                mappings['pycsw:Identifier'], mappings['pycsw:InsertDate'],
+                capacity, error_rate, refresh_interval
+            )
+        return _indexes[database_uri]
+
+
+def clear():
+    """ Closes the sessions of the shared repositories and drops them along
+        with the shared indexes, so the next backends set them up anew
+    """
+    with _lock:
+        for _, repo in _repositories.values():
+            repo.session.remove()
+        _repositories.clear()
+        _indexes.clear()
+
+
+def _after_fork():
+    """ Gives a forked process connection pools of its own. The connections
+        of the parent are left open for the parent, and the indexes, whose
+        locks may be held by threads that do not exist in the child, are
+        built anew.
+    """
+    global _lock
+    _lock = threading.Lock()
+    for _, repo in _repositories.values():
+        repo.engine.dispose(close=False)
+        # sessions of the forking thread are bound to the former pool
+        repo.session.registry.clear()
+    _indexes.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
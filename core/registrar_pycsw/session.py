@@ -0,0 +1,129 @@
+import logging
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 30
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+RETRIES = 3
+
+JSON_HEADERS = {'Accept': 'application/json'}
+
+_lock = threading.Lock()
+_session = None
+# the settings the session was configured with, if it was
+_settings = None
+_opened = 0
+_checkouts = 0
+
+
+def _count(opened: int = 0, checkouts: int = 0):
+    global _opened, _checkouts
+    with _lock:
+        _opened += opened
+        _checkouts += checkouts
+
+
+class _CountingPoolMixIn:
+    def _get_conn(self, *args, **kwargs):
+        _count(checkouts=1)
+        return super()._get_conn(*args, **kwargs)
+
+    def _new_conn(self, *args, **kwargs):
+        _count(opened=1)
+        return super()._new_conn(*args, **kwargs)
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixIn, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixIn, HTTPSConnectionPool):
+    pass
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+
+class PooledSession(requests.Session):
+    """ requests Session with keep-alive connection pools per host, a
+        default timeout and retries on connection errors
+    """
+
+    def __init__(self, timeout: float = TIMEOUT,
+                 pool_connections: int = POOL_CONNECTIONS,
+                 pool_maxsize: int = POOL_MAXSIZE, retries: int = RETRIES):
+        super().__init__()
+        self.timeout = timeout
+        adapter = _CountingHTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            max_retries=retries
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def configure(timeout: float = TIMEOUT,
+              pool_connections: int = POOL_CONNECTIONS,
+              pool_maxsize: int = POOL_MAXSIZE, retries: int = RETRIES):
+    """ Configures the process wide session. The first configuration
+        applies, later ones with other settings are ignored with a warning
+        as the session is already shared.
+    """
+    global _session, _settings
+    settings = {
+        'timeout': timeout, 'pool_connections': pool_connections,
+        'pool_maxsize': pool_maxsize, 'retries': retries,
+    }
+    with _lock:
+        if _settings is not None:
+            if settings != _settings:
+                logger.warning(
+                    f'Ignoring HTTP session settings {settings}, the '
+                    f'session is configured with {_settings}'
+                )
+            return
+        # a session created with the defaults before is left to the
+        # requests it may still serve
+        _session = PooledSession(**settings)
+        _settings = settings
+
+
+def get_session() -> PooledSession:
+    """ Returns the process wide session shared by all remote converters
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = PooledSession()
+        return _session
+
+
+def get_json(url: str, params: Optional[dict] = None):
+    response = get_session().get(url, params=params, headers=JSON_HEADERS)
+    response.raise_for_status()
+    return response.json()
+
+
+def connection_stats() -> dict:
+    """ Returns the number of connections opened and reused since startup
+    """
+    with _lock:
+        return {'opened': _opened, 'reused': _checkouts - _opened}
@@ -0,0 +1,39 @@
+import copy
+import logging
+from typing import IO, Iterator
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# elements holding one metadata record each
+RECORD_TAGS = (
+    '{http://www.isotc211.org/2005/gmd}MD_Metadata',
+    '{http://www.isotc211.org/2005/gmi}MI_Metadata',
+    '{http://www.opengis.net/cat/csw/2.0.2}Record',
+)
+
+
+def iter_records(f: IO[bytes], tags: tuple = RECORD_TAGS
+                 ) -> Iterator[etree._Element]:
+    """ Yields the metadata records of an XML document one at a time, as
+        standalone elements. The document may be a single record or any
+        wrapper holding many of them, such as a CSW GetRecordsResponse.
+
+        Records are detached copies and are dropped from the parse tree
+        once yielded, so memory use does not grow with the document size.
+    """
+    for _, element in etree.iterparse(f, events=('end',), tag=tags,
+                                      huge_tree=True):
+        # records nested in a record are part of their parent
+        if any(ancestor.tag in tags for ancestor in element.iterancestors()):
+            continue
+
+        yield copy.deepcopy(element)
+
+        element.clear(keep_tail=False)
+        parent = element.getparent()
+        if parent is not None:
+            # drop the records and whatever came before them
+            while element.getprevious() is not None:
+                del parent[0]
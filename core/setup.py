@@ -15,6 +15,12 @@ setup(
     url="https://github.com/EOEPCA/rm-data-access/tree/master/core",
     packages=find_packages(),
     include_package_data=True,
+    install_requires=[
+        'prometheus_client',
+    ],
+    extras_require={
+        'test': ['pytest', 'pytest-benchmark'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -0,0 +1,350 @@
+""" Benchmarks of the converters, of the repository writes and of the
+    identifier index warm-up, run with pytest-benchmark from the `core`
+    directory:
+
+    python -m pytest tests/benchmark.py --benchmark-autosave
+    python -m pytest tests/benchmark.py --benchmark-compare \
+        --benchmark-compare-fail=mean:10%
+
+    On top of the timings of pytest-benchmark, every benchmark reports the
+    throughput in records/s, the p50 and p99 latency of one operation and
+    the peak memory allocated by one operation in its extra info, which
+    `--benchmark-json` and the saved runs include.
+
+    Every round of the repository benchmarks writes records with fresh
+    identifiers, so they time the conversion and the upsert rather than
+    the skipping of unchanged records.
+
+    The parse benchmarks of a fixture share a group, so the table of the
+    group gives the speed-up of format sniffing and of the declared
+    content type over the former try-JSON-then-XML parsing.
+"""
+import functools
+import http.server
+import itertools
+import json
+import os
+import shutil
+import threading
+import tracemalloc
+
+import pytest
+from lxml import etree
+from pystac import Item
+
+from registrar_pycsw import formats
+from registrar_pycsw.metadata import ISOMetadata, STACMetadata
+
+THISDIR = os.path.dirname(os.path.realpath(__file__))
+
+STAC_ITEM = 'INDEX_S2A_MSIL2A_20191216T004701_N0213_R102_T53HPA_20191216T024808.json'  # noqa: E501
+
+NAMESPACES = {
+    'gco': 'http://www.isotc211.org/2005/gco',
+    'gmd': 'http://www.isotc211.org/2005/gmd',
+}
+
+# rounds of the repository benchmarks, each writes new records
+ROUNDS = int(os.environ.get('REGISTRAR_BENCHMARK_ROUNDS', 50))
+BATCH_SIZE = 50
+
+
+def read(filename):
+    with open(os.path.join(THISDIR, 'data', filename), 'rb') as fh:
+        return fh.read()
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def report(benchmark, operation, records: int = 1):
+    """ Adds the throughput, the latency percentiles and the peak memory of
+        one call of `operation` to the extra info of a benchmark
+    """
+    # no stats with --benchmark-disable
+    if benchmark.stats is not None:
+        stats = benchmark.stats.stats
+        benchmark.extra_info['records_per_second'] = records / stats.mean
+        benchmark.extra_info['p50_ms'] = percentile(stats.data, 50) * 1000
+        benchmark.extra_info['p99_ms'] = percentile(stats.data, 99) * 1000
+
+    # traced apart from the timed rounds, tracing slows down the code
+    tracemalloc.start()
+    try:
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['peak_memory_kb'] = peak / 1024
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Serves an OGC API - Processes service from the fixtures
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path == '/ades':
+            body = read('oaproc-landing-page.json')
+        elif path == '/ades/processes':
+            body = read('oaproc-processes.json')
+        else:
+            identifier = path.rsplit('/', 1)[-1]
+            processes = json.loads(read('oaproc-processes.json'))['processes']
+            body = json.dumps(next(
+                process for process in processes
+                if process['id'] == identifier
+            )).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope='module')
+def oaproc_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/ades'
+    server.shutdown()
+
+
+def converter_cases():
+    cwl = read('app-s-expression.dev.0.0.2.cwl').decode()
+    stac_item = read(STAC_ITEM).decode()
+    esa_xml = read('MTD_MSIL2A.xml')
+    inspire_xml = read('INSPIRE.xml')
+    collection = json.loads(read('stac-collection.json'))
+    catalog = json.loads(read('stac-catalog.json'))
+    landing_page = json.loads(read('oarec-landing-page.json'))
+    capabilities = read('csw-capabilities.xml')
+    description = read('opensearch-description.xml')
+    iso = ISOMetadata('https://example.org')
+    stac = STACMetadata('https://example.org')
+
+    return {
+        'ISOMetadata.from_cwl': lambda: iso.from_cwl(
+            cwl, 'https://example.org/public'),
+        'ISOMetadata.from_esa_iso_xml': lambda: iso.from_esa_iso_xml(
+            esa_xml, inspire_xml, stac_item, ['S2MSI2A'],
+            'https://example.org/ows'),
+        'ISOMetadata.from_stac_item': lambda: iso.from_stac_item(
+            stac_item, ['S2MSI2A'], 'https://example.org/ows'),
+        'ISOMetadata.from_stac_collection': lambda: iso.from_stac_collection(
+            collection),
+        'ISOMetadata.from_stac_catalog': lambda: iso.from_stac_catalog(
+            'https://example.org/catalog.json', catalog),
+        'ISOMetadata.from_oarec': lambda: iso.from_oarec(
+            landing_page, is_stac_api=True),
+        'ISOMetadata.from_csw': lambda: iso.from_csw(capabilities),
+        'ISOMetadata.from_opensearch': lambda: iso.from_opensearch(
+            'https://example.org/opensearch', description),
+        'STACMetadata.from_stac_item': lambda: stac.from_stac_item(
+            stac_item, 'https://example.org/ows'),
+        'STACMetadata.from_stac_collection':
+            lambda: stac.from_stac_collection(collection),
+    }
+
+
+CONVERTERS = converter_cases()
+
+
+@pytest.mark.parametrize('name', sorted(CONVERTERS))
+def test_converter(benchmark, name):
+    benchmark.group = 'converters'
+    benchmark(CONVERTERS[name])
+    report(benchmark, CONVERTERS[name])
+
+
+@pytest.mark.parametrize('name', ['from_ades', 'from_oaproc'])
+def test_oaproc_converter(benchmark, oaproc_url, name):
+    """ The OGC API - Processes converters, against a local service
+        describing 10 processes
+    """
+    benchmark.group = 'converters'
+    operation = getattr(ISOMetadata(oaproc_url), name)
+    benchmark(operation)
+    report(benchmark, operation)
+
+
+# fixtures and the content types the backends declare for them
+PARSE_FIXTURES = {
+    'INSPIRE.xml': formats.XML_CONTENT_TYPE,
+    'MTD_MSIL2A.xml': formats.XML_CONTENT_TYPE,
+    STAC_ITEM: formats.JSON_CONTENT_TYPE,
+}
+
+
+def legacy_parse(md):
+    """ The parsing done by `PycswMixIn._parse_metadata` before sniffing
+    """
+    try:
+        return 'json', json.loads(md)
+    except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+        try:
+            return 'xml', etree.fromstring(md)
+        except Exception:
+            return 'xml', etree.fromstring(bytes(md, encoding='utf-8'))
+
+
+PARSERS = {
+    'legacy': lambda md, content_type: legacy_parse(md),
+    'sniffed': lambda md, content_type: formats.parse_document(md),
+    'declared': formats.parse_document,
+}
+
+
+@pytest.mark.parametrize('parser', list(PARSERS))
+# converters hand over text, fetched documents are bytes
+@pytest.mark.parametrize('text', [False, True], ids=['bytes', 'str'])
+@pytest.mark.parametrize('fixture', list(PARSE_FIXTURES))
+def test_parse_document(benchmark, fixture, text, parser):
+    benchmark.group = f'parse {fixture[:40]} ({"str" if text else "bytes"})'
+    md = read(fixture)
+    if text:
+        md = md.decode()
+    content_type = PARSE_FIXTURES[fixture]
+    operation = functools.partial(PARSERS[parser], md, content_type)
+    benchmark(operation)
+    report(benchmark, operation)
+
+
+def iso_record(identifier: str) -> bytes:
+    """ The INSPIRE fixture with a distinct file identifier
+    """
+    exml = etree.fromstring(read('INSPIRE.xml'))
+    exml.xpath('gmd:fileIdentifier/gco:CharacterString',
+               namespaces=NAMESPACES)[0].text = identifier
+    return etree.tostring(exml, xml_declaration=True, encoding='UTF-8')
+
+
+class DirectorySource:
+    """ Local stand-in of a registrar Source
+    """
+    def __init__(self, root: str):
+        self.root = root
+
+    def get_file(self, path: str, target_path: str):
+        shutil.copy(os.path.join(self.root, path), target_path)
+
+
+@pytest.fixture
+def item_backend(tmp_path):
+    try:
+        from registrar_pycsw.backend import ItemBackend
+        from registrar_pycsw import registry
+    except Exception as err:
+        # pycsw and the registrar come with the registrar image
+        pytest.skip(f'The backends cannot be imported: {err}')
+
+    database = f'sqlite:///{tmp_path / "records.db"}'
+    try:
+        from pycsw.core.repository import setup
+        setup(database, 'records')
+    except ImportError:
+        from pycsw.core import admin
+        admin.setup_db(database, 'records', str(tmp_path))
+
+    yield ItemBackend(database, ows_url='https://example.org/ows',
+                      batch_size=BATCH_SIZE)
+    registry.clear()
+
+
+def fresh(records: int):
+    """ Returns a function making `records` ISO records with identifiers
+        never used before, for the setup of every round
+    """
+    counter = itertools.count()
+
+    def make():
+        return [
+            iso_record(f'record-{next(counter)}') for _ in range(records)
+        ]
+    return make
+
+
+def test_parse_and_upsert_metadata(benchmark, item_backend):
+    benchmark.group = 'repository (sqlite)'
+    make = fresh(1)
+    benchmark.pedantic(
+        item_backend._parse_and_upsert_metadata,
+        setup=lambda: (tuple(make()), {}), rounds=ROUNDS)
+    report(benchmark,
+           lambda: item_backend._parse_and_upsert_metadata(make()[0]))
+
+
+def test_upsert_many(benchmark, item_backend):
+    benchmark.group = 'repository (sqlite)'
+    make = fresh(BATCH_SIZE)
+    benchmark.pedantic(
+        item_backend.upsert_many,
+        setup=lambda: ((make(),), {}), rounds=ROUNDS)
+    report(benchmark, lambda: item_backend.upsert_many(make()), BATCH_SIZE)
+
+
+def test_item_backend_register(benchmark, item_backend, tmp_path):
+    """ Full registration of items referencing ISO metadata on a local
+        source
+    """
+    benchmark.group = 'repository (sqlite)'
+    source = DirectorySource(str(tmp_path / 'source'))
+    os.mkdir(source.root)
+    stac_item = json.loads(read(STAC_ITEM))
+    stac_item['stac_version'] = '1.0.0'
+    stac_item.pop('stac_extensions', None)
+    stac_item['links'] = []
+    counter = itertools.count()
+
+    def make():
+        identifier = f'item-{next(counter)}'
+        with open(os.path.join(source.root, f'{identifier}.xml'), 'wb') as f:
+            f.write(iso_record(identifier))
+        stac_item['id'] = identifier
+        stac_item['assets'] = {
+            'iso-metadata': {
+                'href': f'{identifier}.xml', 'roles': ['metadata']
+            }
+        }
+        return (source, Item.from_dict(stac_item), True), {}
+
+    benchmark.pedantic(item_backend.register, setup=make, rounds=ROUNDS)
+    report(benchmark, lambda: item_backend.register(*make()[0]))
+
+
+# identifiers in the table of the identifier index warm-up
+INDEX_RECORDS = int(os.environ.get('REGISTRAR_BENCHMARK_INDEX_RECORDS',
+                                   100_000))
+
+
+def test_identifier_index_rebuild(benchmark, tmp_path):
+    """ Warm-up of the identifier index, reading the identifiers of the
+        records table and filling the filter
+    """
+    from sqlalchemy import Column, MetaData, String, Table, create_engine
+    from registrar_pycsw.index import RepositoryIndex
+
+    benchmark.group = 'identifier index (sqlite)'
+    engine = create_engine(f'sqlite:///{tmp_path / "records.db"}')
+    table = Table('records', MetaData(),
+                  Column('identifier', String, primary_key=True),
+                  Column('insert_date', String))
+    table.create(engine)
+    with engine.begin() as connection:
+        connection.execute(table.insert(), [
+            {'identifier': f'record-{i}',
+             'insert_date': '2024-01-01T00:00:00Z'}
+            for i in range(INDEX_RECORDS)
+        ])
+
+    index = RepositoryIndex(engine, table, 'identifier', 'insert_date',
+                            capacity=INDEX_RECORDS)
+    benchmark.pedantic(index.rebuild, rounds=5)
+    report(benchmark, index.rebuild, INDEX_RECORDS)
+    assert len(index) == INDEX_RECORDS
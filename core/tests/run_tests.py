@@ -1,9 +1,25 @@
+import http.server
+import importlib
 import io
+import json
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
 from lxml import etree
+from sqlalchemy import create_engine
 
+from registrar_pycsw import (
+    catalogue, esa, formats, harvest, profiling, session, xmlstream
+)
+from registrar_pycsw.index import IdentifierIndex
 from registrar_pycsw.metadata import ISOMetadata
 
 THISDIR = os.path.dirname(os.path.realpath(__file__))
@@ -13,6 +29,31 @@ def get_abspath(filepath):
     return os.path.join(THISDIR, filepath)
 
 
+def canonical(xml):
+    """canonical XML of a document, without indentation and datestamp"""
+    root = etree.fromstring(xml)
+    for e in root.iter():
+        # the indentation of the templates
+        if e.text is not None and not e.text.strip():
+            e.text = None
+        if e.tail is not None and not e.tail.strip():
+            e.tail = None
+    for e in root.iterfind(
+            '{http://www.isotc211.org/2005/gmd}dateStamp//'):
+        e.text = None
+    return etree.tostring(root, method='c14n')
+
+
+# import time budget of registrar_pycsw.backend in milliseconds
+IMPORT_BUDGET_MS = float(os.environ.get('REGISTRAR_IMPORT_BUDGET_MS', 1500))
+
+# converter dependencies not needed for registering STAC items
+LAZY_MODULES = [
+    'owslib.iso', 'owslib.ows', 'owslib.opensearch', 'pygeometa', 'yaml',
+    'pycsw.core.admin', 'concurrent.futures.process',
+]
+
+
 def read(filename, encoding='utf-8'):
     """read file contents"""
     full_path = os.path.join(os.path.dirname(__file__), filename)
@@ -21,6 +62,49 @@ def read(filename, encoding='utf-8'):
     return contents
 
 
+def iso_record(identifier, filename='data/INSPIRE.xml'):
+    """ISO fixture with a distinct file identifier"""
+    exml = etree.fromstring(read(filename))
+    exml.xpath('gmd:fileIdentifier/gco:CharacterString', namespaces={
+        'gco': 'http://www.isotc211.org/2005/gco',
+        'gmd': 'http://www.isotc211.org/2005/gmd',
+    })[0].text = identifier
+    return etree.tostring(exml, xml_declaration=True, encoding='UTF-8')
+
+
+def import_backend(name='backend'):
+    """a module of registrar_pycsw, skipping without pycsw or the registrar"""
+    try:
+        return importlib.import_module(f'registrar_pycsw.{name}')
+    except Exception as err:
+        raise unittest.SkipTest(
+            f'registrar_pycsw.{name} cannot be imported: {err}')
+
+
+class RepositoryTestCase(unittest.TestCase):
+    """runs against a fresh SQLite repository"""
+    def setUp(self):
+        self.backend = import_backend()
+        from registrar_pycsw import registry
+
+        self.tmpdir = tempfile.mkdtemp(prefix='registrar-test-')
+        self.database = f'sqlite:///{self.tmpdir}/records.db'
+        try:
+            from pycsw.core.repository import setup
+            setup(self.database, 'records')
+        except ImportError:
+            from pycsw.core import admin
+            admin.setup_db(self.database, 'records', self.tmpdir)
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.addCleanup(registry.clear)
+
+    def count(self, backend, prefix):
+        return backend.repo.session.execute(
+            "SELECT count(*) FROM records WHERE identifier LIKE :prefix",
+            {'prefix': prefix + '%'}
+        ).scalar()
+
+
 class ISOMetadataTest(unittest.TestCase):
     def setUp(self):
         self.namespaces = {
@@ -60,11 +144,15 @@ class ISOMetadataTest(unittest.TestCase):
         self.assertEqual(url, 'https://example.org/')
 
     def test_from_esa_iso_xml(self):
+        # the assets of an item without an identifier of its own
+        stac_item = json.loads(read('data/INDEX_S2A_MSIL2A_20191216T004701_N0213_R102_T53HPA_20191216T024808.json'))
+        del stac_item['id']
+
         m = ISOMetadata('https://example.org')
         iso = m.from_esa_iso_xml(
             read('data/MTD_MSIL2A.xml'),
             read('data/INSPIRE.xml'),
-            ['S2MSI2A'], 'https://example.org'
+            json.dumps(stac_item), ['S2MSI2A'], 'https://example.org'
         )
 
         self.assertIsInstance(iso, str)
@@ -94,17 +182,18 @@ class ISOMetadataTest(unittest.TestCase):
             'Land cover',
             'Orthoimagery',
             'processing',
-            'eo:orbitNumber:/',
-            'eo:orbitDirection:/',
-            'eo:productType:/',
-            'eo:snowCover:/'
+            'eo:orbitNumber:50',
+            'eo:orbitDirection:DESCENDING',
+            'eo:productType:S2MSI2A',
+            'eo:snowCover:0.0'
         ]
 
         self.assertEqual(sorted(keywords), sorted(expected_keywords))
 
         bbox = e.xpath('//gmd:extent//gmd:geographicElement//gco:Decimal/text()', namespaces=self.namespaces)
         self.assertEqual(len(bbox), 4)
-        self.assertEqual(bbox, ['22.116947357483525', '22.189438433804188', '36.51756985836932', '36.77470089136385'])
+        # west, east, south and north of the footprint
+        self.assertEqual(bbox, ['22.11023969131881', '23.358467546278757', '36.03410504881955', '37.039161424629846'])
 
         temporal_begin = e.xpath('//gmd:extent//gmd:temporalElement//gml:beginPosition/text()', namespaces=self.namespaces)[0]
         temporal_end = e.xpath('//gmd:extent//gmd:temporalElement//gml:endPosition/text()', namespaces=self.namespaces)[0]
@@ -123,7 +212,12 @@ class ISOMetadataTest(unittest.TestCase):
         self.assertTrue(band_1_max > band_1_min)
 
         urls = e.xpath('//gmd:distributionInfo//gmd:transferOptions//gmd:onLine//gmd:URL/text()', namespaces=self.namespaces)
-        self.assertEqual(len(urls), 38)
+        # the product, its 3 assets, WMS and WCS; the granule image files
+        # are no longer listed
+        self.assertEqual(len(urls), 6)
+        self.assertEqual(
+            [url for url in urls if url.endswith('.tif')],
+            [f'https://example.org/{index}_S2A_MSIL2A_20191216T004701_N0213_R102_T53HPA_20191216T024808.tif' for index in ('NBR', 'NDVI', 'NDWI')])
 
         platform = e.xpath('//gmi:acquisitionInformation//gmi:MI_Platform/gmi:identifier/text()', namespaces=self.namespaces)[0]
         self.assertEqual(platform, 'Sentinel-2B')
@@ -134,9 +228,149 @@ class ISOMetadataTest(unittest.TestCase):
         instrument_type = e.xpath('//gmi:acquisitionInformation//gmi:MI_Platform//gmi:MI_Instrument/gmi:type/text()', namespaces=self.namespaces)[0]
         self.assertEqual(instrument_type, 'S2MSI2A')
 
+    def test_esa_extract(self):
+        product = esa.extract(read('data/MTD_MSIL2A.xml'))
+
+        self.assertIsInstance(product, esa.ProductMetadata)
+        self.assertEqual(product.product_type, 'S2MSI2A')
+        self.assertEqual(product.product_uri, 'S2B_MSIL2A_20200902T090559_N0214_R050_T34SFF_20200902T113910.SAFE')
+        self.assertEqual(product.start_time, '2020-09-02T09:05:59.024Z')
+        self.assertEqual(product.cloud_cover, '0.024471')
+        self.assertEqual(product.snow_cover, '0.0')
+        self.assertEqual(product.platform, 'Sentinel-2B')
+        self.assertEqual(product.instrument, 'INS-NOBS')
+        self.assertEqual(product.bbox, ['22.11023969131881', '36.03410504881955', '23.358467546278757', '37.039161424629846'])
+
+        self.assertEqual(len(product.bands), 13)
+        self.assertEqual(product.bands[0], esa.Band('B1', 'nm', '411', '456'))
+        self.assertEqual(product.bands[1], esa.Band('B2', 'nm', '456', '532'))
+
+    def test_esa_extract_s1(self):
+        product = esa.extract(read('data/S1B_IW_GRDH_manifest.safe'))
+
+        self.assertEqual(product.product_type, 'GRD')
+        self.assertIsNone(product.product_uri)
+        self.assertEqual(product.generation_time, '2020-09-02T06:02:04.413752')
+        self.assertEqual(product.start_time, '2020-09-02T04:38:53.372513')
+        self.assertEqual(product.stop_time, '2020-09-02T04:39:18.370782')
+        self.assertEqual(product.platform, 'SENTINEL-1B')
+        self.assertEqual(product.instrument, 'IW')
+        self.assertEqual(product.orbit_number, '23188')
+        self.assertEqual(product.orbit_direction, 'DESCENDING')
+        self.assertIsNone(product.cloud_cover)
+        self.assertEqual(product.bands, [])
+        # 'lat,lon' pairs
+        self.assertEqual(product.coordinates[0], ('37.106960', '23.470526'))
+        self.assertEqual(product.bbox, ['20.642683', '37.106960', '23.862209', '39.010723'])
+
+        with self.assertRaises(ValueError):
+            esa.extract(b'<unknown/>')
+
+    def test_digest_ignores_datestamp(self):
+        def digest(xml):
+            return formats.digest(formats.XML, etree.fromstring(xml))
+
+        record = read('data/INSPIRE.xml')
+        exml = etree.fromstring(record)
+        datestamp = exml.xpath('gmd:dateStamp/*', namespaces=self.namespaces)[0]
+        datestamp.text = '2000-01-01T00:00:00'
+        restamped = etree.tostring(exml)
+        exml.xpath('gmd:fileIdentifier/gco:CharacterString',
+                   namespaces=self.namespaces)[0].text = 'other'
+        changed = etree.tostring(exml)
+
+        self.assertEqual(digest(record), digest(restamped))
+        self.assertNotEqual(digest(record), digest(changed))
+
+        # only dates are ignored, not the text that happens to match
+        title = exml.xpath('//gmd:title/gco:CharacterString',
+                           namespaces=self.namespaces)[0]
+        title.text = f'Updated {datestamp.text}'
+        titled = etree.tostring(exml)
+        title.text = 'Updated '
+        self.assertNotEqual(digest(titled), digest(etree.tostring(exml)))
+
+        # the parsed tree is left as it was
+        before = etree.tostring(exml)
+        formats.digest(formats.XML, exml)
+        self.assertEqual(etree.tostring(exml), before)
+        self.assertEqual(
+            formats.digest(formats.JSON, {'a': 1, 'b': [1, 2]}),
+            formats.digest(formats.JSON, {'b': [1, 2], 'a': 1}))
+
+    def test_parse_document(self):
+        xml = read('data/INSPIRE.xml')
+        item = read('data/INDEX_S2A_MSIL2A_20191216T004701_N0213_R102_T53HPA_20191216T024808.json')
+        for md in (xml, xml.decode(), '\ufeff' + xml.decode(), formats.BOM + xml):
+            metadata_format, parsed = formats.parse_document(md)
+            self.assertEqual(metadata_format, formats.XML)
+            self.assertEqual(parsed.tag, '{http://www.isotc211.org/2005/gmd}MD_Metadata')
+        for md in (item, item.decode(), b' \n' + item, formats.BOM + item):
+            metadata_format, parsed = formats.parse_document(md)
+            self.assertEqual((metadata_format, parsed['type']), (formats.JSON, 'Feature'))
+
+        # text is parsed as is
+        with mock.patch.object(formats.json, 'loads', wraps=json.loads) as loads:
+            formats.parse_document(item.decode(), 'application/geo+json')
+        self.assertIsInstance(loads.call_args.args[0], str)
+
+        with self.assertRaises(ValueError):
+            formats.parse_document('name: value')
+
+    def test_iter_records(self):
+        record = '<gmd:MD_Metadata xmlns:gmd="http://www.isotc211.org/2005/gmd"><gmd:fileIdentifier>{}</gmd:fileIdentifier></gmd:MD_Metadata>'
+        response = (
+            '<csw:GetRecordsResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2"><csw:SearchResults>'
+            + ''.join(record.format(i) for i in range(3))
+            + '</csw:SearchResults></csw:GetRecordsResponse>'
+        )
+
+        records = list(xmlstream.iter_records(io.BytesIO(response.encode())))
+        identifiers = [r.xpath('gmd:fileIdentifier/text()', namespaces=self.namespaces)[0] for r in records]
+        self.assertEqual(identifiers, ['0', '1', '2'])
+        self.assertTrue(all(r.getparent() is None for r in records))
+
+        records = list(xmlstream.iter_records(io.BytesIO(record.format('single').encode())))
+        self.assertEqual(len(records), 1)
+
+        # records are yielded as received
+        indented = record.replace('><', '>\n  <', 1).replace('></gmd:MD', '>\n</gmd:MD')
+        records = list(xmlstream.iter_records(io.BytesIO(indented.format('single').encode())))
+        self.assertEqual(etree.tostring(records[0]).decode(), indented.format('single'))
+
+    def test_identifier_index(self):
+        index = IdentifierIndex(1000, 0.01)
+        index.update(f'item-{i}' for i in range(1000))
+
+        self.assertEqual(len(index), 1000)
+        self.assertTrue(all(f'item-{i}' in index for i in range(1000)))
+        false_positives = sum(f'other-{i}' in index for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_get_records_modified_since(self):
+        request = etree.fromstring(harvest.get_records(21, 10, '2024-01-09'))
+
+        self.assertEqual(request.get('startPosition'), '21')
+        self.assertEqual(request.get('maxRecords'), '10')
+        literal = request.find('.//{http://www.opengis.net/ogc}Literal')
+        self.assertEqual(literal.text, '2024-01-09')
+
+        request = etree.fromstring(harvest.get_records(
+            1, 0, '2024-01-09', until='2024-02-01T00:00:00Z'))
+        self.assertEqual(
+            [literal.text for literal in request.iterfind(
+                './/{http://www.opengis.net/ogc}And/*/'
+                '{http://www.opengis.net/ogc}Literal')],
+            ['2024-01-09', '2024-02-01T00:00:00Z'])
+
+        request = etree.fromstring(harvest.get_records(1, 0, None, 'hits'))
+        self.assertEqual(request.get('resultType'), 'hits')
+        self.assertIsNone(
+            request.find('.//{http://www.opengis.net/cat/csw/2.0.2}Constraint'))
+
     def test_from_stac_item(self):
         m = ISOMetadata('https://example.org')
-        iso = m.from_stac_item(read('data/INDEX_S2A_MSIL2A_20191216T004701_N0213_R102_T53HPA_20191216T024808.json'))
+        iso = m.from_stac_item(read('data/INDEX_S2A_MSIL2A_20191216T004701_N0213_R102_T53HPA_20191216T024808.json'), ['S2MSI2A'], 'https://example.org/ows')
 
         self.assertIsInstance(iso, str)
 
@@ -166,7 +400,7 @@ class ISOMetadataTest(unittest.TestCase):
         self.assertEqual(bands, ['NBR', 'NDVI', 'NDWI'])
 
         urls = e.xpath('//gmd:distributionInfo//gmd:transferOptions//gmd:onLine//gmd:URL/text()', namespaces=self.namespaces)
-        self.assertEqual(len(urls), 4)
+        self.assertEqual(len(urls), 6)
 
         expected_urls = [
             'https://example.org/NBR_S2A_MSIL2A_20191216T004701_N0213_R102_T53HPA_20191216T024808.tif',
@@ -175,7 +409,9 @@ class ISOMetadataTest(unittest.TestCase):
             'https://example.org/'
         ]
 
-        self.assertEqual(urls, expected_urls)
+        self.assertEqual(urls[:4], expected_urls)
+        # the WMS and WCS of the item
+        self.assertEqual([url.split('&')[1] for url in urls[4:]], ['service=WMS', 'service=WCS'])
 
         platform = e.xpath('//gmi:acquisitionInformation//gmi:MI_Platform/gmi:identifier/text()', namespaces=self.namespaces)[0]
         self.assertEqual(platform, 'S2A')
@@ -186,6 +422,1195 @@ class ISOMetadataTest(unittest.TestCase):
         instrument_type = e.xpath('//gmi:acquisitionInformation//gmi:MI_Platform//gmi:MI_Instrument/gmi:type/text()', namespaces=self.namespaces)[0]
         self.assertEqual(instrument_type, 'S2MSI')
 
+    def test_from_stac_item_direct_writer(self):
+        stac_item = json.loads(read('data/INDEX_S2A_MSIL2A_20191216T004701_N0213_R102_T53HPA_20191216T024808.json'))
+        stac_item['properties']['collection'] = 'S2MSI2A'
+        stac_item = json.dumps(stac_item)
+
+        m = ISOMetadata('https://example.org')
+        iso = m.from_stac_item(stac_item, ['S2MSI2A'], 'https://example.org/ows')
+        with mock.patch('registrar_pycsw.iso19139.supports', return_value=False):
+            expected = m.from_stac_item(stac_item, ['S2MSI2A'], 'https://example.org/ows')
+
+        self.assertEqual(canonical(iso), canonical(expected))
+
+    def test_from_csw_without_service_identification(self):
+        caps = etree.fromstring(read('data/csw-capabilities.xml'))
+        for si in caps.findall('{*}ServiceIdentification'):
+            caps.remove(si)
+
+        m = ISOMetadata('https://example.org/csw')
+        iso = etree.fromstring(m.from_csw(etree.tostring(caps)))
+
+        self.assertEqual(iso.xpath(
+            'gmd:hierarchyLevel/gmd:MD_ScopeCode/@codeListValue',
+            namespaces=self.namespaces), ['service'])
+
+
+def fake_probe(result, delay=0):
+    """probe detecting the given service type after a delay"""
+    def probe(base_url, timeout):
+        time.sleep(delay)
+        if result is None:
+            raise ValueError('not found')
+        return result, f'{result} document', None
+    return probe
+
+
+class CatalogueDetectionTest(unittest.TestCase):
+    def detect(self, landing_page, csw):
+        probes = {
+            landing_page: catalogue.PROBES[catalogue.probe_landing_page],
+            csw: catalogue.PROBES[catalogue.probe_csw],
+        }
+        with mock.patch.object(catalogue, 'PROBES', probes):
+            start = time.monotonic()
+            result = catalogue.detect('https://example.org')
+            return result, time.monotonic() - start
+
+    def test_priority_over_first_response(self):
+        (service_type, document, _), _ = self.detect(
+            fake_probe('opensearch'), fake_probe('csw', 0.2))
+        self.assertEqual(service_type, 'csw')
+        self.assertEqual(document, 'csw document')
+
+        (service_type, _, _), _ = self.detect(
+            fake_probe('stac_api', 0.2), fake_probe('csw'))
+        self.assertEqual(service_type, 'stac_api')
+
+    def test_highest_priority_is_not_held_up(self):
+        (service_type, _, _), elapsed = self.detect(
+            fake_probe('oarec'), fake_probe('csw', 2))
+        self.assertEqual(service_type, 'oarec')
+        self.assertLess(elapsed, 1)
+
+    def test_failed_probes(self):
+        (service_type, _, _), _ = self.detect(
+            fake_probe(None), fake_probe('csw'))
+        self.assertEqual(service_type, 'csw')
+        self.assertEqual(
+            self.detect(fake_probe(None), fake_probe(None))[0],
+            (None, None, None))
+
+
+class FakeBackend:
+    """backend converting items to their id and writing to a list"""
+    batch_size = 4
+    flush_interval = 0.05
+
+    def __init__(self):
+        self.written = []
+        self.writable = threading.Event()
+        self.writable.set()
+
+    def get_metadata(self, source, item):
+        return item.metadata
+
+    def upsert_many(self, records):
+        self.writable.wait()
+        records = list(records)
+        if 'bad' in records:
+            raise ValueError('bad record')
+        self.written.extend(records)
+        return len(records)
+
+
+class FakeItem:
+    def __init__(self, id, metadata=None):
+        self.id = id
+        self.metadata = metadata or id
+
+
+class FixtureServer:
+    """local HTTP server of JSON documents by path, honouring ETags"""
+    def __init__(self, documents):
+        self.documents = documents
+        self.requests = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                server.requests.append(path)
+                if path not in server.documents:
+                    self.send_error(404)
+                    return
+                body = json.dumps(server.documents[path]).encode()
+                etag = f'"{hash(body)}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, path):
+        return self.requests.count(path)
+
+
+def oaproc_documents(prefix='/ades/'):
+    """the OGC API - Processes fixtures served below prefix"""
+    processes = json.loads(read('data/oaproc-processes.json'))
+    documents = {
+        prefix: json.loads(read('data/oaproc-landing-page.json')),
+        prefix + 'processes': processes,
+    }
+    for process in processes['processes']:
+        documents[f'{prefix}processes/{process["id"]}'] = process
+    return documents
+
+
+class DirectorySource:
+    """local stand-in of a registrar Source, slow to download"""
+    def __init__(self, root):
+        self.root = root
+
+    def get_file(self, path, target_path):
+        time.sleep(0.1)
+        shutil.copy(os.path.join(self.root, path), target_path)
+
+
+class FetchTest(unittest.TestCase):
+    def setUp(self):
+        self.fetch = import_backend('fetch')
+        self.tmpdir = tempfile.mkdtemp(prefix='registrar-test-')
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        for name in ['a', 'b']:
+            os.mkdir(os.path.join(self.tmpdir, name))
+            with open(os.path.join(
+                    self.tmpdir, name, 'metadata.xml'), 'wb') as f:
+                f.write(name.encode() * 100)
+        self.source = DirectorySource(self.tmpdir)
+
+    def test_concurrent_fetches_from_source(self):
+        results = {}
+
+        def fetch(name):
+            results[name] = self.fetch.fetch(
+                f'{name}/metadata.xml', self.source)
+
+        # documents of the same name do not overwrite each other
+        threads = [
+            threading.Thread(target=fetch, args=(name,))
+            for name in ['a', 'b']
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {'a': b'a' * 100, 'b': b'b' * 100})
+
+    def test_max_size(self):
+        with self.assertRaises(ValueError):
+            self.fetch.fetch('a/metadata.xml', self.source, max_size=99)
+
+        server = FixtureServer({'/document': ['x' * 100]})
+        self.addCleanup(server.close)
+        self.assertEqual(
+            json.loads(self.fetch.fetch(server.url + '/document')),
+            ['x' * 100])
+        with self.assertRaises(ValueError):
+            self.fetch.fetch(server.url + '/document', max_size=99)
+
+    def test_spill_to_file(self):
+        with self.fetch.open_href(
+                'a/metadata.xml', self.source, spool_size=10) as f:
+            self.assertTrue(f._rolled)
+            self.assertEqual(f.read(), b'a' * 100)
+        with self.fetch.open_href('a/metadata.xml', self.source) as f:
+            self.assertFalse(f._rolled)
+
+
+class RegistrationPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.pipeline = import_backend('pipeline')
+        self.backend = FakeBackend()
+
+    def test_failing_record_is_isolated(self):
+        with self.pipeline.RegistrationPipeline(self.backend) as pipeline:
+            for i in range(10):
+                pipeline.register(
+                    None, FakeItem(f'item-{i}', 'bad' if i == 6 else None))
+
+        self.assertEqual(pipeline.failed, ['item-6'])
+        self.assertEqual(
+            sorted(self.backend.written),
+            sorted(f'item-{i}' for i in range(10) if i != 6))
+
+    def test_inflight_bytes(self):
+        self.backend.batch_size = 1
+        self.backend.writable.clear()
+        # 50 characters, 100 bytes
+        metadata = '\u00e9' * 50
+        pipeline = self.pipeline.RegistrationPipeline(
+            self.backend, max_inflight_bytes=150)
+
+        self.assertEqual(
+            pipeline._convert(None, FakeItem('a', metadata))[1], 100)
+        pipeline._release(100)
+
+        producer = threading.Thread(target=lambda: [
+            pipeline.register(None, FakeItem(f'item-{i}', metadata))
+            for i in range(5)
+        ])
+        producer.start()
+        time.sleep(0.5)
+        # blocked while the writer cannot keep up
+        self.assertTrue(producer.is_alive())
+        self.assertGreaterEqual(pipeline._inflight_bytes, 150)
+
+        self.backend.writable.set()
+        producer.join(5)
+        pipeline.close()
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(len(self.backend.written), 5)
+        self.assertEqual(pipeline._inflight_bytes, 0)
+
+
+class FakeItemBackend:
+    """backend converting STAC items to their id, failing on 'bad' ones"""
+    batch_size = 4
+
+    def __init__(self):
+        self.written = []
+
+    def get_metadata(self, source, item):
+        if item.id.startswith('bad'):
+            raise ValueError(f'cannot convert {item.id}')
+        return item.id
+
+    def upsert_many(self, records):
+        records = list(records)
+        self.written.extend(records)
+        return len(records)
+
+
+class FakeStacApi:
+    """STAC API search over items by id and timestamp, paged by offset"""
+    def __init__(self, items, page_size=2):
+        self.items = items
+        self.page_size = page_size
+        self.requests = []
+        self.failing = None
+
+    def feature(self, id, timestamp):
+        return {
+            'type': 'Feature', 'stac_version': '1.0.0', 'id': id,
+            'geometry': None, 'links': [], 'assets': {},
+            'properties': {'datetime': timestamp, 'updated': timestamp},
+        }
+
+    def request(self, request):
+        if request.get('params'):
+            params = dict(request['params'], offset=0)
+        else:
+            params = {
+                key: value[0] for key, value
+                in parse_qs(urlparse(request['href']).query).items()
+            }
+        self.requests.append(params)
+        offset = int(params['offset'])
+        if offset == self.failing:
+            raise ValueError('search failed')
+
+        since = params.get('datetime', '').split('/')[0]
+        if 'filter' in params:
+            since = params['filter'].split("'")[1]
+        matched = sorted(
+            (timestamp, id) for id, timestamp in self.items.items()
+            if timestamp >= since)
+        page = {'features': [
+            self.feature(id, timestamp)
+            for timestamp, id in matched[offset:offset + self.page_size]
+        ]}
+        if offset + self.page_size < len(matched):
+            query = '&'.join(f'{key}={value}' for key, value in dict(
+                params, offset=offset + self.page_size).items())
+            page['links'] = [{'rel': 'next', 'href': f'search?{query}'}]
+        return page
+
+
+class StacApiHarvesterTest(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeStacApi({
+            f'item-{i}': f'2024-01-0{i + 1}T00:00:00Z' for i in range(5)
+        })
+        self.backend = FakeItemBackend()
+        tmpdir = tempfile.mkdtemp(prefix='registrar-test-')
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.checkpoints = harvest.Checkpoints(
+            create_engine(f'sqlite:///{tmpdir}/checkpoints.db'))
+        self.landing_page = {'links': [
+            {'rel': 'search', 'href': 'https://example.org/search'}
+        ]}
+
+    def harvest(self):
+        harvester = harvest.StacApiHarvester(
+            self.backend, self.checkpoints, 'https://example.org',
+            self.landing_page, workers=1, page_size=2)
+        with mock.patch.object(harvester, '_request', self.api.request):
+            harvester.harvest(['c1'])
+        return harvester
+
+    def test_checkpoint_and_resume(self):
+        self.api.failing = 4
+        self.assertEqual(self.harvest().failed, ['c1'])
+        checkpoint = self.checkpoints.get('https://example.org', 'c1')
+        self.assertIsNone(checkpoint['watermark'])
+        self.assertEqual(checkpoint['next']['href'].split('offset=')[1], '4')
+        self.assertEqual(len(self.backend.written), 4)
+
+        self.api.failing = None
+        self.api.requests.clear()
+        self.assertEqual(self.harvest().failed, [])
+        self.assertEqual(
+            [request['offset'] for request in self.api.requests], ['4'])
+        self.assertEqual(len(self.backend.written), 5)
+        self.assertEqual(
+            self.checkpoints.get('https://example.org', 'c1'), {
+                'watermark': '2024-01-05T00:00:00Z', 'pending': None,
+                'next': None, 'failed': None,
+            })
+
+        # incremental, from the watermark on
+        self.api.items['item-5'] = '2024-01-06T00:00:00Z'
+        self.api.requests.clear()
+        self.harvest()
+        self.assertEqual(
+            self.api.requests[0]['datetime'], '2024-01-05T00:00:00Z/..')
+        self.assertEqual(self.backend.written[-2:], ['item-4', 'item-5'])
+
+    def test_failed_items_hold_back_watermark(self):
+        self.api.items['bad-1'] = '2024-01-02T12:00:00Z'
+        # resumed after the page with the failed item
+        self.api.failing = 4
+        self.assertEqual(self.harvest().failed, ['bad-1', 'c1'])
+        self.api.failing = None
+        self.assertEqual(self.harvest().failed, [])
+
+        self.assertEqual(
+            self.checkpoints.get('https://example.org', 'c1')['watermark'],
+            '2024-01-02T12:00:00Z')
+
+    def test_updated_filter(self):
+        self.landing_page['conformsTo'] = [
+            'https://api.stacspec.org/v1.0.0-rc.2/item-search#filter']
+        self.harvest()
+        self.api.requests.clear()
+        self.harvest()
+
+        self.assertEqual(
+            self.api.requests[0]['filter'],
+            "updated >= TIMESTAMP('2024-01-05T00:00:00Z')")
+        self.assertNotIn('datetime', self.api.requests[0])
+
+
+class FakeCsw:
+    """CSW records by identifier and modification date"""
+    def __init__(self, records):
+        self.records = records
+        self.queries = []
+        self.on_window = None
+
+    def matching(self, since, until):
+        self.queries.append((since, until))
+        return sorted(
+            identifier for identifier, modified in self.records.items()
+            if (since is None or modified >= since)
+            and (until is None or modified <= until))
+
+    def hits(self, since=None, until=None):
+        return len(self.matching(since, until))
+
+    def window(self, position, since, until, page_size=3):
+        if self.on_window is not None:
+            self.on_window()
+        return [
+            etree.fromstring(f'<record>{identifier}</record>')
+            for identifier in self.matching(since, until)[
+                position - 1:position - 1 + page_size]
+        ]
+
+
+class FakeCswBackend:
+    def __init__(self):
+        self.written = []
+
+    def upsert_elements(self, elements):
+        self.written.extend(element.text for element in elements)
+        return len(elements)
+
+
+class CswHarvesterTest(unittest.TestCase):
+    def setUp(self):
+        self.csw = FakeCsw({
+            f'r{i:02d}': f'2024-01-0{i}' for i in range(1, 10)
+        })
+        self.backend = FakeCswBackend()
+        tmpdir = tempfile.mkdtemp(prefix='registrar-test-')
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.checkpoints = harvest.Checkpoints(
+            create_engine(f'sqlite:///{tmpdir}/checkpoints.db'))
+
+    def harvest(self):
+        harvester = harvest.CswHarvester(
+            self.backend, self.checkpoints, 'https://example.org/csw',
+            workers=1, page_size=3)
+        with mock.patch.object(harvester, 'hits', self.csw.hits), \
+                mock.patch.object(harvester, '_window', self.csw.window):
+            return harvester.harvest()
+
+    def test_windows_fixed_at_start(self):
+        def insert():
+            # modified while harvesting, sorts before the other records
+            self.csw.records['r00'] = time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 60))
+            self.csw.on_window = None
+        self.csw.on_window = insert
+
+        self.assertEqual(self.harvest(), 9)
+        self.assertEqual(
+            self.backend.written, [f'r{i:02d}' for i in range(1, 10)])
+
+        until = self.csw.queries[0][1]
+        self.assertEqual(
+            self.checkpoints.get('https://example.org/csw')['watermark'],
+            until)
+
+        # from the day of the start of the last harvest on, two minutes on
+        later = time.gmtime(time.time() + 120)
+        self.csw.queries.clear()
+        with mock.patch.object(harvest.time, 'gmtime', return_value=later):
+            self.assertEqual(self.harvest(), 1)
+        self.assertEqual(self.csw.queries[0][0], until[:10])
+        self.assertEqual(self.backend.written[-1], 'r00')
+
+
+class FakeCollectionBackend:
+    def __init__(self):
+        self.registered = []
+
+    def register(self, source, collection, replace):
+        self.registered.append(collection.id)
+
+
+class StacCatalogCrawlerTest(unittest.TestCase):
+    def setUp(self):
+        api = FakeStacApi({})
+        self.documents = {
+            '/catalog.json': {
+                'type': 'Catalog', 'id': 'root', 'stac_version': '1.0.0',
+                'description': 'root', 'links': [
+                    {'rel': 'child', 'href': 'collection.json'}
+                ]
+            },
+            '/collection.json': {
+                'type': 'Collection', 'id': 'c1', 'stac_version': '1.0.0',
+                'description': 'c1', 'license': 'proprietary',
+                'extent': {
+                    'spatial': {'bbox': [[-180, -90, 180, 90]]},
+                    'temporal': {'interval': [[None, None]]}
+                },
+                'links': [
+                    {'rel': 'item', 'href': f'items/item-{i}.json'}
+                    for i in range(3)
+                ]
+            },
+        }
+        for i in range(3):
+            self.documents[f'/items/item-{i}.json'] = api.feature(
+                f'item-{i}', '2024-01-01T00:00:00Z')
+        self.server = FixtureServer(self.documents)
+        self.addCleanup(self.server.close)
+
+        tmpdir = tempfile.mkdtemp(prefix='registrar-test-')
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.validators = harvest.Validators(
+            create_engine(f'sqlite:///{tmpdir}/validators.db'))
+        self.collections = FakeCollectionBackend()
+        self.items = FakeItemBackend()
+
+    def crawl(self, prune_unchanged=False):
+        self.server.requests.clear()
+        crawler = harvest.StacCatalogCrawler(
+            self.collections, self.items, self.validators,
+            self.server.url + '/catalog.json', workers=2,
+            prune_unchanged=prune_unchanged)
+        return crawler.crawl(), crawler
+
+    def test_unchanged_documents(self):
+        written, crawler = self.crawl()
+        self.assertEqual(written, 4)
+        self.assertEqual(crawler.failed, [])
+        self.assertEqual(self.collections.registered, ['c1'])
+        self.assertEqual(
+            sorted(self.items.written), ['item-0', 'item-1', 'item-2'])
+
+        # 304 all along, each document requested once
+        written, _ = self.crawl()
+        self.assertEqual(written, 0)
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(len(set(self.server.requests)), 5)
+
+    def test_changes_below_unchanged_documents(self):
+        self.crawl()
+        self.documents['/items/item-1.json']['properties']['title'] = 'new'
+
+        written, _ = self.crawl()
+        self.assertEqual(written, 1)
+        self.assertEqual(self.items.written[-1], 'item-1')
+
+    def test_prune_unchanged(self):
+        self.crawl()
+        self.documents['/items/item-1.json']['properties']['title'] = 'new'
+
+        written, _ = self.crawl(prune_unchanged=True)
+        self.assertEqual(written, 0)
+        self.assertEqual(self.server.requests, ['/catalog.json'])
+
+        # a changed parent is descended into
+        self.documents['/collection.json']['description'] = 'changed'
+        self.documents['/catalog.json']['description'] = 'changed'
+        written, _ = self.crawl(prune_unchanged=True)
+        self.assertEqual(written, 2)
+        self.assertEqual(self.collections.registered, ['c1', 'c1'])
+
+
+class ProfiledBackend:
+    """backend registering items by their id, failing on 'bad' ones"""
+    converter_branch = 'sentinel'
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def _profile_identifier(self, item):
+        return item.id
+
+    def _converter_branch(self, item):
+        return self.converter_branch
+
+    @profiling.profiled
+    def register(self, source, item, replace):
+        if item.id.startswith('bad'):
+            raise ValueError(item.id)
+        return item.id
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='registrar-test-')
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_from_options(self):
+        self.assertIsNone(profiling.Profiler.from_options(self.tmpdir))
+        self.assertIsNone(profiling.Profiler.from_options(fraction=1))
+        with mock.patch.dict(os.environ, {
+                profiling.PROFILE_DIR_ENV: self.tmpdir,
+                profiling.PROFILE_PATTERN_ENV: '^S2'}):
+            profiler = profiling.Profiler.from_options()
+        self.assertEqual(profiler.directory, self.tmpdir)
+        self.assertTrue(profiler.selects('S2A_MSIL2A'))
+        self.assertFalse(profiler.selects('S1A_IW_GRDH'))
+
+    def test_selected_registrations_are_profiled(self):
+        backend = ProfiledBackend(
+            profiling.Profiler(self.tmpdir, pattern='^(S2|bad)'))
+        self.assertEqual(
+            backend.register(None, FakeItem('S1/a'), False), 'S1/a')
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+        self.assertEqual(
+            backend.register(None, FakeItem('S2/a'), False), 'S2/a')
+        [profile] = os.listdir(self.tmpdir)
+        self.assertTrue(profile.startswith('ProfiledBackend-S2_a-sentinel-'))
+        self.assertTrue(profile.endswith('.pstats'))
+
+        # also dumped when the registration fails
+        with self.assertRaises(ValueError):
+            backend.register(None, FakeItem('bad'), False)
+        self.assertEqual(len(os.listdir(self.tmpdir)), 2)
+
+    def test_fraction(self):
+        backend = ProfiledBackend(profiling.Profiler(self.tmpdir, 0.5))
+        with mock.patch.object(profiling.random, 'random',
+                               side_effect=[0.7, 0.2]):
+            backend.register(None, FakeItem('a'), False)
+            backend.register(None, FakeItem('b'), False)
+        [profile] = os.listdir(self.tmpdir)
+        self.assertTrue(profile.startswith('ProfiledBackend-b-'))
+
+
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        for name in ('_session', '_settings'):
+            patcher = mock.patch.object(session, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_configured_once(self):
+        default = session.get_session()
+        session.configure(timeout=5, pool_maxsize=20)
+        configured = session.get_session()
+        self.assertIsNot(configured, default)
+        self.assertEqual(configured.timeout, 5)
+
+        session.configure(timeout=5, pool_maxsize=20)
+        with self.assertLogs(session.logger, 'WARNING'):
+            session.configure(timeout=60)
+        self.assertIs(session.get_session(), configured)
+        self.assertEqual(session.get_session().timeout, 5)
+
+
+class DetectionCacheTest(unittest.TestCase):
+    def setUp(self):
+        from registrar_pycsw import cache, session
+        self.cache_module = cache
+        self.session = session
+        self.tmpdir = tempfile.mkdtemp(prefix='registrar-test-')
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.server = FixtureServer({'/ades/processes': {'processes': []}})
+        self.addCleanup(self.server.close)
+        self.url = self.server.url + '/ades/'
+
+    def put(self, cache):
+        response = self.session.get_session().get(
+            self.url + 'processes', headers=self.session.JSON_HEADERS)
+        cache.put(self.url, 'oaproc', 'ades', response)
+        return cache.get(self.url)
+
+    def test_fresh_entry_is_revalidated(self):
+        cache = self.cache_module.DetectionCache(
+            os.path.join(self.tmpdir, 'cache.db'), ttl=3600)
+        entry = self.put(cache)
+
+        # conditional request within the TTL, answered with 304
+        self.assertEqual(entry['service_type'], 'oaproc')
+        self.assertEqual(cache.revalidate(entry), (True, None))
+        self.assertEqual(self.server.count('/ades/processes'), 2)
+
+        self.server.documents['/ades/processes'] = {'processes': [
+            {'id': 'new'}
+        ]}
+        unchanged, response = cache.revalidate(cache.get(self.url))
+        self.assertFalse(unchanged)
+        self.assertEqual(response.json()['processes'], [{'id': 'new'}])
+
+    def test_fresh_entry_without_validators_is_trusted(self):
+        cache = self.cache_module.DetectionCache(
+            os.path.join(self.tmpdir, 'cache.db'), ttl=3600)
+        entry = dict(self.put(cache), etag=None, last_modified=None)
+
+        self.assertEqual(cache.revalidate(entry), (True, None))
+        self.assertEqual(self.server.count('/ades/processes'), 1)
+
+    def test_expired_entry_is_revalidated(self):
+        cache = self.cache_module.DetectionCache(
+            os.path.join(self.tmpdir, 'cache.db'), ttl=0)
+        entry = self.put(cache)
+
+        # 304 Not Modified
+        self.assertEqual(cache.revalidate(entry), (True, None))
+        self.assertEqual(self.server.count('/ades/processes'), 2)
+
+        self.server.documents['/ades/processes'] = {'processes': [
+            {'id': 'new'}
+        ]}
+        unchanged, response = cache.revalidate(cache.get(self.url))
+        self.assertFalse(unchanged)
+        self.assertEqual(response.json()['processes'], [{'id': 'new'}])
+
+    def test_eviction(self):
+        cache = self.cache_module.DetectionCache(
+            os.path.join(self.tmpdir, 'cache.db'), max_entries=1)
+        self.put(cache)
+        self.url += 'other/'
+        self.put(cache)
+
+        self.assertIsNone(cache.get(self.server.url + '/ades/'))
+        self.assertIsNotNone(cache.get(self.url))
+
+
+class ADESBackendTest(RepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = FixtureServer(oaproc_documents())
+        self.addCleanup(self.server.close)
+        self.item = {'type': 'oaproc', 'url': self.server.url + '/ades/'}
+        self.ades = self.backend.ADESBackend(
+            self.database,
+            detection_cache=os.path.join(self.tmpdir, 'cache.db'))
+
+    def test_process_list_fetched_once(self):
+        self.ades.register(None, self.item, False)
+
+        self.assertEqual(self.server.count('/ades/processes'), 1)
+        # the service and its 10 processes
+        self.assertEqual(self.count(self.ades, ''), 11)
+
+    def test_cached_registration_is_skipped_unless_replaced(self):
+        self.ades.register(None, self.item, False)
+        self.ades.register(None, self.item, False)
+        # revalidated with a conditional request only
+        self.assertEqual(self.server.count('/ades/processes'), 2)
+        self.assertEqual(self.count(self.ades, ''), 11)
+
+        self.ades.register(None, self.item, True)
+        self.assertEqual(self.server.count('/ades/processes'), 3)
+
+    def test_sync(self):
+        self.ades.detection_cache = None
+        self.ades.register(None, self.item, False)
+        # unchanged records are skipped unless replaced
+        with mock.patch.object(self.ades, '_write_records') as write_records:
+            self.ades.register(None, self.item, False)
+        write_records.assert_not_called()
+        with mock.patch.object(self.ades, '_write_records') as write_records:
+            self.ades.register(None, self.item, True)
+        self.assertEqual(len(write_records.call_args.args[0]), 11)
+
+        # the record of an undeployed process is deleted
+        documents = self.server.documents
+        process = documents['/ades/processes']['processes'].pop()
+        del documents[f'/ades/processes/{process["id"]}']
+        identifier = (f'{self.backend.url_identifier(self.item["url"])}-'
+                      f'{process["id"]}')
+        self.assertTrue(self.ades._query_ids([identifier]))
+        self.ades.register(None, self.item, False)
+        self.assertEqual(self.count(self.ades, ''), 10)
+        self.assertFalse(self.ades._query_ids([identifier]))
+
+
+class RegistryTest(RepositoryTestCase):
+    def test_shared_repository(self):
+        items = self.backend.ItemBackend(self.database)
+        collections = self.backend.CollectionBackend(self.database)
+
+        self.assertIs(items.repo, collections.repo)
+        self.assertIs(items.context, collections.context)
+
+        # one session per thread
+        sessions = [items.repo.session()]
+        thread = threading.Thread(
+            target=lambda: sessions.append(items.repo.session()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(sessions[0], sessions[1])
+
+    def test_engine_of_pycsw(self):
+        from pycsw.core.repository import Repository
+
+        repo = self.backend.ItemBackend(self.database).repo
+        engine = Repository._engines[self.database]
+        self.assertIs(repo.engine, engine)
+        self.assertIs(repo.dataset.metadata.bind, engine)
+        self.assertIs(repo.session.bind, engine)
+
+    def test_after_fork(self):
+        from registrar_pycsw import registry
+
+        items = self.backend.ItemBackend(
+            self.database, identifier_index=True, identifier_index_refresh=0)
+        items.upsert_many([iso_record('parent-1')])
+        pool = items.repo.engine.pool
+
+        registry._after_fork()
+
+        # a pool and an index of its own, the repository is still shared
+        self.assertIsNot(items.repo.engine.pool, pool)
+        child = self.backend.ItemBackend(self.database, identifier_index=True)
+        self.assertIs(child.repo, items.repo)
+        self.assertIsNot(child.identifier_index, items.identifier_index)
+        child.upsert_many([iso_record('child-1')])
+        self.assertEqual(self.count(child, 'parent'), 1)
+        self.assertTrue(child.exists(None, FakeItem('child-1')))
+
+    def test_shared_identifier_index(self):
+        items = self.backend.ItemBackend(
+            self.database, identifier_index=True, identifier_index_refresh=0)
+        self.assertIs(
+            self.backend.ItemBackend(
+                self.database, identifier_index=True).identifier_index,
+            items.identifier_index)
+
+        # written by a backend without the index, like another process
+        other = self.backend.ItemBackend(self.database)
+        other.upsert_many([iso_record('other-1'), iso_record('other-2')])
+        self.assertTrue(items.exists(None, FakeItem('other-1')))
+
+        items.deregister_many(['other-1'])
+        with mock.patch.object(items, '_query_ids') as query_ids:
+            self.assertFalse(items.exists(None, FakeItem('other-1')))
+            query_ids.assert_not_called()
+        self.assertTrue(items.exists(None, FakeItem('other-2')))
+
+    def test_identifier_index_confirms_misses(self):
+        items = self.backend.ItemBackend(
+            self.database, identifier_index=True,
+            identifier_index_refresh=3600)
+
+        # written by another process after the index was refreshed
+        other = self.backend.ItemBackend(self.database)
+        other.upsert_many([iso_record('other-1')])
+        self.assertTrue(items.exists(None, FakeItem('other-1')))
+        self.assertEqual(
+            items.existing_identifiers(['other-1', 'other-2']), {'other-1'})
+        self.assertFalse(items.exists(None, FakeItem('other-2')))
+
+        # re-inserted after its deletion was tracked
+        items.deregister_many(['other-1'])
+        other.upsert_many([iso_record('other-1')])
+        self.assertTrue(items.exists(None, FakeItem('other-1')))
+
+    def test_session_per_thread(self):
+        items = self.backend.ItemBackend(self.database, batch_size=10)
+        errors = []
+
+        def write(prefix):
+            try:
+                items.upsert_many(
+                    iso_record(f'{prefix}-{i}') for i in range(30))
+            except Exception as err:
+                errors.append(err)
+
+        threads = [
+            threading.Thread(target=write, args=(f'thread{i}',))
+            for i in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        # the calling thread keeps reading meanwhile
+        while any(thread.is_alive() for thread in threads):
+            items._query_ids(['thread0-0'])
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.count(items, 'thread'), 90)
+
+
+class UpsertManyTest(RepositoryTestCase):
+    def test_batches(self):
+        items = self.backend.ItemBackend(self.database, batch_size=2)
+        with mock.patch.object(
+                items, '_write_batch', wraps=items._write_batch) as batch:
+            self.assertEqual(
+                items.upsert_many(iso_record(f'many-{i}') for i in range(5)),
+                5)
+        self.assertEqual(
+            [len(call.args[0]) for call in batch.call_args_list], [2, 2, 1])
+        self.assertEqual(self.count(items, 'many-'), 5)
+
+        # written as soon as the flush interval passed
+        items.flush_interval = 0
+        with mock.patch.object(
+                items, '_write_batch', wraps=items._write_batch) as batch:
+            items.upsert_many(iso_record(f'many-{i}') for i in range(3, 6))
+        self.assertEqual(batch.call_count, 3)
+        self.assertEqual(self.count(items, 'many-'), 6)
+
+    def test_batch_written_in_one_transaction(self):
+        items = self.backend.ItemBackend(self.database)
+        items.upsert_many([iso_record('many-0')])
+        with mock.patch.object(
+                items, '_set_digests', side_effect=ValueError('digest')):
+            with self.assertRaises(ValueError):
+                items.upsert_many([
+                    iso_record('many-0').replace(b'.SAFE<', b'.SAFE updated<'),
+                    iso_record('many-1'),
+                ])
+        # neither the insert nor the update were committed
+        self.assertEqual(self.count(items, 'many-'), 1)
+        self.assertEqual(
+            list(items._get_record_digests(['many-0', 'many-1'])),
+            ['many-0'])
+
+
+class DeregisterManyTest(RepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.items = self.backend.ItemBackend(self.database)
+        self.items.upsert_many(iso_record(f'dereg-{i}') for i in range(6))
+        self.items.upsert_many([iso_record('dereg-6.SAFE')])
+        self.items.repo.session.execute(
+            "UPDATE records SET parentidentifier = 'collection' "
+            "WHERE identifier IN ('dereg-0', 'dereg-1', 'dereg-2', "
+            "'dereg-3')")
+        self.items.repo.session.execute(
+            "UPDATE records SET time_begin = '2019-12-31T00:00:00' "
+            "WHERE identifier = 'dereg-0'")
+
+    def test_by_selector(self):
+        progress = []
+        with mock.patch.object(
+                self.items, '_delete_identifiers',
+                wraps=self.items._delete_identifiers) as delete:
+            deleted = self.items.deregister_many(
+                parent_identifier='collection', start='2020-01-01',
+                chunk_size=2,
+                progress=lambda *counts: progress.append(counts))
+        self.assertEqual(deleted, 3)
+        # a transaction per chunk
+        self.assertEqual(delete.call_count, 2)
+        self.assertEqual(progress, [(2, 2), (3, 3)])
+        self.assertEqual(self.count(self.items, 'dereg-'), 4)
+        self.assertEqual(self.items.deregister_many(end='2020-01-01'), 1)
+        self.assertFalse(self.items._query_ids(['dereg-0']))
+
+    def test_by_identifiers(self):
+        # falls back to the .SAFE identifiers like deregister_identifier
+        deleted = self.items.deregister_many(
+            iter(['dereg-4', 'dereg-6', 'missing']), chunk_size=2)
+        self.assertEqual(deleted, 2)
+        self.assertEqual(self.count(self.items, 'dereg-'), 5)
+        self.assertFalse(self.items._query_ids(['dereg-6.SAFE']))
+
+    def test_selection_required(self):
+        with self.assertRaises(ValueError):
+            self.items.deregister_many()
+        with self.assertRaises(ValueError):
+            self.items.deregister_many(['dereg-0'], 'collection')
+
+
+class XMLBackendTest(RepositoryTestCase):
+    def test_malformed_dump(self):
+        records = b''.join(
+            iso_record(f'dump-{i}').split(b'?>', 1)[1] for i in range(5))
+        with open(os.path.join(self.tmpdir, 'dump.xml'), 'wb') as f:
+            f.write(
+                b'<csw:GetRecordsResponse '
+                b'xmlns:csw="http://www.opengis.net/cat/csw/2.0.2">'
+                b'<csw:SearchResults>' + records + b'<broken>'
+                b'</csw:SearchResults>')
+        xml = self.backend.XMLBackend(
+            self.database, batch_size=10, flush_interval=0)
+        item = {'url': 'dump.xml'}
+
+        with mock.patch.object(
+                xml, '_parse_and_upsert_metadata') as parse_and_upsert:
+            with self.assertRaises(etree.XMLSyntaxError):
+                xml.register(DirectorySource(self.tmpdir), item, False)
+        # not handed to pycsw as a whole
+        parse_and_upsert.assert_not_called()
+        # the records written before the error are tracked
+        self.assertEqual(self.count(xml, 'dump-'), 5)
+        self.assertTrue(xml.exists(None, item))
+        xml.deregister_many(['dump-0'])
+        self.assertFalse(xml.exists(None, item))
+
+
+class NativeUpsertTest(RepositoryTestCase):
+    def test_inserted_and_updated_counts(self):
+        items = self.backend.ItemBackend(self.database)
+        records = [
+            items._parse_metadata(iso_record(f'upsert-{i}'))
+            for i in range(3)
+        ]
+        items._take_digests(records)
+        items.upsert_many([iso_record('upsert-0')])
+
+        with mock.patch.object(self.backend.metrics, 'written') as written:
+            self.assertTrue(items._native_upsert(records))
+        written.assert_any_call('ItemBackend', 'inserted', 2)
+        written.assert_any_call('ItemBackend', 'updated', 1)
+        self.assertEqual(self.count(items, 'upsert-'), 3)
+
+    def test_fallback_on_other_dialects(self):
+        items = self.backend.ItemBackend(self.database)
+        with mock.patch.dict(self.backend.NATIVE_UPSERT_DIALECTS, clear=True):
+            items.upsert_many([iso_record('upsert-0')])
+            items.upsert_many([
+                iso_record('upsert-0').replace(b'.SAFE<', b'.SAFE updated<'),
+                iso_record('upsert-1'),
+            ])
+        self.assertEqual(self.count(items, 'upsert-'), 2)
+        self.assertEqual(len(items._get_record_digests(
+            ['upsert-0', 'upsert-1'])), 2)
+
+    def test_concurrent_writers(self):
+        items = self.backend.ItemBackend(self.database, batch_size=5)
+        errors = []
+
+        def write():
+            try:
+                items.upsert_many(
+                    iso_record(f'upsert-{i}') for i in range(20))
+            except Exception as err:
+                errors.append(err)
+
+        # the same identifiers are written by every thread
+        threads = [threading.Thread(target=write) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.count(items, 'upsert-'), 20)
+
+
+class RecordDigestTest(RepositoryTestCase):
+    def test_digest_written_with_record(self):
+        items = self.backend.ItemBackend(self.database)
+        with mock.patch.object(
+                items, '_set_digests', side_effect=ValueError('digest')):
+            with self.assertRaises(ValueError):
+                items.upsert_many([iso_record('digest-1')])
+        # rolled back along with the digest
+        self.assertEqual(self.count(items, 'digest-'), 0)
+
+        items.upsert_many([iso_record('digest-1')])
+        self.assertEqual(
+            list(items._get_record_digests(['digest-1'])), ['digest-1'])
+        with mock.patch.object(items, '_write_records') as write_records:
+            items.upsert_many([iso_record('digest-1')])
+        write_records.assert_not_called()
+
+    def test_replace_rewrites_unchanged_record(self):
+        items = self.backend.ItemBackend(self.database)
+        items._parse_and_upsert_metadata(iso_record('digest-1'))
+        with mock.patch.object(items, '_write_records') as write_records:
+            items._parse_and_upsert_metadata(iso_record('digest-1'))
+        write_records.assert_not_called()
+
+        with mock.patch.object(
+                items, '_write_records',
+                wraps=items._write_records) as write_records:
+            items._parse_and_upsert_metadata(
+                iso_record('digest-1'), replace=True)
+            items.upsert_many([iso_record('digest-1')], replace=True)
+        self.assertEqual(write_records.call_count, 2)
+
+
+class CollectionLevelMetadataTest(RepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        resources = os.path.join(self.tmpdir, 'resources')
+        os.mkdir(resources)
+        with open(os.path.join(resources, 'clm-1.yml'), 'w') as f:
+            f.write('mcf:\n    version: 1.0\n')
+        render = mock.Mock(return_value=iso_record('clm-1').decode())
+        for name, value in [
+            ('COLLECTION_LEVEL_METADATA', resources),
+            ('list_collection_level_metadata', lambda: ('clm-1.yml',)),
+            ('render_collection_level_metadata', render),
+        ]:
+            patcher = mock.patch.object(self.backend, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.render = render
+
+    def test_renders_changed_files_only(self):
+        items = self.backend.ItemBackend(self.database)
+        items.load_collection_level_metadata()
+        self.assertEqual(self.count(items, 'clm-'), 1)
+        self.assertEqual(self.render.call_count, 1)
+
+        # unchanged, the record digest is that of the file
+        items.load_collection_level_metadata()
+        self.assertEqual(self.render.call_count, 1)
+        self.assertEqual(
+            list(items._get_record_digests(['clm-1'])), ['clm-1'])
+
+        # rendered again with a new rendering version
+        with mock.patch.object(
+                self.backend, 'COLLECTION_LEVEL_METADATA_VERSION', '2'):
+            items.load_collection_level_metadata()
+        self.assertEqual(self.render.call_count, 2)
+
+        # and when its record is gone
+        items.repo.session.execute(
+            "DELETE FROM records WHERE identifier = 'clm-1'")
+        items.load_collection_level_metadata()
+        self.assertEqual(self.render.call_count, 3)
+        self.assertEqual(self.count(items, 'clm-'), 1)
+
+
+class SourceRecordsTest(RepositoryTestCase):
+    def test_exists_source(self):
+        items = self.backend.ItemBackend(self.database)
+        url = 'https://example.org/source.xml'
+        self.assertFalse(items._exists_source(url))
+        self.assertFalse(items._exists_source(url, 'src-1'))
+
+        items.upsert_many([iso_record('src-1')])
+        self.assertTrue(items._exists_source(url, 'src-1'))
+
+        # the recorded identifiers take precedence over the fallback ones
+        items._set_source_identifiers(url, ['src-1', 'src-2'])
+        self.assertFalse(items._exists_source(url, 'src-1'))
+        items.upsert_many([iso_record('src-2')])
+        with mock.patch.object(
+                items.repo.engine, 'connect',
+                wraps=items.repo.engine.connect) as connect:
+            self.assertTrue(items._exists_source(url, 'src-1'))
+        connect.assert_called_once()
+
+    def test_harvested_catalogue_is_registered_again(self):
+        item = {'url': 'https://example.org/csw'}
+        catalogues = self.backend.CatalogueBackend(self.database)
+        with mock.patch.object(catalogues, '_exists_source',
+                               return_value=True):
+            self.assertTrue(catalogues.exists(None, item))
+            self.assertFalse(
+                catalogues.exists(None, dict(item, harvest=True)))
+            catalogues.harvest = True
+            self.assertFalse(catalogues.exists(None, item))
+
+
+class ImportTimeTest(unittest.TestCase):
+    def import_module(self, module):
+        """imports a module in a fresh interpreter with -X importtime"""
+        script = (
+            'import json, sys\n'
+            f'import {module}\n'
+            f'print(json.dumps([m for m in {LAZY_MODULES!r} '
+            'if m in sys.modules]))\n'
+        )
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [os.path.dirname(THISDIR), env.get('PYTHONPATH')]))
+        return subprocess.run(
+            [sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', script],
+            capture_output=True, text=True, env=env
+        )
+
+    def test_metadata_import(self):
+        # the converters import their dependencies, unlike the module
+        result = self.import_module('registrar_pycsw.metadata')
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(json.loads(result.stdout), [])
+
+    def test_item_path_import(self):
+        result = self.import_module('registrar_pycsw.backend')
+        if result.returncode != 0:
+            # pycsw and the registrar come with the registrar image
+            self.skipTest(f'registrar_pycsw.backend cannot be imported: '
+                          f'{result.stderr.strip().splitlines()[-1]}')
+
+        self.assertEqual(json.loads(result.stdout), [])
+        cumulative = [
+            int(line.split('|')[1])
+            for line in result.stderr.splitlines()
+            if line.rstrip().endswith('| registrar_pycsw.backend')
+        ]
+        self.assertLess(cumulative[0] / 1000, IMPORT_BUDGET_MS)
+
 
 if __name__ == '__main__':
     unittest.main()